@@ -0,0 +1,8 @@
+
+def kff(n, x, alpha, theta, k):
+    from numpy import exp
+
+    for i in range(0, n):
+        for j in range(0, n):
+            k[i,j] = alpha**2*theta*exp(-0.5*(x[i] - x[j])**2) + alpha*theta*(-1.0*x[i] + 1.0*x[j])*exp(-0.5*(x[i] - x[j])**2) + alpha*theta*(1.0*x[i] - 1.0*x[j])*exp(-0.5*(x[i] - x[j])**2) + theta*(-1.0*x[i] + 1.0*x[j])*(1.0*x[i] - 1.0*x[j])*exp(-0.5*(x[i] - x[j])**2) + 1.0*theta*exp(-0.5*(x[i] - x[j])**2)
+    return k
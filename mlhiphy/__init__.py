@@ -1,4 +1,19 @@
 __version__ = "0.1"
 
-from mlhiphy import calculus
-from mlhiphy import kernels
+# submodules are imported on first access (PEP 562), so that workers which
+# only evaluate the likelihood do not pay for sympy at startup
+import importlib
+
+__all__ = ['calculus', 'kernels', 'gaussian', 'linalg', 'models', 'optimize',
+           'trace', 'sweep', 'dataset', 'simulate',
+           'store', 'utilities']
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('mlhiphy.' + name)
+        globals()[name] = module
+        return module
+    raise AttributeError("module 'mlhiphy' has no attribute {!r}".format(name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -2,48 +2,22 @@
 
 # TODO add action of diff operators on sympy known functions
 
-import numpy as np
-from itertools import groupby
 from collections import OrderedDict
+from functools import lru_cache
 
-from sympy.core.sympify import sympify
-from sympy.simplify.simplify import simplify
-from sympy import Symbol
-from sympy import Lambda
-from sympy import Function
-from sympy import bspline_basis
-from sympy import lambdify
-from sympy import cos
-from sympy import sin
-from sympy import Rational
-from sympy import diff
-from sympy import Matrix
-from sympy import latex
-from sympy import Integral
-from sympy import I as sympy_I
+# only the sympy names used below, the module is imported by every worker
 from sympy.core import Basic
 from sympy.core.singleton import S
-from sympy.simplify.simplify import nsimplify
-from sympy.utilities.lambdify import implemented_function
-from sympy.matrices.dense import MutableDenseMatrix
-from sympy import Mul, Add
-from sympy import Tuple
-from sympy import postorder_traversal
-from sympy import preorder_traversal
-
-from sympy.core.expr import Expr
+from sympy.core.numbers import Integer, Float
+from sympy.core.add import Add
+from sympy.core.mul import Mul
+from sympy.core.symbol import Symbol
+from sympy.core.function import Function
+from sympy.core.function import expand
+from sympy.core.sympify import sympify
 from sympy.core.containers import Tuple
-from sympy import Integer, Float
-
-from sympy import symbols, Tuple, Symbol, sympify, expand
-from sympy import Add, Mul
-from sympy import preorder_traversal, Expr
-from sympy import simplify
-from sympy import S
-from sympy.core.compatibility import is_sequence
-from sympy import Basic
-from sympy import Function
-from sympy import Indexed
+from sympy.tensor.indexed import Indexed
+from sympy.utilities.iterables import is_sequence
 
 #try:
 #    from pyccel.ast.core import IndexedElement as Indexed
@@ -165,6 +139,7 @@ class DifferentialOperator(LinearOperator):
 
     """
     coordinate = None
+    grad_index = None
 
     @classmethod
     def eval(cls, *_args):
@@ -187,14 +162,14 @@ class DifferentialOperator(LinearOperator):
             V = S.One
             if vectors:
                 if len(vectors) == 1:
-                    V = cls(Mul(vectors[0]), evaluate=False)
+                    V = cls._canonical(vectors[0])
 
                 elif len(vectors) == 2:
                     a = vectors[0]
                     b = vectors[1]
 
-                    fa = cls(a, evaluate=False)
-                    fb = cls(b, evaluate=False)
+                    fa = cls._canonical(a)
+                    fb = cls._canonical(b)
 
                     V = a * fb + fa * b
 
@@ -203,51 +178,150 @@ class DifferentialOperator(LinearOperator):
 
             return Mul(c, V)
 
+        return cls._canonical(expr)
+
+    @classmethod
+    def _canonical(cls, expr):
+        """
+        applies the operator to expr, where nested partial derivatives are
+        sorted by grad_index (the outer operator has the lowest index), so
+        that dy(dx(u)) and dx(dy(u)) are the same expression.
+        """
+        if (isinstance(expr, DifferentialOperator) and
+            _grad_order(type(expr)) < _grad_order(cls)):
+            D = type(expr)
+            return D(cls(expr.args[0]))
+
         return cls(expr, evaluate=False)
+
+def _grad_order(op):
+    # operators without grad_index come last, then negative indices
+    # (counted from the last coordinate)
+    if op.grad_index is None:
+        return (2, 0)
+    if op.grad_index < 0:
+        return (1, op.grad_index)
+    return (0, op.grad_index)
 # ...
 
 # ...
-class dx(DifferentialOperator):
+class PartialDerivative(DifferentialOperator):
+    """
+    Partial derivative along the coordinate grad_index. A negative index is
+    counted from the last coordinate, e.g. dt is the derivative along the
+    last coordinate, whatever the dimension.
+    """
+    pass
+
+class dx(PartialDerivative):
     coordinate = 'x'
     grad_index = 0 # index in grad
     pass
 
-class dy(DifferentialOperator):
+class dy(PartialDerivative):
     coordinate = 'y'
     grad_index = 1 # index in grad
     pass
 
-class dz(DifferentialOperator):
+class dz(PartialDerivative):
     coordinate = 'z'
     grad_index = 2 # index in grad
     pass
 
-class dt(DifferentialOperator):
+class dt(PartialDerivative):
     coordinate = 't'
-    grad_index = None # index in grad
+    grad_index = -1 # time is the last coordinate
     pass
 
 _partial_derivatives = (dx, dy, dz, dt)
+
+_partial_derivatives_registery = {0: dx, 1: dy, 2: dz}
+
+def partial_derivative(index):
+    """
+    returns the partial derivative along the coordinate index, for any
+    number of coordinates: dx, dy, dz for the first three ones, a new
+    operator d3, d4, ... otherwise.
+
+    Examples
+
+    >>> dw = partial_derivative(3)
+    >>> expr = dx(u) + dw(dw(u))
+    """
+    if index < 0:
+        raise ValueError('expecting a non negative index')
+
+    if not(index in _partial_derivatives_registery):
+        name = 'd{}'.format(index)
+        op = type(name, (PartialDerivative,), {'coordinate': 'x{}'.format(index),
+                                               'grad_index': index,
+                                               '__module__': __name__})
+        # expressions using op can then be pickled
+        globals()[name] = op
+        _partial_derivatives_registery[index] = op
+
+    return _partial_derivatives_registery[index]
+
+def coordinate_index(op, dim):
+    """returns the index of the coordinate of the partial derivative op, in
+    dimension dim."""
+    i = op.grad_index
+    if i is None:
+        raise ValueError('{} has no coordinate'.format(op.__name__))
+
+    if i < 0:
+        i += dim
+
+    if not(0 <= i < dim):
+        raise ValueError('{} is not defined in dimension {}'.format(op.__name__, dim))
+    return i
 # ...
 
 # ...
-def find_partial_derivatives(expr):
+@lru_cache(maxsize=1024)
+def _partial_derivatives_by_order(expr):
+    d = OrderedDict()
+
+    # preorder traversal, with an explicit stack
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+
+        if isinstance(e, (Add, Mul, tuple)):
+            args = e.args if isinstance(e, (Add, Mul)) else e
+            stack.extend(reversed(args))
+
+        elif isinstance(e, PartialDerivative):
+            n = get_number_derivatives(e)
+            if not(n in d):
+                d[n] = OrderedDict()
+            d[n][e] = None
+
+    # the cached result is immutable, callers get their own dictionary
+    return tuple((n, tuple(d[n])) for n in sorted(d, reverse=True))
+
+def partial_derivatives_by_order(expr):
     """
-    returns all partial derivative expressions
+    returns the partial derivative expressions of expr, without duplicates,
+    in an OrderedDict whose keys are the number of derivatives, sorted from
+    high to low. The result is computed in one traversal and cached.
     """
-    if isinstance(expr, (Add, Mul)):
-        return find_partial_derivatives(expr.args)
-
-    elif isinstance(expr, (list, tuple)):
-        args = []
-        for a in expr:
-            args += find_partial_derivatives(a)
-        return args
+    return OrderedDict(_partial_derivatives_by_order(_freeze(expr)))
 
-    elif isinstance(expr, _partial_derivatives):
-        return [expr]
+def _freeze(expr):
+    # lists are not hashable, they are converted to tuples to be cached
+    if isinstance(expr, (list, tuple)):
+        return tuple(_freeze(a) for a in expr)
+    return expr
+# ...
 
-    return []
+# ...
+def find_partial_derivatives(expr):
+    """
+    returns all partial derivative expressions
+    """
+    d = partial_derivatives_by_order(expr)
+    return [a for n in d for a in d[n]]
 # ...
 
 # ...
@@ -258,57 +332,182 @@ def get_number_derivatives(expr):
     form d(a) where a is a single atom.
     """
     n = 0
-    if isinstance(expr, _partial_derivatives):
+    while isinstance(expr, PartialDerivative):
         assert(len(expr.args) == 1)
 
-        n += 1 + get_number_derivatives(expr.args[0])
+        n += 1
+        expr = expr.args[0]
     return n
 # ...
 
 # ...
 def sort_partial_derivatives(expr):
-    """returns the partial derivatives of an expression, sorted.
-    """
-    ls = []
-
-    args = find_partial_derivatives(expr)
-
-#    # ... Note
-#    #     group by is given the wrong answer for expr =mu * u + dx(u) + dx(dx(u))
-#    for key, group in groupby(args, lambda x: get_number_derivatives(x)):
-#        g = [a for a in group]
-#        for a in group:
-#            ls.append(a)
-#    # ...
-
-    # ...
-    d = {}
-    for a in args:
-        n = get_number_derivatives(a)
-        if n in d.keys():
-            d[n] += [a]
+    """returns the partial derivatives of an expression, sorted from high to
+    low order.
+    """
+    return find_partial_derivatives(expr)
+# ...
+
+# ...
+def _multi_index(expr, u, dim):
+    """returns the multi-index of expr = d(...(u)), or None if expr is not a
+    partial derivative of u."""
+    index = [0] * dim
+    ops = {}
+    while isinstance(expr, PartialDerivative):
+        op = type(expr)
+        i = coordinate_index(op, dim)
+        if ops.setdefault(i, op) is not op:
+            raise ValueError('{} and {} are both along the coordinate {} in '
+                             'dimension {}'.format(ops[i].__name__,
+                                                   op.__name__, i, dim))
+
+        index[i] += 1
+        expr = expr.args[0]
+
+    if not(expr == u):
+        return None
+    return tuple(index)
+
+def multi_index_form(expr, u, dim):
+    """
+    returns the linear differential operator expr, applied to the unknown u,
+    as an OrderedDict that maps a multi-index (the number of derivatives along
+    every coordinate) to its coefficient.
+
+    Examples
+
+    >>> multi_index_form(mu * u + dx(dy(u)) + 2 * dy(dy(u)), u, 2)
+
+    maps (0, 0) to mu, (1, 1) to 1 and (0, 2) to 2.
+    """
+    d = OrderedDict()
+    for term in Add.make_args(expand(expr)):
+        index = None
+        coeffs = []
+        for a in Mul.make_args(term):
+            i = _multi_index(a, u, dim)
+            if i is None:
+                coeffs.append(a)
+            elif index is None:
+                index = i
+            else:
+                raise ValueError('expecting a linear operator, given {}'.format(term))
+
+        c = Mul(*coeffs)
+        if index is None or u in c.free_symbols:
+            raise ValueError('expecting a linear operator in {}, '
+                             'given {}'.format(u, term))
+
+        d[index] = d.get(index, S.Zero) + c
+
+    return OrderedDict((i, c) for i, c in d.items() if not(c == 0))
+
+def _factors(term, u):
+    """splits term into a coefficient and the list of the factors that are u
+    or a partial derivative of u (repeated according to their power)."""
+    coeffs = []
+    factors = []
+    for a in Mul.make_args(term):
+        b, e = a.as_base_exp()
+        if _is_derivative_of(b, u):
+            if not(e.is_Integer and e > 0):
+                raise ValueError('expecting a polynomial in {}, given {}'.format(u, term))
+            factors += [b] * int(e)
+
+        elif u in a.free_symbols:
+            raise ValueError('expecting a polynomial in {}, given {}'.format(u, term))
+
         else:
-            d[n] = [a]
-    # ...
-
-    # ...
-    if not d:
-        return []
-    # ...
-
-    # ... sort keys from high to low
-    keys = np.asarray(list(d.keys()))
-    keys.sort()
-    keys = keys[::-1]
-    # ...
-
-    # ... construct a list of partial derivatives from high to low order
-    ls = []
-    for k in keys:
-        ls += d[k]
-    # ...
-
-    return ls
+            coeffs.append(a)
+    return Mul(*coeffs), factors
+
+def _is_derivative_of(expr, u):
+    """returns True if expr is u or d(...(u)) for partial derivatives d."""
+    while isinstance(expr, PartialDerivative):
+        expr = expr.args[0]
+    return expr == u
+
+def field_derivative(F, expr):
+    """
+    returns the Field standing for the partial derivatives of expr = d(...(u))
+    applied to the Field F, named after their coordinates, e.g. F_xt for
+    dx(dt(u)). Its values are given with the data, as those of F.
+    """
+    coordinates = []
+    while isinstance(expr, PartialDerivative):
+        coordinates.append(type(expr).coordinate)
+        expr = expr.args[0]
+
+    if not coordinates:
+        return F
+    return Field('{}_{}'.format(F.name, ''.join(coordinates)))
+
+def linearize(expr, u, around):
+    """
+    returns a linear approximation of the polynomial operator expr in u.
+
+    In every nonlinear term, the factor with the highest number of
+    derivatives is kept and the other ones are frozen at the state around,
+    e.g. u * dx(u) becomes around * dx(u), as in a Picard iteration.
+
+    around: number, Constant or Field
+        a constant state (e.g. the mean of the data, the derivatives of a
+        constant state vanish) or a Field, e.g. the previous time step, whose
+        values are given with the data. A frozen derivative of a Field F is
+        the Field given by field_derivative, e.g. F_x for dx(u).
+    """
+    around = sympify(around)
+
+    terms = []
+    for term in Add.make_args(expand(expr)):
+        c, factors = _factors(term, u)
+        if len(factors) < 2:
+            terms.append(term)
+            continue
+
+        factors = sorted(factors, key=get_number_derivatives)
+        kept = factors[-1]
+
+        frozen = S.One
+        for f in factors[:-1]:
+            if f == u:
+                frozen *= around
+            elif isinstance(around, Field):
+                frozen *= field_derivative(around, f)
+            else:
+                frozen = S.Zero
+
+        terms.append(c * frozen * kept)
+
+    return Add(*terms)
+
+def multi_index_system(expr, unknowns, dim):
+    """
+    returns the linear differential operator expr, applied to several
+    unknowns, as an OrderedDict that maps every unknown to the multi-index
+    form of the terms acting on it. Every term must contain exactly one of
+    the unknowns.
+
+    Examples
+
+    >>> multi_index_system(dx(u) + dy(v), [u, v], 2)
+
+    maps u to {(1, 0): 1} and v to {(0, 1): 1}.
+    """
+    forms = OrderedDict((u, OrderedDict()) for u in unknowns)
+    for term in Add.make_args(expand(expr)):
+        us = [u for u in unknowns if u in term.free_symbols]
+        if not(len(us) == 1):
+            raise ValueError('expecting a linear operator, given {}'.format(term))
+
+        form = forms[us[0]]
+        for i, c in multi_index_form(term, us[0], dim).items():
+            form[i] = form.get(i, S.Zero) + c
+
+    for u in unknowns:
+        forms[u] = OrderedDict((i, c) for i, c in forms[u].items() if not(c == 0))
+    return forms
 # ...
 
 # ...
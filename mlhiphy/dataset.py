@@ -0,0 +1,315 @@
+# coding: utf-8
+
+# On disk format of a dataset: a directory with one .npy file per array and a
+# small JSON header
+#
+#     heat/
+#         header.json
+#         x_u.npy
+#         y_u.npy
+#         ...
+#
+# The header describes the arrays (file, shape, dtype), the names of the
+# coordinates and of the outputs, the operator and other attributes. Arrays are
+# opened with memory-mapping, so that many processes can read the same data
+# without a copy. The header is written last, a directory without a header is
+# an incomplete dataset.
+
+import os
+import json
+import pickle
+import numpy as np
+
+from mlhiphy.utilities import to_json
+from mlhiphy.utilities import write_json
+
+
+_header = 'header.json'
+_version = 1
+
+# ...
+class Dataset(object):
+    """
+    A dataset opened with open_dataset. Arrays are loaded on first access,
+    memory-mapped (read only) by default.
+
+    Examples
+
+    >>> data = open_dataset('heat')
+    >>> model.set_data(data['x_u'], data['y_u'], data['x_f'], data['y_f'])
+    """
+
+    def __init__(self, dirname, header, mmap_mode='r'):
+        self._dirname = dirname
+        self._header = header
+        self._mmap_mode = mmap_mode
+        self._arrays = {}
+
+    @property
+    def dirname(self):
+        return self._dirname
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def coordinates(self):
+        """names of the coordinates, e.g. ['x', 't']."""
+        return self._header['coordinates']
+
+    @property
+    def outputs(self):
+        """names of the observed outputs, e.g. ['u', 'f']."""
+        return self._header['outputs']
+
+    @property
+    def operator(self):
+        """metadata of the operator, e.g. the srepr of its expression."""
+        return self._header['operator']
+
+    @property
+    def attrs(self):
+        return self._header['attrs']
+
+    def keys(self):
+        return list(self._header['arrays'].keys())
+
+    def __contains__(self, name):
+        return name in self._header['arrays']
+
+    def __len__(self):
+        return len(self._header['arrays'])
+
+    def __getitem__(self, name):
+        if not(name in self._arrays):
+            if not(name in self):
+                raise KeyError(name)
+
+            info = self._header['arrays'][name]
+            filename = os.path.join(self._dirname, info['file'])
+            self._arrays[name] = np.load(filename, mmap_mode=self._mmap_mode,
+                                         allow_pickle=False)
+        return self._arrays[name]
+
+    def as_dict(self):
+        return {name: self[name] for name in self.keys()}
+
+    def __getstate__(self):
+        # memory maps are opened again by every process
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def __repr__(self):
+        return 'Dataset({!r}, arrays={})'.format(self._dirname, self.keys())
+# ...
+
+# ...
+def save_dataset(dirname, arrays, coordinates=None, outputs=None,
+                 operator=None, attrs=None):
+    """
+    writes a dataset in the directory dirname.
+
+    arrays: dict
+        the arrays, e.g. {'x_u': x_u, 'y_u': y_u, 'x_f': x_f, 'y_f': y_f}.
+        The names are used as file names.
+    coordinates: list
+        names of the coordinates, e.g. ['x', 't']
+    outputs: list
+        names of the observed outputs, e.g. ['u', 'f']
+    operator: dict
+        metadata of the operator, e.g. {'expr': srepr(expr), 'tau': 0.02}
+    attrs: dict
+        other JSON serializable attributes
+
+    returns the opened Dataset.
+    """
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    # an existing dataset is invalid until its new header is written
+    header = os.path.join(dirname, _header)
+    if os.path.exists(header):
+        os.remove(header)
+
+    info = {}
+    for name, value in arrays.items():
+        value = np.ascontiguousarray(value)
+        if value.dtype == object:
+            raise TypeError('cannot store the object array {}'.format(name))
+
+        filename = '{}.npy'.format(name)
+        tmp = os.path.join(dirname, filename + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, value, allow_pickle=False)
+        os.replace(tmp, os.path.join(dirname, filename))
+
+        info[name] = {'file': filename,
+                      'shape': list(value.shape),
+                      'dtype': value.dtype.str}
+
+    write_header(dirname, info, coordinates=coordinates, outputs=outputs,
+                 operator=operator, attrs=attrs)
+
+    return open_dataset(dirname)
+
+def write_header(dirname, arrays, coordinates=None, outputs=None,
+                 operator=None, attrs=None):
+    """
+    writes the header of a dataset whose .npy files were written in dirname
+    by other means, e.g. filled by chunks with numpy.lib.format.open_memmap.
+
+    arrays: dict
+        maps the name of every array to its file name, or to a dictionary
+        with the keys 'file', 'shape' and 'dtype'
+    """
+    info = {}
+    for name, value in arrays.items():
+        if isinstance(value, str):
+            a = np.load(os.path.join(dirname, value), mmap_mode='r')
+            value = {'file': value, 'shape': list(a.shape),
+                     'dtype': a.dtype.str}
+        info[name] = value
+
+    write_json(os.path.join(dirname, _header),
+                {'version': _version,
+                 'arrays': info,
+                 'coordinates': list(coordinates or []),
+                 'outputs': list(outputs or []),
+                 'operator': to_json(operator or {}),
+                 'attrs': to_json(attrs or {})})
+
+def open_dataset(dirname, mmap_mode='r'):
+    """
+    opens the dataset stored in dirname. The arrays are memory-mapped with
+    the given mode ('r' by default, None loads them in memory).
+    """
+    filename = os.path.join(dirname, _header)
+    if not os.path.exists(filename):
+        raise IOError('no dataset in {}'.format(dirname))
+
+    with open(filename, 'r') as f:
+        header = json.load(f)
+
+    if header.get('version', 0) > _version:
+        raise ValueError('unsupported dataset version {}'.format(header['version']))
+
+    return Dataset(dirname, header, mmap_mode=mmap_mode)
+# ...
+
+# ...
+class ChunkReader(object):
+    """
+    Reads the observations of a dataset by chunks of at most chunk_size
+    points of u and of f, without loading the arrays in memory. It can be
+    iterated several times, e.g. once for every evaluation of the nlml.
+
+    Every chunk is (x_u, y_u, x_f, y_f), followed by a dictionary with the
+    values of the Fields at x_f if fields is given. When one of u and f has
+    less points, its last chunks are empty.
+
+    source: Dataset, str or dict
+        a dataset, the directory of a dataset or a dictionary of arrays
+    names: tuple
+        names of the arrays x_u, y_u, x_f and y_f
+    fields: dict
+        maps the name of a Field to the name of the array of its values at x_f
+
+    Examples
+
+    >>> chunks = ChunkReader('heat', chunk_size=1000)
+    >>> model.nlml_chunks(values, chunks)
+    """
+
+    def __init__(self, source, chunk_size=1024,
+                 names=('x_u', 'y_u', 'x_f', 'y_f'), fields=None):
+        if isinstance(source, str):
+            source = open_dataset(source)
+
+        if chunk_size < 1:
+            raise ValueError('expecting a positive chunk size')
+
+        self._source = source
+        self._chunk_size = chunk_size
+        self._names = tuple(names)
+        self._fields = dict(fields or {})
+
+        x_u, y_u, x_f, y_f = [source[i] for i in self._names]
+        if not(len(x_u) == len(y_u)) or not(len(x_f) == len(y_f)):
+            raise ValueError('inconsistent number of points and values')
+        self._n_u = len(x_u)
+        self._n_f = len(x_f)
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def shape(self):
+        """number of points of u and f."""
+        return (self._n_u, self._n_f)
+
+    def __len__(self):
+        n = max(self._n_u, self._n_f)
+        return (n + self._chunk_size - 1) // self._chunk_size
+
+    def __iter__(self):
+        x_u, y_u, x_f, y_f = [self._source[i] for i in self._names]
+        fields = {k: self._source[v] for k, v in self._fields.items()}
+
+        for k in range(0, len(self)):
+            u = slice(min(k*self._chunk_size, self._n_u),
+                      min((k + 1)*self._chunk_size, self._n_u))
+            f = slice(min(k*self._chunk_size, self._n_f),
+                      min((k + 1)*self._chunk_size, self._n_f))
+
+            # only the chunk is read from disk
+            chunk = (np.array(x_u[u]), np.array(y_u[u]),
+                     np.array(x_f[f]), np.array(y_f[f]))
+            if self._fields:
+                chunk += ({k: np.array(v[f]) for k, v in fields.items()},)
+            yield chunk
+# ...
+
+# ...
+def _split(data, prefix, arrays, attrs):
+    for key, value in data.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            # e.g. an OptimizeResult
+            _split(value, name + '.', arrays, attrs)
+
+        elif isinstance(value, np.ndarray) and not(value.dtype == object):
+            if value.ndim == 0:
+                attrs[name] = value.item()
+            else:
+                arrays[name] = value
+
+        else:
+            attrs[name] = to_json(value)
+
+def convert_pickle(filename, dirname, **kwargs):
+    """
+    converts a pickled dictionary of arrays (e.g. heat_equation/heat_data.pkl)
+    into a dataset in dirname.
+
+    Arrays are stored as arrays, nested dictionaries (e.g. the OptimizeResult
+    stored as 'min') are flattened with dotted names and the other values are
+    stored as attributes. Other arguments are passed to save_dataset.
+    """
+    with open(filename, 'rb') as f:
+        data = pickle.load(f)
+
+    if not isinstance(data, dict):
+        raise TypeError('expecting a pickled dictionary, given {}'.format(type(data)))
+
+    arrays = {}
+    attrs = {}
+    _split(data, '', arrays, attrs)
+
+    attrs.update(kwargs.pop('attrs', None) or {})
+    attrs['source'] = os.path.basename(filename)
+
+    return save_dataset(dirname, arrays, attrs=attrs, **kwargs)
+# ...
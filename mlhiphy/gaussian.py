@@ -0,0 +1,504 @@
+# coding: utf-8
+
+# Closed form derivatives of the Gaussian kernel
+#
+#     kuu(xi, xj) = theta * exp(- sum_k l_k (xi_k - xj_k)^2)
+#
+# Along every coordinate, with r = xi - xj, the n-th derivative of exp(-l r^2)
+# is P_n(r) exp(-l r^2) where
+#
+#     P_n(r) = (-1)^n l^(n/2) H_n(sqrt(l) r)
+#
+# and H_n is the (physicists') Hermite polynomial. Since d/dxj = - d/dxi, the
+# mixed derivative d^a/dxi^a d^b/dxj^b is (-1)^b P_{a+b}(r) exp(-l r^2). The
+# kernel blocks of a linear operator are then assembled from its multi-index
+# form, without any symbolic computation.
+#
+# The derivative with respect to l of P_n(r) exp(-l r^2) is
+# (dP_n/dl - r^2 P_n(r)) exp(-l r^2), so that the gradient of the nlml with
+# respect to the hyperparameters is in closed form too. OperatorGP uses
+# GaussianOperator when its kuu is a Gaussian (see kernels.gaussian_operator).
+
+import numpy as np
+from functools import lru_cache
+from collections import OrderedDict
+
+
+# ...
+@lru_cache(maxsize=64)
+def _hermite_table(n):
+    # python integers, the coefficients overflow int64 from H_26
+    H = np.zeros((n + 1, n + 1), dtype=object)
+    H[:] = 0
+    H[0,0] = 1
+    if n > 0:
+        H[1,1] = 2
+    # H_{k+1} = 2 z H_k - 2 k H_{k-1}
+    for k in range(1, n):
+        H[k+1,1:] = 2 * H[k,:-1]
+        H[k+1] -= 2 * k * H[k-1]
+    H.setflags(write=False)
+    return H
+
+def hermite_table(n):
+    """
+    returns the coefficients of the Hermite polynomials H_0, ..., H_n, as an
+    array of (python) integers of shape (n+1, n+1) where the entry [k, m] is
+    the coefficient of z^m in H_k. The table is computed once.
+    """
+    if n < 0:
+        raise ValueError('expecting a non negative order')
+    return _hermite_table(n)
+
+def gaussian_polynomial(n, l):
+    """
+    returns the coefficients c_m of P_n(r) = sum_m c_m r^m, where
+    d^n/dr^n exp(-l r^2) = P_n(r) exp(-l r^2).
+    """
+    h = np.array([float(i) for i in hermite_table(n)[n]])
+    m = np.arange(0, n + 1)
+    # h_m vanishes unless n + m is even, the powers of l are integers
+    return (-1.)**n * h * float(l)**((n + m) // 2)
+
+def gaussian_polynomial_dl(n, l):
+    """
+    returns the coefficients of the derivative of P_n(r) with respect to l,
+    see gaussian_polynomial.
+    """
+    h = np.array([float(i) for i in hermite_table(n)[n]])
+    q = (np.arange(0, n + 1) + n) // 2
+    # the constant term of P_0 does not depend on l
+    dl = np.array([k * float(l)**(k - 1) if k > 0 else 0. for k in q])
+    return (-1.)**n * h * dl
+# ...
+
+# ...
+def _as_points(x):
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:,None]
+    if not(x.ndim == 2):
+        raise ValueError('expecting an array of shape (n, dim)')
+    return x
+
+class GaussianDerivatives(object):
+    """
+    Numerical table of the partial derivatives of the Gaussian kernel
+    theta * exp(- sum_k l_k (xi_k - xj_k)^2) between the points xi and xj,
+    the counterpart of kernels.KernelDerivatives.
+
+    The differences, the exponential and the polynomial factor of every
+    coordinate and order are computed once and shared by all the entries.
+
+    xi, xj: ndarray
+        points, of shape (n1, dim) and (n2, dim), or (n,) in 1D
+    l: float or sequence
+        inverse squared length scale, one value per coordinate or a single one
+    theta: float
+        variance
+
+    Examples
+
+    >>> D = GaussianDerivatives(xi, xj, l=[1., 0.5])
+    >>> D[(1, 0), (0, 2)]   # d/dxi d^2/dyj^2 kuu, of shape (n1, n2)
+    >>> D.derivative(((1, 0), (0, 2)), 1)   # the same entry, derived by l_1
+    """
+
+    def __init__(self, xi, xj, l=1., theta=1.):
+        xi = _as_points(xi)
+        xj = _as_points(xj)
+        if not(xi.shape[1] == xj.shape[1]):
+            raise ValueError('xi and xj have different dimensions')
+
+        dim = xi.shape[1]
+        l = np.asarray(l, dtype=float) * np.ones(dim)
+
+        self._l = l
+        self._theta = theta
+        self._r = [xi[:,k][:,None] - xj[:,k][None,:] for k in range(0, dim)]
+        self._exp = np.exp(-sum(l[k] * r**2 for k, r in enumerate(self._r)))
+        self._kernel = theta * self._exp
+        self._factors = {}
+        self._table = {}
+
+    @property
+    def dim(self):
+        return len(self._r)
+
+    @property
+    def shape(self):
+        return self._kernel.shape
+
+    def __len__(self):
+        return len(self._table)
+
+    def _factor(self, k, n):
+        """returns P_n(r_k), for the coordinate k."""
+        if not((k, n) in self._factors):
+            c = gaussian_polynomial(n, self._l[k])
+            r = self._r[k]
+            # Horner scheme
+            P = np.full(r.shape, c[n])
+            for m in range(n - 1, -1, -1):
+                P = P * r + c[m]
+            self._factors[k, n] = P
+        return self._factors[k, n]
+
+    def _factor_dl(self, k, n):
+        """returns the derivative of P_n(r_k) exp(-l_k r_k^2) with respect to
+        l_k, divided by exp(-l_k r_k^2)."""
+        if not(('dl', k, n) in self._factors):
+            c = gaussian_polynomial_dl(n, self._l[k])
+            r = self._r[k]
+            P = np.full(r.shape, c[n])
+            for m in range(n - 1, -1, -1):
+                P = P * r + c[m]
+            if n > 0:
+                P = P - r**2 * self._factor(k, n)
+            else:
+                P = P - r**2
+            self._factors['dl', k, n] = P
+        return self._factors['dl', k, n]
+
+    def __getitem__(self, key):
+        return self._entry(key, None)
+
+    def derivative(self, key, k=None):
+        """
+        returns the derivative of the entry key with respect to l_k, or with
+        respect to theta if k is None.
+        """
+        return self._entry(key, 'theta' if k is None else k)
+
+    def _entry(self, key, wrt):
+        a, b = key
+        a = tuple(a)
+        b = tuple(b)
+        if (a, b, wrt) in self._table:
+            return self._table[a, b, wrt]
+
+        if not(len(a) == self.dim) or not(len(b) == self.dim):
+            raise ValueError('expecting multi-indices of length {}'.format(self.dim))
+
+        # the derivative with respect to theta is the entry with theta = 1
+        K = self._exp if wrt == 'theta' else self._kernel
+        sign = 1.
+        for k in range(0, self.dim):
+            n = a[k] + b[k]
+            if k == wrt:
+                K = K * self._factor_dl(k, n)
+            elif n > 0:
+                K = K * self._factor(k, n)
+            if b[k] % 2:
+                sign = -sign
+        if sign < 0.:
+            K = -K
+
+        self._table[a, b, wrt] = K
+        return K
+# ...
+
+# ...
+def apply_operators(D, op_i, op_j):
+    """
+    returns sum_{a, b} c_a c_b d^a_i d^b_j kuu, where op_i and op_j map a
+    multi-index to a numerical coefficient (see calculus.multi_index_form),
+    None being the identity.
+    """
+    zero = tuple([0] * D.dim)
+    if op_i is None:
+        op_i = {zero: 1.}
+    if op_j is None:
+        op_j = {zero: 1.}
+
+    K = np.zeros(D.shape)
+    for a, ca in op_i.items():
+        for b, cb in op_j.items():
+            K += float(ca) * float(cb) * D[a, b]
+    return K
+
+def gaussian_kernels(op, xi, xj, l=1., theta=1., derivatives=None):
+    """
+    returns the covariance blocks of u and f = L u for a Gaussian kuu, as a
+    dictionary with the keys 'uu', 'uf', 'fu' and 'ff' (see
+    kernels.compute_kernels), evaluated between the points xi and xj.
+
+    op: dict
+        multi-index form of L with numerical coefficients, e.g.
+        {(2, 0): -phi, (0, 1): 1.} for dt(u) - phi*dx(dx(u)) in (x, t)
+    derivatives: GaussianDerivatives
+        a table to reuse, e.g. for several operators on the same points
+    """
+    if derivatives is None:
+        derivatives = GaussianDerivatives(xi, xj, l=l, theta=theta)
+
+    D = derivatives
+    return {'uu': apply_operators(D, None, None),
+            'uf': apply_operators(D, None, op),
+            'fu': apply_operators(D, op, None),
+            'ff': apply_operators(D, op, op)}
+# ...
+
+# ...
+class Polynomial(object):
+    """
+    Sum of monomials c * prod_k v_k^e_k of n variables v_k, with integer
+    (possibly negative) exponents, e.g. a coefficient of an operator as a
+    function of the hyperparameters and the Fields.
+
+    coefficients: list
+        the numerical coefficient of every monomial
+    exponents: list
+        the exponents of the variables in every monomial
+
+    Examples
+
+    >>> p = Polynomial([-0.02], [[0, 0, 1]], 3)    # -0.02 * alpha
+    >>> p([1., 1., 0.5])
+    """
+
+    def __init__(self, coefficients, exponents, n):
+        self._coefficients = [float(c) for c in coefficients]
+        self._exponents = [tuple(int(k) for k in e) for e in exponents]
+        self._n = n
+
+        if not all(len(e) == n for e in self._exponents):
+            raise ValueError('expecting {} exponents per monomial'.format(n))
+
+    @property
+    def n_variables(self):
+        return self._n
+
+    def __len__(self):
+        return len(self._coefficients)
+
+    def __call__(self, values):
+        """evaluates the polynomial, the values may be arrays."""
+        total = 0.
+        for c, e in zip(self._coefficients, self._exponents):
+            term = c
+            for v, k in zip(values, e):
+                if k:
+                    term = term * v**k
+            total = total + term
+        return total
+
+    def diff(self, k):
+        """returns the derivative with respect to the variable k."""
+        coefficients = []
+        exponents = []
+        for c, e in zip(self._coefficients, self._exponents):
+            if e[k]:
+                d = list(e)
+                d[k] -= 1
+                coefficients.append(c * e[k])
+                exponents.append(d)
+        return Polynomial(coefficients, exponents, self._n)
+
+    def as_dict(self):
+        """returns the polynomial as a dictionary of lists, see from_dict."""
+        return {'coefficients': list(self._coefficients),
+                'exponents': [list(e) for e in self._exponents],
+                'n': self._n}
+
+    @staticmethod
+    def from_dict(d):
+        return Polynomial(d['coefficients'], d['exponents'], d['n'])
+
+# ...
+class GaussianOperator(object):
+    """
+    Covariance blocks of u and f = L u for a Gaussian kuu, and their
+    derivatives with respect to the hyperparameters, evaluated from
+    GaussianDerivatives tables. This is the numerical counterpart of the
+    kernels derived by kernels.compute_kernels, see
+    kernels.gaussian_operator.
+
+    The coefficients of the multi-index form of L are Polynomials of the
+    hyperparameters followed by the Fields, theta and every l_k are
+    Polynomials of the hyperparameters.
+
+    op: dict
+        multi-index form of L, the values are Polynomials
+    theta: Polynomial
+        variance
+    l: list
+        inverse squared length scale of every coordinate, as Polynomials
+    params: list
+        names of the hyperparameters
+    fields: list
+        names of the Fields
+
+    The tables of the last evaluated points and hyperparameters are kept, so
+    that the blocks and all their derivatives share them.
+    """
+
+    _cache_size = 4
+
+    def __init__(self, op, theta, l, params, fields=()):
+        self._op = OrderedDict((tuple(a), c) for a, c in op.items())
+        self._theta = theta
+        self._l = list(l)
+        self._params = tuple(params)
+        self._fields = tuple(fields)
+
+        n = len(self._params) + len(self._fields)
+        if not all(c.n_variables == n for c in self._op.values()):
+            raise ValueError('the coefficients must be polynomials of the '
+                             'hyperparameters and the Fields')
+        if not all(p.n_variables == len(self._params)
+                   for p in [theta] + self._l):
+            raise ValueError('theta and l must be polynomials of the '
+                             'hyperparameters')
+        if not all(len(a) == len(self._l) for a in self._op.keys()):
+            raise ValueError('expecting multi-indices of length {}'.format(len(self._l)))
+
+        # derivatives with respect to every hyperparameter, without the
+        # vanishing ones
+        n = len(self._params)
+        self._dop = [OrderedDict((a, d) for a, d in
+                                 ((a, c.diff(p)) for a, c in self._op.items())
+                                 if len(d))
+                     for p in range(0, n)]
+        self._dtheta = [theta.diff(p) for p in range(0, n)]
+        self._dl = [[lk.diff(p) for lk in self._l] for p in range(0, n)]
+
+        self._tables = OrderedDict()
+
+    @property
+    def dim(self):
+        return len(self._l)
+
+    @property
+    def params(self):
+        return self._params
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def op(self):
+        return self._op
+
+    def __getstate__(self):
+        # the tables are computed again
+        state = self.__dict__.copy()
+        state['_tables'] = OrderedDict()
+        return state
+
+    def hyperparameters(self, values):
+        """returns theta and the l_k for the given values of the
+        hyperparameters."""
+        values = list(values)[:len(self._params)]
+        return float(self._theta(values)), [float(lk(values)) for lk in self._l]
+
+    def _table(self, values, x1, x2):
+        theta, l = self.hyperparameters(values)
+        key = (id(x1), id(x2))
+
+        if key in self._tables:
+            y1, y2, hyper, D = self._tables[key]
+            # the points are kept in the cache, their ids are not reused
+            if y1 is x1 and y2 is x2 and hyper == (theta, l):
+                return D
+
+        D = GaussianDerivatives(x1, x2, l=l, theta=theta)
+        self._tables[key] = (x1, x2, (theta, l), D)
+        while len(self._tables) > self._cache_size:
+            self._tables.popitem(last=False)
+        return D
+
+    def _operator(self, side, values, fields, n, axis, p=None):
+        """returns the coefficients of u or f (side) with the Fields at n
+        points, or their derivatives with respect to the p-th
+        hyperparameter."""
+        if side == 'u':
+            if p is None:
+                return {tuple([0] * self.dim): 1.}
+            return {}
+
+        if fields is None:
+            fields = [np.zeros(n)] * len(self._fields)
+        fields = [np.asarray(v, dtype=float) for v in fields]
+        if not(axis is None):
+            fields = [np.expand_dims(v, axis) for v in fields]
+
+        variables = list(values) + fields
+        op = self._op if p is None else self._dop[p]
+        return OrderedDict((a, c(variables)) for a, c in op.items())
+
+    def kernel(self, name, values, x1, x2, fields1=None, fields2=None, p=None):
+        """
+        evaluates a covariance block between the points x1 and x2 (arrays of
+        shape (n, dim)), or its derivative with respect to the p-th
+        hyperparameter. See OperatorGP.kernel.
+        """
+        D = self._table(values, x1, x2)
+        n1 = x1.shape[0]
+        n2 = x2.shape[0]
+
+        op_i = self._operator(name[0], values, fields1, n1, 1)
+        op_j = self._operator(name[1], values, fields2, n2, 0)
+        if p is None:
+            return _apply(D.__getitem__, op_i, op_j, D.shape)
+
+        # derivatives of the coefficients of L
+        K  = _apply(D.__getitem__,
+                    self._operator(name[0], values, fields1, n1, 1, p=p), op_j,
+                    D.shape)
+        K += _apply(D.__getitem__, op_i,
+                    self._operator(name[1], values, fields2, n2, 0, p=p),
+                    D.shape)
+
+        # and of the kernel
+        params = list(values)[:len(self._params)]
+        if len(self._dtheta[p]):
+            K += self._dtheta[p](params) * _apply(D.derivative, op_i, op_j,
+                                                  D.shape)
+        for k, dl in enumerate(self._dl[p]):
+            if len(dl):
+                K += dl(params) * _apply(lambda key: D.derivative(key, k),
+                                         op_i, op_j, D.shape)
+        return K
+
+    def diagonal(self, name, values, x, fields=None):
+        """
+        evaluates the diagonal of a covariance block between the points x and
+        themselves, without assembling the block.
+        """
+        theta, l = self.hyperparameters(values)
+        zero = np.zeros((1, self.dim))
+        D = GaussianDerivatives(zero, zero, l=l, theta=theta)
+        n = x.shape[0]
+
+        op_i = self._operator(name[0], values, fields, n, None)
+        op_j = self._operator(name[1], values, fields, n, None)
+        K = _apply(lambda key: D[key][0,0], op_i, op_j, ())
+        return np.array(np.broadcast_to(K, (n,)), dtype=float)
+
+    def as_dict(self):
+        """returns the operator as a dictionary of lists and numbers, that
+        can be saved as json, see from_dict."""
+        return {'op': [[list(a), c.as_dict()] for a, c in self._op.items()],
+                'theta': self._theta.as_dict(),
+                'l': [lk.as_dict() for lk in self._l],
+                'params': list(self._params),
+                'fields': list(self._fields)}
+
+    @staticmethod
+    def from_dict(d):
+        op = OrderedDict((tuple(a), Polynomial.from_dict(c)) for a, c in d['op'])
+        return GaussianOperator(op, Polynomial.from_dict(d['theta']),
+                                [Polynomial.from_dict(lk) for lk in d['l']],
+                                d['params'], d['fields'])
+
+def _apply(entry, op_i, op_j, shape):
+    """returns sum_{a, b} c_a c_b entry((a, b)), the coefficients may be
+    arrays."""
+    K = np.zeros(shape)
+    for a, ca in op_i.items():
+        for b, cb in op_j.items():
+            K = K + ca * cb * entry((a, b))
+    return K
+# ...
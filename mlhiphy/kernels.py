@@ -3,9 +3,16 @@
 from mlhiphy.calculus import dx, dy, dz
 from mlhiphy.calculus import Constant
 from mlhiphy.calculus import Unknown
-from mlhiphy.calculus import _partial_derivatives
+from mlhiphy.calculus import Field
+from mlhiphy.calculus import linearize
+from mlhiphy.calculus import PartialDerivative
+from mlhiphy.calculus import coordinate_index
 from mlhiphy.calculus import find_partial_derivatives
 from mlhiphy.calculus import sort_partial_derivatives
+from mlhiphy.calculus import multi_index_form
+from mlhiphy.calculus import multi_index_system
+
+from collections import OrderedDict
 
 from sympy import preorder_traversal
 from sympy import Derivative
@@ -18,12 +25,24 @@ from sympy import diff
 from sympy import Function
 from sympy import Tuple
 from sympy import Symbol
+from sympy import S
+
+def _coordinate_derivatives(expr, dim):
+    """returns the partial derivatives acting in dimension dim: dx, dy, dz
+    and those of expr (e.g. dt or partial_derivative(3))."""
+    ops = list((dx, dy, dz)[:dim])
+    for i in preorder_traversal(expr):
+        d = type(i)
+        if isinstance(i, PartialDerivative) and not(d in ops):
+            coordinate_index(d, dim)
+            ops.append(d)
+    return tuple(ops)
 
 def generic_kernel(expr, func, y, args=None):
     if isinstance(y, Symbol):
         _derivatives = tuple([dx])
     elif isinstance(y, Tuple):
-        _derivatives = tuple(_partial_derivatives[:len(y)])
+        _derivatives = _coordinate_derivatives(expr, len(y))
     elif not isinstance(y, (list, tuple)):
         raise TypeError('expecting a Symbol or Tuple')
 
@@ -175,57 +194,324 @@ def generic_kernel(expr, func, y, args=None):
 
         return expr
 
-def compute_kernel(expr, kuu, args):
-    if not isinstance(args, (tuple, list)):
-        args = [args]
+# ...
+class KernelDerivatives(object):
+    """
+    Table of the partial derivatives of kuu with respect to the coordinates of
+    xi and xj. Every entry is computed once, from the entry with one
+    derivative less.
 
-    u = [i for i in expr.free_symbols if isinstance(i, Unknown)]
-    if not(len(u) == 1):
-        raise ValueError('Expecting one unknown')
+    Examples
 
-    u = u[0]
-    expr = generic_kernel(expr, u, args)
+    >>> D = KernelDerivatives(kuu, Tuple(xi, yi), Tuple(xj, yj))
+    >>> D[(1, 0), (0, 2)]   # d/dxi d^2/dyj^2 kuu
+    """
 
-    expr = expr.subs({u: kuu})
+    def __init__(self, kuu, xi, xj):
+        if isinstance(xi, Symbol):
+            xi = Tuple(xi)
+        if isinstance(xj, Symbol):
+            xj = Tuple(xj)
 
-    xi = args[0]
-    scalar = isinstance(xi, Symbol)
+        self._kuu = kuu
+        self._xi = xi
+        self._xj = xj
+        self._table = {}
 
-    if not scalar:
-        _args = []
-        for a in args:
-            if isinstance(a, Symbol):
-                _args += [a]
-            elif isinstance(a, Tuple):
-                _args += [*a]
-            else:
-                raise TypeError('expecting a Symbol or Tuple')
+    @property
+    def kuu(self):
+        return self._kuu
 
-    # must be done before subs on xi and xj
-    if len(args) > 1:
-        xj = args[1]
+    @property
+    def dim(self):
+        return len(self._xi)
+
+    def __len__(self):
+        return len(self._table)
+
+    def __getitem__(self, key):
+        a, b = key
+        a = tuple(a)
+        b = tuple(b)
+        if (a, b) in self._table:
+            return self._table[a, b]
+
+        if not any(a) and not any(b):
+            expr = self._kuu
 
-        if scalar:
-            expr = expr.subs({Derivative(u(*args), xi, xj):
-                              diff(kuu, xi, xj)})
         else:
-            for _xi in xi:
-                for _xj in xj:
-                    expr = expr.subs({Derivative(u(*_args), _xi, _xj):
-                                      diff(kuu, _xi, _xj)})
+            # one derivative less, on the last non zero index
+            for k in reversed(range(0, len(b))):
+                if b[k] > 0:
+                    c = list(b)
+                    c[k] -= 1
+                    expr = diff(self[a, tuple(c)], self._xj[k])
+                    break
+            else:
+                for k in reversed(range(0, len(a))):
+                    if a[k] > 0:
+                        c = list(a)
+                        c[k] -= 1
+                        expr = diff(self[tuple(c), b], self._xi[k])
+                        break
+
+        self._table[a, b] = expr
+        return expr
+# ...
+
+# ...
+def _apply(D, op_i, op_j):
+    """returns sum_{a, b} c_a c_b d^a_i d^b_j kuu."""
+    zero = tuple([0] * D.dim)
+    if op_i is None:
+        op_i = {zero: 1}
+    if op_j is None:
+        op_j = {zero: 1}
+
+    terms = []
+    for a, ca in op_i.items():
+        for b, cb in op_j.items():
+            terms.append(ca * cb * D[a, b])
+    return Add(*terms)
+
+def field_at(F, side):
+    """returns the Field F evaluated at xi (side 'i') or xj (side 'j'), i.e.
+    the Field named F_i or F_j."""
+    return Field('{}_{}'.format(F.name, side))
+
+def _at(op, side):
+    """returns the multi-index form op with its Fields evaluated on side."""
+    fields = set()
+    for c in op.values():
+        fields |= set(i for i in c.free_symbols if isinstance(i, Field))
+    if not fields:
+        return op
+
+    subs = {F: field_at(F, side) for F in fields}
+    return OrderedDict((a, c.subs(subs)) for a, c in op.items())
+
+def _unknown(expr):
+    u = [i for i in expr.free_symbols if isinstance(i, Unknown)]
+    if not(len(u) == 1):
+        raise ValueError('Expecting one unknown')
+    return u[0]
+
+def compute_kernels(expr, kuu, xi, xj, derivatives=None, around=None):
+    """
+    returns the covariance kernels of u and f = L u, where L is given by
+    expr, as a dictionary with the keys 'uu', 'uf', 'fu' and 'ff'. The
+    kernel 'fu' is L applied to kuu with respect to xi.
+
+    The operator is converted to its multi-index form and the kernels are
+    assembled from a single table of derivatives of kuu, that can be given
+    (a KernelDerivatives) to be shared with other operators.
+
+    A nonlinear operator, e.g. u + c * u * dx(u), is first linearized around
+    the given state (see calculus.linearize). A Field F in the coefficients
+    of L becomes F_i or F_j (see field_at), its values at xi or xj.
+    """
+    u = _unknown(expr)
+    if not(around is None):
+        expr = linearize(expr, u, around)
+
+    if derivatives is None:
+        derivatives = KernelDerivatives(kuu, xi, xj)
+
+    D = derivatives
+    op = multi_index_form(expr, u, D.dim)
+    op_i = _at(op, 'i')
+    op_j = _at(op, 'j')
+
+    return {'uu': kuu,
+            'uf': _apply(D, None, op_j),
+            'fu': _apply(D, op_i, None),
+            'ff': _apply(D, op_i, op_j)}
+# ...
+
+# ...
+def compute_kernel(expr, kuu, args, around=None):
+    if not isinstance(args, (tuple, list)):
+        args = [args]
 
-    if scalar:
-        expr = expr.subs({Derivative(u(*args), xi): diff(kuu, xi)})
-    else:
-        for _xi in xi:
-            expr = expr.subs({Derivative(u(*_args), _xi): diff(kuu, _xi)})
+    u = _unknown(expr)
+    if not(around is None):
+        expr = linearize(expr, u, around)
+
+    xi = args[0]
+    xj = args[1] if len(args) > 1 else args[0]
+
+    D = KernelDerivatives(kuu, xi, xj)
+    op = multi_index_form(expr, u, D.dim)
 
     if len(args) > 1:
-        if scalar:
-            expr = expr.subs({Derivative(u(*args), xj): diff(kuu, xj)})
+        return _apply(D, _at(op, 'i'), _at(op, 'j'))
+
+    return _apply(D, _at(op, 'i'), None)
+# ...
+
+# ...
+def _unknowns(exprs):
+    us = set()
+    for e in exprs:
+        us |= set(i for i in e.free_symbols if isinstance(i, Unknown))
+    return sorted(us, key=lambda u: u.name)
+
+def compute_kernel_system(exprs, kuu, xi, xj, unknowns=None, derivatives=None,
+                          around=None):
+    """
+    returns the covariance kernels of several unknowns and of a system of
+    linear operators f_k = sum_m L_km u_m applied to them.
+
+    The unknowns have independent priors, kuu is either one kernel shared by
+    all of them or a dictionary that maps every unknown to its kernel. The
+    blocks are assembled from one table of derivatives per distinct kernel,
+    shared by all the pairs of components.
+
+    exprs: list
+        the equations of the system. Tuples (e.g. given by Grad_2d) are
+        flattened.
+    unknowns: list
+        the unknowns, sorted by name if not given
+    derivatives: dict
+        maps a kernel to its KernelDerivatives, completed in place
+    around: number, Constant, Field or dict
+        the state around which nonlinear equations are linearized (see
+        calculus.linearize), one for all the unknowns or a dictionary that
+        maps every unknown to its state. As in compute_kernels, a Field F in
+        the coefficients becomes F_i or F_j.
+
+    returns (names, kernels), where names are the names of the unknowns
+    followed by 'f0', 'f1', ... for the equations and kernels maps every pair
+    (a, b) of names to the covariance of a(xi) and b(xj).
+
+    Examples
+
+    >>> u, v, p = [Unknown(i) for i in ['u', 'v', 'p']]
+    >>> exprs = [-nu*(dx(dx(u)) + dy(dy(u))) + dx(p),
+    ...          -nu*(dx(dx(v)) + dy(dy(v))) + dy(p),
+    ...          Div_2d(Tuple(u, v))]
+    >>> names, kernels = compute_kernel_system(exprs, kuu, Xi, Xj)
+    >>> kernels['f2', 'p']
+    """
+    _exprs = []
+    for e in exprs:
+        if isinstance(e, (Tuple, list, tuple)):
+            _exprs += list(e)
         else:
-            expr = expr.subs({Derivative(u(*_args), _xj): diff(kuu, _xj)})
-
-    # enforce computing the derivatives
-    expr = expr.doit()
-    return expr
+            _exprs.append(e)
+    exprs = _exprs
+
+    if unknowns is None:
+        unknowns = _unknowns(exprs)
+
+    if not(around is None):
+        if not isinstance(around, dict):
+            around = {u: around for u in unknowns}
+        for u, state in around.items():
+            exprs = [linearize(e, u, state) for e in exprs]
+
+    if not isinstance(kuu, dict):
+        kuu = {u: kuu for u in unknowns}
+
+    if derivatives is None:
+        derivatives = {}
+
+    for u in unknowns:
+        if not(kuu[u] in derivatives):
+            derivatives[kuu[u]] = KernelDerivatives(kuu[u], xi, xj)
+
+    tables = {u: derivatives[kuu[u]] for u in unknowns}
+    dim = tables[unknowns[0]].dim
+
+    zero = tuple([0] * dim)
+    outputs = [(u.name, {u: {zero: S.One}}) for u in unknowns]
+    for k, e in enumerate(exprs):
+        outputs.append(('f{}'.format(k), multi_index_system(e, unknowns, dim)))
+
+    # the Fields of the operators, at xi and at xj
+    ops_i = [{u: _at(op, 'i') for u, op in op_a.items()} for _, op_a in outputs]
+    ops_j = [{u: _at(op, 'j') for u, op in op_a.items()} for _, op_a in outputs]
+
+    kernels = OrderedDict()
+    for (a, _), op_i in zip(outputs, ops_i):
+        for (b, _), op_j in zip(outputs, ops_j):
+            terms = [_apply(tables[u], op_i[u], op_j[u]) for u in unknowns
+                     if op_i.get(u) and op_j.get(u)]
+            kernels[a, b] = Add(*terms)
+
+    names = [a for a, _ in outputs]
+    return names, kernels
+# ...
+
+# ...
+def polynomial(expr, variables):
+    """
+    returns expr as a gaussian.Polynomial of the given variables (Symbols,
+    Constants or Fields). A ValueError is raised if expr is not a sum of
+    monomials with numerical coefficients and integer exponents.
+    """
+    from mlhiphy.gaussian import Polynomial
+
+    variables = list(variables)
+    coefficients = []
+    exponents = []
+    for term in Add.make_args(expand(S(expr))):
+        if term == 0:
+            continue
+
+        c = S.One
+        e = [0] * len(variables)
+        for factor in Mul.make_args(term):
+            base, k = factor.as_base_exp()
+            if factor.is_number:
+                c *= factor
+            elif base in variables and k.is_Integer:
+                e[variables.index(base)] += int(k)
+            else:
+                raise ValueError('{} is not a monomial of {}'.format(term, variables))
+
+        coefficients.append(float(c))
+        exponents.append(e)
+    return Polynomial(coefficients, exponents, len(variables))
+
+def gaussian_operator(expr, kuu, xi, xj, params, fields=()):
+    """
+    returns the numerical kernels of u and f = L u (a
+    gaussian.GaussianOperator), where L is given by expr, if kuu is a Gaussian
+
+        theta * exp(- sum_k l_k (xi_k - xj_k)^2)
+
+    with theta and the l_k polynomials of params (e.g. theta, l or 1/(2*l))
+    and the coefficients of L polynomials of params and fields. Returns None
+    otherwise, the kernels are then derived with compute_kernels.
+    """
+    from mlhiphy.gaussian import GaussianOperator
+
+    if isinstance(xi, Symbol):
+        xi = Tuple(xi)
+        xj = Tuple(xj)
+
+    coordinates = list(xi) + list(xj)
+    theta, g = kuu.as_independent(*coordinates, as_Add=False)
+    if not isinstance(g, exp):
+        return None
+
+    arg = expand(g.args[0])
+    l = [-arg.coeff(a, 2) for a in xi]
+    # e.g. a term xi*yj or a term linear in xi is left
+    rest = expand(arg + Add(*[lk*(a - b)**2 for lk, a, b in zip(l, xi, xj)]))
+    if not(rest == 0) or any(lk.has(*coordinates) for lk in l):
+        return None
+
+    try:
+        op = multi_index_form(expr, _unknown(expr), len(xi))
+        op = OrderedDict((a, polynomial(c, list(params) + list(fields)))
+                         for a, c in op.items())
+        theta = polynomial(theta, params)
+        l = [polynomial(lk, params) for lk in l]
+    except ValueError:
+        return None
+
+    return GaussianOperator(op, theta, l, [p.name for p in params],
+                            [F.name for F in fields])
+# ...
@@ -0,0 +1,371 @@
+# coding: utf-8
+
+import os
+import numpy as np
+from scipy.linalg import cho_solve
+from scipy.linalg import solve_triangular
+
+
+# ...
+class CholeskyFactor(object):
+    """
+    Lower Cholesky factor of a symmetric positive definite matrix.
+
+    jitter is the value that was added to the diagonal of the matrix in order
+    to get a successful factorization.
+
+    Examples
+
+    >>> F = cholesky(K)
+    >>> alpha = F.solve(y)
+    """
+
+    def __init__(self, L, jitter=0.):
+        self._L = L
+        self._jitter = jitter
+
+    @property
+    def L(self):
+        return self._L
+
+    @property
+    def jitter(self):
+        return self._jitter
+
+    @property
+    def shape(self):
+        return self._L.shape
+
+    def solve(self, b):
+        """returns the solution of K x = b."""
+        return cho_solve((self._L, True), b, check_finite=False)
+
+    def solve_lower(self, b):
+        """returns the solution of L x = b."""
+        return solve_triangular(self._L, b, lower=True, check_finite=False)
+
+    def logdet(self):
+        """returns log(det(K))."""
+        return 2. * np.sum(np.log(np.diag(self._L)))
+
+    def inverse(self):
+        """returns K^{-1}."""
+        return self.solve(np.eye(self._L.shape[0]))
+
+    def condition(self):
+        """
+        returns a cheap estimate (a lower bound) of the condition number of K,
+        from the diagonal of its factor.
+        """
+        d = np.abs(np.diag(self._L))
+        return (np.max(d) / np.min(d))**2
+# ...
+
+# ...
+def cholesky(K, jitter=0., max_tries=6, growth=10., min_jitter=1.e-10):
+    """
+    Cholesky factorization of K with adaptive jitter.
+
+    The factorization of K + jitter * I is tried first. On failure, the jitter
+    is multiplied by growth (it starts from min_jitter times the mean of the
+    diagonal when jitter is zero) and the factorization is tried again, at
+    most max_tries times.
+
+    K: ndarray
+        symmetric matrix
+    jitter: float
+        initial value added to the diagonal, e.g. the noise level
+    max_tries: int
+        maximum number of retries with an increased jitter
+    growth: float
+        geometric factor used to increase the jitter
+    min_jitter: float
+        relative jitter used for the first retry when jitter is zero
+
+    returns a CholeskyFactor, its attribute jitter is the value that was used.
+    raises numpy.linalg.LinAlgError if K is not positive definite even after
+    max_tries retries.
+    """
+    K = np.asarray(K, dtype=float)
+    if not(K.ndim == 2) or not(K.shape[0] == K.shape[1]):
+        raise ValueError('expecting a square matrix, given {}'.format(K.shape))
+
+    if max_tries < 0:
+        raise ValueError('expecting max_tries >= 0, given {}'.format(max_tries))
+
+    if not np.all(np.isfinite(K)):
+        raise np.linalg.LinAlgError('matrix has non-finite entries')
+
+    diag = np.diag(K)
+    scale = np.mean(np.abs(diag)) if diag.size else 1.
+    if scale == 0.:
+        scale = 1.
+
+    n = K.shape[0]
+    J = jitter
+    for i in range(0, max_tries + 1):
+        A = K.copy()
+        if J > 0.:
+            A[np.diag_indices(n)] += J
+        try:
+            L = np.linalg.cholesky(A)
+            return CholeskyFactor(L, jitter=J)
+        except np.linalg.LinAlgError:
+            tried = J
+            J = max(J * growth, min_jitter * scale)
+
+    raise np.linalg.LinAlgError('matrix is not positive definite, '
+                                'even with a jitter of {}'.format(tried))
+# ...
+
+# ...
+def block_cholesky(Kuu, Kuf, Kff, factor_uu=None, **options):
+    """
+    Cholesky factorization of the block matrix [[Kuu, Kuf], [Kfu, Kff]] using
+    the Schur complement Kff - Kfu Kuu^{-1} Kuf.
+
+    factor_uu: CholeskyFactor
+        factor of Kuu, computed if not given. Kuu is not used in this case.
+
+    options are passed to cholesky. The jitter of the returned factor is the
+    largest jitter used for the two diagonal blocks.
+    """
+    if factor_uu is None:
+        factor_uu = cholesky(Kuu, **options)
+
+    Luu = factor_uu.L
+    W = factor_uu.solve_lower(Kuf)
+    S = Kff - W.T.dot(W)
+    factor_s = cholesky(S, **options)
+
+    nu = Luu.shape[0]
+    nf = factor_s.L.shape[0]
+    L = np.zeros((nu + nf, nu + nf))
+    L[:nu,:nu] = Luu
+    L[nu:,:nu] = W.T
+    L[nu:,nu:] = factor_s.L
+
+    return CholeskyFactor(L, jitter=max(factor_uu.jitter, factor_s.jitter))
+# ...
+
+# ...
+class SchurFactorization(object):
+    """
+    Factorization of the joint covariance matrix [[Kuu, Kuf], [Kfu, Kff]],
+    where the factor of Kuu is cached and reused as long as its key does not
+    change.
+
+    Kuu only depends on the parameters of kuu, so the key is typically the
+    tuple of their values: when only the operator parameters change, Kuu is
+    neither assembled nor factorized again.
+
+    Examples
+
+    >>> factorize = SchurFactorization(jitter=1e-7)
+    >>> F = factorize((theta,), lambda: kuu(x, theta), Kuf, Kff)
+    """
+
+    def __init__(self, **options):
+        self._options = options
+        self._key = None
+        self._factor_uu = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def factor_uu(self):
+        return self._factor_uu
+
+    def clear(self):
+        self._key = None
+        self._factor_uu = None
+
+    def __call__(self, key, Kuu, Kuf, Kff):
+        """
+        key: hashable
+            identifies Kuu
+        Kuu: ndarray or callable
+            a callable is only called when the cached factor cannot be used
+        """
+        if self._factor_uu is None or not(key == self._key):
+            if callable(Kuu):
+                Kuu = Kuu()
+
+            self._factor_uu = cholesky(Kuu, **self._options)
+            self._key = key
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return block_cholesky(None, Kuf, Kff, factor_uu=self._factor_uu,
+                              **self._options)
+# ...
+
+# ...
+class IncrementalCholesky(object):
+    """
+    Cholesky factor of a covariance matrix that grows by blocks of rows, e.g.
+    when the observations are read by chunks.
+
+    The factor is stored by blocks of rows [L_k1, ..., L_kk], so that adding
+    a block only needs the covariance of the new rows with the previous ones.
+    If directory is given, the blocks are memory-mapped .npy files and the
+    factor can be larger than the memory.
+
+    The data y is given with every block and L^{-1} y is updated by forward
+    substitution, so the negative log marginal likelihood is available at any
+    time without solving again.
+
+    options are passed to cholesky, for the Schur complement of every block.
+
+    Examples
+
+    >>> F = IncrementalCholesky(jitter=1e-7)
+    >>> for K_new_old, K_new, y_new in blocks:
+    ...     F.append(K_new_old, K_new, y_new)
+    >>> F.nlml()
+    """
+
+    def __init__(self, directory=None, **options):
+        self._directory = directory
+        self._options = options
+        self._rows = []
+        self._z = []
+        self._jitter = 0.
+        self._logdet = 0.
+        self._size = 0
+        self._diagonal = (np.inf, 0.)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def jitter(self):
+        """largest jitter used for the diagonal blocks."""
+        return self._jitter
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _store(self, L):
+        if self._directory is None:
+            return L
+
+        filename = os.path.join(self._directory,
+                                'factor_{}.npy'.format(len(self._rows)))
+        M = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                      shape=L.shape)
+        M[...] = L
+        M.flush()
+        return M
+
+    def solve_lower(self, b):
+        """returns the solution of L x = b, block by block."""
+        b = np.asarray(b, dtype=float)
+        x = np.zeros_like(b)
+        start = 0
+        for rows in self._rows:
+            m = rows.shape[0]
+            r = b[start:start+m] - rows[:,:start].dot(x[:start])
+            x[start:start+m] = solve_triangular(rows[:,start:start+m], r,
+                                                lower=True, check_finite=False)
+            start += m
+        return x
+
+    def append(self, K_new_old, K_new, y_new):
+        """
+        adds a block of rows.
+
+        K_new_old: ndarray
+            covariance of the new rows with the previous ones, of shape
+            (m, size)
+        K_new: ndarray
+            covariance of the new rows, of shape (m, m)
+        y_new: ndarray
+            data of the new rows
+        """
+        K_new = np.asarray(K_new, dtype=float)
+        y_new = np.asarray(y_new, dtype=float).ravel()
+        m = K_new.shape[0]
+
+        if self._size > 0:
+            W = self.solve_lower(np.asarray(K_new_old, dtype=float).T)
+            S = K_new - W.T.dot(W)
+            z = y_new - W.T.dot(np.concatenate(self._z))
+        else:
+            W = np.zeros((0, m))
+            S = K_new
+            z = y_new
+
+        F = cholesky(S, **self._options)
+        z = F.solve_lower(z)
+
+        self._rows.append(self._store(np.hstack([W.T, F.L])))
+        self._z.append(z)
+        self._jitter = max(self._jitter, F.jitter)
+        self._logdet += F.logdet()
+        self._size += m
+
+        d = np.abs(np.diag(F.L))
+        if d.size:
+            self._diagonal = (min(self._diagonal[0], np.min(d)),
+                              max(self._diagonal[1], np.max(d)))
+
+    def logdet(self):
+        """returns log(det(K))."""
+        return self._logdet
+
+    def condition(self):
+        """returns the estimate of CholeskyFactor.condition, from the
+        diagonals of the blocks."""
+        low, high = self._diagonal
+        if self._size == 0:
+            return np.nan
+        return (high / low)**2
+
+    def nlml(self):
+        """returns the negative log marginal likelihood of the data."""
+        z = np.concatenate(self._z) if self._z else np.zeros(0)
+        return 0.5 * (z.dot(z) + self._logdet + self._size * np.log(2. * np.pi))
+
+    def to_factor(self):
+        """returns the full factor as a CholeskyFactor (in memory)."""
+        L = np.zeros((self._size, self._size))
+        start = 0
+        for rows in self._rows:
+            m = rows.shape[0]
+            L[start:start+m,:start+m] = rows
+            start += m
+        return CholeskyFactor(L, jitter=self._jitter)
+# ...
+
+# ...
+def nlml(factor, y):
+    """
+    returns the negative log marginal likelihood of the data y for a zero mean
+    Gaussian process with covariance given by its Cholesky factor.
+    """
+    y = np.asarray(y, dtype=float)
+    alpha = factor.solve(y)
+    n = y.shape[0]
+    return 0.5 * (y.dot(alpha) + factor.logdet() + n * np.log(2. * np.pi))
+# ...
+
+# ...
+def nlml_gradient(factor, y, dK):
+    """
+    returns the gradient of the negative log marginal likelihood
+
+        -1/2 tr((alpha alpha^T - K^{-1}) dK/dp)
+
+    where alpha = K^{-1} y. The factor is the one used to compute the value.
+
+    dK: list
+        derivatives of K with respect to each parameter
+    """
+    y = np.asarray(y, dtype=float)
+    alpha = factor.solve(y)
+    W = np.outer(alpha, alpha) - factor.inverse()
+    return np.asarray([-0.5 * np.sum(W * D) for D in dK])
+# ...
@@ -0,0 +1,869 @@
+# coding: utf-8
+
+# sympy, kernels and scipy.optimize are imported by the methods that derive,
+# lambdify or fit, so that importing the module is cheap for the workers. A
+# model with a Gaussian kuu evaluates its kernels with gaussian.GaussianOperator
+# and keeps its expressions as srepr when pickled: it is fitted and evaluated
+# without sympy.
+
+import time
+import numpy as np
+
+from mlhiphy.linalg import CholeskyFactor
+from mlhiphy.linalg import SchurFactorization
+from mlhiphy.linalg import IncrementalCholesky
+from mlhiphy.linalg import nlml as _nlml
+from mlhiphy.linalg import nlml_gradient
+
+
+# attributes of OperatorGP that are sympy objects
+_symbolic = ['_expr', '_kuu', '_xi', '_xj', '_params', '_fields', '_kernels']
+
+# ...
+def _coordinates(x):
+    """returns the points x as a 2d array of shape (n, dim)."""
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:,None]
+    return x
+# ...
+
+# ...
+class OperatorGP(object):
+    """
+    Joint Gaussian process for u and f = L u, where u ~ GP(0, kuu) and L is a
+    linear differential operator.
+
+    The covariance of (u, f) is the block matrix [[Kuu, Kuf], [Kfu, Kff]].
+    If kuu is a Gaussian, the blocks and their derivatives with respect to
+    the hyperparameters are evaluated in closed form (see
+    kernels.gaussian_operator), otherwise they are derived once, using
+    compute_kernels, and lambdified.
+
+    expr: sympy expression
+        the operator L applied to an Unknown
+    kuu: sympy expression
+        covariance of u, as a function of xi and xj
+    xi, xj: Symbol or Tuple
+        coordinates of the two points
+    params: list
+        hyperparameters, the free symbols of kuu followed by those of expr
+        (sorted by name) when not given
+    constants: dict
+        values of Constants that are not hyperparameters, e.g. the time step
+    noise: float
+        value added to the diagonal of Kuu and Kff, it is increased
+        automatically if the covariance matrix is not numerically positive
+        definite
+    trace: Trace
+        if given, every evaluation of the nlml is recorded
+    around: number, Constant or Field
+        if given, the nonlinear operator expr is linearized around this state,
+        see calculus.linearize. The values of a Field at the points of f are
+        given to set_data.
+    kernels: dict
+        the kernels of expr, if they were already derived (see load_model)
+    engine: str
+        'gaussian' for the closed form kernels, 'sympy' for the lambdified
+        ones, 'auto' uses the former when kuu is a Gaussian
+
+    Examples
+
+    >>> model = OperatorGP(phi * u + dx(dx(u)), kuu, xi, xj)
+    >>> model.set_data(x_u, y_u, x_f, y_f)
+    >>> res = model.fit([1., 1.])
+
+    >>> model = OperatorGP(u + tau * c * u * dx(u), kuu, xi, xj, around=F)
+    >>> model.set_data(x_u, y_u, x_f, y_f, fields={F: y_f})
+    """
+
+    def __init__(self, expr, kuu, xi, xj, params=None, constants=None,
+                 noise=0., trace=None, around=None, kernels=None,
+                 engine='auto', **options):
+        from sympy import Symbol
+        from sympy import Tuple
+        from mlhiphy.calculus import Unknown
+        from mlhiphy.calculus import Field
+
+        if not(around is None):
+            from mlhiphy.calculus import linearize
+
+            u = [i for i in expr.free_symbols if isinstance(i, Unknown)]
+            if not(len(u) == 1):
+                raise ValueError('Expecting one unknown')
+            expr = linearize(expr, u[0], around)
+
+        if constants:
+            expr = expr.subs(constants)
+            kuu = kuu.subs(constants)
+
+        if isinstance(xi, Symbol):
+            xi = Tuple(xi)
+            xj = Tuple(xj)
+
+        if not(len(xi) == len(xj)):
+            raise ValueError('xi and xj must have the same dimension')
+
+        if not(engine in ('auto', 'gaussian', 'sympy')):
+            raise ValueError("expecting engine 'auto', 'gaussian' or 'sympy', "
+                             "given {}".format(engine))
+
+        self._expr = expr
+        self._kuu = kuu
+        self._xi = xi
+        self._xj = xj
+        # derived on demand, see kernels
+        self._kernels = kernels
+        self._metadata = None
+
+        # ...
+        coordinates = set(xi) | set(xj)
+        kernel_params = [i for i in kuu.free_symbols if not(i in coordinates)]
+        kernel_params = sorted(kernel_params, key=lambda i: i.name)
+
+        operator_params = [i for i in expr.free_symbols
+                           if not isinstance(i, (Unknown, Field)) and
+                           not(i in kernel_params)]
+        operator_params = sorted(operator_params, key=lambda i: i.name)
+
+        if params is None:
+            params = kernel_params + operator_params
+
+        free = set(kernel_params + operator_params)
+        if not(set(params) == free):
+            raise ValueError('expecting the parameters {}'.format(free))
+
+        self._params = tuple(params)
+        self._fields = tuple(sorted([i for i in expr.free_symbols
+                                     if isinstance(i, Field)],
+                                    key=lambda i: i.name))
+        self._kernel_indices = [self._params.index(i) for i in kernel_params]
+        self._param_names = tuple(i.name for i in self._params)
+        self._field_names = tuple(F.name for F in self._fields)
+        self._dim = len(xi)
+        # ...
+
+        # ...
+        self._gaussian = None
+        if not(engine == 'sympy'):
+            from mlhiphy.kernels import gaussian_operator
+            self._gaussian = gaussian_operator(expr, kuu, xi, xj, self._params,
+                                               self._fields)
+            if self._gaussian is None and engine == 'gaussian':
+                raise ValueError('kuu is not a Gaussian, or the coefficients '
+                                 'of the operator are not polynomials')
+        # ...
+
+        self._setup(noise, trace, options)
+
+    @classmethod
+    def from_gaussian(cls, gaussian, metadata, kernel_indices, noise=0.,
+                      trace=None, **options):
+        """
+        returns a model evaluated with the closed form kernels gaussian (a
+        gaussian.GaussianOperator), without sympy, e.g. in load_model. Its
+        expressions are only evaluated from their srepr (metadata, see
+        save_model) when they are accessed.
+
+        kernel_indices: list
+            indices of the hyperparameters of kuu
+        """
+        model = cls.__new__(cls)
+        for k in _symbolic:
+            setattr(model, k, None)
+        model._metadata = metadata
+        model._param_names = tuple(gaussian.params)
+        model._field_names = tuple(gaussian.fields)
+        model._kernel_indices = list(kernel_indices)
+        model._dim = gaussian.dim
+        model._gaussian = gaussian
+        model._setup(noise, trace, options)
+        return model
+
+    def _setup(self, noise, trace, options):
+        self._noise = noise
+        self._options = options
+        self._factorize = SchurFactorization(jitter=noise, **options)
+        self._functions = {}
+        self._last = None
+        self._last_gradient = None
+        self._timings = (0., 0.)
+
+        self._x_u = None
+        self._x_f = None
+        self._y = None
+        self._field_values = None
+
+        self.values = None
+        self.trace = trace
+
+    @property
+    def expr(self):
+        self._restore()
+        return self._expr
+
+    @property
+    def kuu(self):
+        self._restore()
+        return self._kuu
+
+    @property
+    def params(self):
+        self._restore()
+        return self._params
+
+    @property
+    def param_names(self):
+        """names of the hyperparameters, available without sympy."""
+        return self._param_names
+
+    @property
+    def fields(self):
+        """Fields of the (linearized) operator, sorted by name."""
+        self._restore()
+        return self._fields
+
+    @property
+    def kernel_params(self):
+        return tuple(self.params[i] for i in self._kernel_indices)
+
+    @property
+    def kernels(self):
+        self._restore()
+        if self._kernels is None:
+            from mlhiphy.kernels import compute_kernels
+            self._kernels = compute_kernels(self._expr, self._kuu, self._xi,
+                                            self._xj)
+        return self._kernels
+
+    @property
+    def engine(self):
+        """'gaussian' or 'sympy', see OperatorGP."""
+        return 'sympy' if self._gaussian is None else 'gaussian'
+
+    @property
+    def dim(self):
+        return self._dim
+
+    @property
+    def factor(self):
+        """Cholesky factor of the last evaluated covariance matrix."""
+        if self._last is None:
+            return None
+        return self._last[1]
+
+    @property
+    def factor_values(self):
+        """hyperparameters of the last evaluated covariance matrix."""
+        if self._last is None:
+            return None
+        return self._last[0]
+
+    def set_factor(self, values, factor):
+        """
+        sets the Cholesky factor of the covariance matrix for the given
+        hyperparameters, e.g. when restoring a checkpoint.
+        """
+        if self._y is None:
+            raise ValueError('no data, use set_data first')
+
+        if not(factor.shape[0] == self._y.size):
+            raise ValueError('expecting a factor of size {}'.format(self._y.size))
+
+        self._last = (tuple(float(i) for i in values), factor)
+
+    def __getstate__(self):
+        # lambdified functions cannot be pickled, they are created again
+        state = self.__dict__.copy()
+        state['_functions'] = {}
+
+        # the closed form kernels do not need the expressions, they are
+        # restored from their srepr on demand
+        if not(self._gaussian is None):
+            state['_metadata'] = self._describe()
+            for k in _symbolic:
+                state[k] = None
+        return state
+
+    def _describe(self):
+        """returns the expressions of the model as srepr strings."""
+        if self._metadata is None:
+            from sympy import srepr
+            from mlhiphy import calculus
+
+            # operators created by partial_derivative must exist before loading
+            derivatives = set(type(i) for i in
+                              self._expr.atoms(calculus.PartialDerivative))
+            derivatives = sorted(d.grad_index for d in derivatives
+                                 if not(d in calculus._partial_derivatives))
+
+            self._metadata = {'expr': srepr(self._expr),
+                              'derivatives': derivatives,
+                              'kuu': srepr(self._kuu),
+                              'xi': srepr(self._xi),
+                              'xj': srepr(self._xj),
+                              'params': [srepr(i) for i in self._params]}
+            if not(self._kernels is None):
+                self._metadata['kernels'] = {k: srepr(v) for k, v in
+                                             self._kernels.items()}
+        return self._metadata
+
+    def _restore(self):
+        """evaluates the expressions of the model from their srepr, if they
+        are not there yet. Only restore trusted models."""
+        if not(self._expr is None):
+            return
+
+        from mlhiphy.calculus import Field
+
+        d = self._metadata
+        load = _loader(d.get('derivatives', []))
+
+        self._expr = load(d['expr'])
+        self._kuu = load(d['kuu'])
+        self._xi = load(d['xi'])
+        self._xj = load(d['xj'])
+        self._params = tuple(load(i) for i in d['params'])
+        self._fields = tuple(Field(i) for i in self._field_names)
+        if 'kernels' in d:
+            self._kernels = {k: load(v) for k, v in d['kernels'].items()}
+
+    def _function(self, name, p=None):
+        key = (name, p)
+        if not(key in self._functions):
+            from sympy import diff
+            from sympy import lambdify
+            from mlhiphy.kernels import field_at
+
+            expr = self.kernels[name]
+            if not(p is None):
+                expr = diff(expr, self._params[p])
+
+            args  = [*self._xi] + [*self._xj] + list(self._params)
+            args += [field_at(F, 'i') for F in self._fields]
+            args += [field_at(F, 'j') for F in self._fields]
+            self._functions[key] = lambdify(args, expr, 'numpy')
+
+        return self._functions[key]
+
+    def kernel(self, name, values, x1, x2, p=None, fields1=None, fields2=None):
+        """
+        evaluates a covariance block.
+
+        name: str
+            one of 'uu', 'uf', 'fu', 'ff'
+        values: list
+            values of the hyperparameters
+        x1, x2: ndarray
+            points of shape (n,) or (n, dim)
+        p: int
+            if given, the derivative with respect to the p-th parameter is
+            evaluated
+        fields1, fields2: list
+            values of the Fields at x1 and x2, in the order of fields. They
+            are only needed on the side of f.
+        """
+        x1 = _coordinates(x1)
+        x2 = _coordinates(x2)
+        if not(x1.shape[1] == self.dim) or not(x2.shape[1] == self.dim):
+            raise ValueError('expecting points of dimension {}'.format(self.dim))
+
+        if not(self._gaussian is None):
+            return self._gaussian.kernel(name, values, x1, x2, p=p,
+                                         fields1=fields1, fields2=fields2)
+
+        f = self._function(name, p)
+
+        args  = [x1[:,k,None] for k in range(self.dim)]
+        args += [x2[None,:,k] for k in range(self.dim)]
+        args += list(values)
+        for x, fields, axis in [(x1, fields1, 1), (x2, fields2, 0)]:
+            if fields is None:
+                fields = [np.zeros(x.shape[0])] * len(self._field_names)
+            args += [np.expand_dims(np.asarray(v, dtype=float), axis)
+                     for v in fields]
+
+        k = f(*args)
+        return np.array(np.broadcast_to(k, (x1.shape[0], x2.shape[0])),
+                        dtype=float)
+
+    def kernel_diagonal(self, name, values, x, fields=None):
+        """
+        evaluates the diagonal of a covariance block between the points x and
+        themselves, without assembling the block.
+        """
+        x = _coordinates(x)
+        if not(x.shape[1] == self.dim):
+            raise ValueError('expecting points of dimension {}'.format(self.dim))
+
+        if fields is None:
+            fields = [np.zeros(x.shape[0])] * len(self._field_names)
+        fields = [np.asarray(v, dtype=float).ravel() for v in fields]
+
+        if not(self._gaussian is None):
+            return self._gaussian.diagonal(name, values, x, fields=fields)
+
+        f = self._function(name)
+
+        args  = [x[:,k] for k in range(self.dim)] * 2
+        args += list(values) + fields + fields
+
+        k = f(*args)
+        return np.array(np.broadcast_to(k, (x.shape[0],)), dtype=float)
+
+    def set_data(self, x_u, y_u, x_f, y_f, fields=None):
+        """
+        sets the observations of u and f.
+
+        fields: dict
+            values of the Fields of the operator at x_f, the keys are Fields
+            or their names
+
+        The covariance matrix only depends on the points (and the Fields), so
+        the cached factorizations are kept if they do not change, e.g. when
+        consecutive time steps are observed at the same locations.
+        """
+        x_u = _coordinates(x_u)
+        x_f = _coordinates(x_f)
+        y = np.concatenate((np.asarray(y_u, dtype=float).ravel(),
+                            np.asarray(y_f, dtype=float).ravel()))
+
+        if not(y.size == x_u.shape[0] + x_f.shape[0]):
+            raise ValueError('inconsistent number of points and values')
+
+        values = self._field_values_at(fields, x_f.shape[0])
+
+        same = (not(self._x_u is None) and
+                np.array_equal(x_u, self._x_u) and
+                np.array_equal(x_f, self._x_f) and
+                all(np.array_equal(v, w) for v, w in zip(values, self._field_values)))
+
+        self._x_u = x_u
+        self._x_f = x_f
+        self._y = y
+        self._field_values = values
+
+        if not same:
+            self._factorize.clear()
+            self._last = None
+            self._last_gradient = None
+
+    def _field_values_at(self, fields, n):
+        """returns the values of the Fields at n points of f, in order."""
+        fields = {str(k): v for k, v in (fields or {}).items()}
+        values = []
+        for name in self._field_names:
+            if not(name in fields):
+                raise ValueError('missing values of the Field {}'.format(name))
+
+            v = np.asarray(fields[name], dtype=float).ravel()
+            if not(v.size == n):
+                raise ValueError('expecting {} values of {}'.format(n, name))
+            values.append(v)
+        return values
+
+    def covariance(self, values):
+        """returns the joint covariance matrix of the observations."""
+        F = self._field_values
+        return self._block(values, self._x_u, self._x_f, F,
+                           self._x_u, self._x_f, F)
+
+    def covariance_gradient(self, values):
+        """returns the derivatives of the covariance matrix."""
+        values = tuple(float(i) for i in values)
+        if not(self._last_gradient is None) and self._last_gradient[0] == values:
+            return self._last_gradient[1]
+
+        F = self._field_values
+        dK = []
+        for p in range(0, len(self._param_names)):
+            dK += [np.block([
+                [self.kernel('uu', values, self._x_u, self._x_u, p=p),
+                 self.kernel('uf', values, self._x_u, self._x_f, p=p, fields2=F)],
+                [self.kernel('fu', values, self._x_f, self._x_u, p=p, fields1=F),
+                 self.kernel('ff', values, self._x_f, self._x_f, p=p,
+                             fields1=F, fields2=F)]])]
+
+        self._last_gradient = (values, dK)
+        return dK
+
+    def _factor(self, values):
+        if self._y is None:
+            raise ValueError('no data, use set_data first')
+
+        values = tuple(float(i) for i in values)
+        if not(len(values) == len(self._param_names)):
+            raise ValueError('expecting {} values'.format(len(self._param_names)))
+
+        if not(self._last is None) and self._last[0] == values:
+            return self._last[1]
+
+        key = tuple(values[i] for i in self._kernel_indices)
+        x_u = self._x_u
+        x_f = self._x_f
+
+        timings = [0., 0.]
+        def kuu():
+            t = time.perf_counter()
+            K = self.kernel('uu', values, x_u, x_u)
+            timings[1] = time.perf_counter() - t
+            return K
+
+        fields = self._field_values
+
+        t = time.perf_counter()
+        Kuf = self.kernel('uf', values, x_u, x_f, fields2=fields)
+        Kff = self.kernel('ff', values, x_f, x_f, fields1=fields, fields2=fields)
+        timings[0] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        F = self._factorize(key, kuu, Kuf, Kff)
+        t_factorization = time.perf_counter() - t - timings[1]
+
+        self._timings = (timings[0] + timings[1], t_factorization)
+        self._last = (values, F)
+        return F
+
+    def _record(self, values, value, t_assembly, t_solve, factor=None):
+        if self.trace is None:
+            return
+
+        if self.trace.names is None:
+            self.trace.names = list(self._param_names)
+
+        F = self._last[1] if factor is None else factor
+        self.trace.record(values, value,
+                          t_assembly=self._timings[0] + t_assembly,
+                          t_factorization=self._timings[1],
+                          t_solve=t_solve,
+                          jitter=F.jitter,
+                          condition=F.condition())
+
+        # the cost of the factorization is only counted once
+        self._timings = (0., 0.)
+
+    def nlml(self, values):
+        """returns the negative log marginal likelihood."""
+        F = self._factor(values)
+
+        t = time.perf_counter()
+        val = _nlml(F, self._y)
+        self._record(values, val, 0., time.perf_counter() - t)
+        return val
+
+    def nlml_and_grad(self, values):
+        """
+        returns the negative log marginal likelihood and its gradient with
+        respect to the hyperparameters.
+        """
+        F = self._factor(values)
+
+        t = time.perf_counter()
+        dK = self.covariance_gradient(values)
+        t_assembly = time.perf_counter() - t
+
+        t = time.perf_counter()
+        val = _nlml(F, self._y)
+        grad = nlml_gradient(F, self._y, dK)
+        self._record(values, val, t_assembly, time.perf_counter() - t)
+        return val, grad
+
+    def predict(self, x, output='u', values=None, variance=False,
+                chunk_size=10000, fields=None):
+        """
+        returns the posterior mean of u or f at the points x, and its variance
+        if variance is True.
+
+        The points are processed by chunks of chunk_size, so only the cross
+        covariance of a chunk with the observations is in memory. The factor
+        of the covariance matrix of the observations is the cached one when
+        values did not change.
+
+        output: str
+            'u' or 'f'
+        values: list
+            hyperparameters, the estimated ones (values) by default
+        fields: dict
+            values of the Fields at x, needed to predict f
+        """
+        if not(output in ('u', 'f')):
+            raise ValueError("expecting output 'u' or 'f', given {}".format(output))
+
+        if values is None:
+            values = self.values
+        if values is None:
+            values = self.factor_values
+        if values is None:
+            raise ValueError('no hyperparameters, use fit first')
+
+        values = tuple(float(i) for i in values)
+        F = self._factor(values)
+        alpha = F.solve(self._y)
+
+        x = _coordinates(x)
+        if output == 'f':
+            fields = self._field_values_at(fields, x.shape[0])
+        else:
+            fields = None
+
+        train = self._field_values
+        mean = np.zeros(x.shape[0])
+        var = np.zeros(x.shape[0]) if variance else None
+        for start in range(0, x.shape[0], chunk_size):
+            end = min(start + chunk_size, x.shape[0])
+            xs = x[start:end]
+            fs = None if fields is None else [v[start:end] for v in fields]
+
+            if output == 'u':
+                Ks = np.hstack([
+                    self.kernel('uu', values, xs, self._x_u),
+                    self.kernel('uf', values, xs, self._x_f, fields2=train)])
+            else:
+                Ks = np.hstack([
+                    self.kernel('fu', values, xs, self._x_u, fields1=fs),
+                    self.kernel('ff', values, xs, self._x_f, fields1=fs,
+                                fields2=train)])
+
+            mean[start:end] = Ks.dot(alpha)
+
+            if variance:
+                name = output + output
+                V = F.solve_lower(Ks.T)
+                var[start:end] = (self.kernel_diagonal(name, values, xs, fields=fs)
+                                  - np.sum(V**2, axis=0))
+
+        if variance:
+            # rounding errors may give small negative values
+            return mean, np.maximum(var, 0.)
+        return mean
+
+    def _block(self, values, x1_u, x1_f, fields1, x2_u, x2_f, fields2):
+        """returns the covariance of the observations (u, f) at the points 1
+        and 2."""
+        return np.block([
+            [self.kernel('uu', values, x1_u, x2_u),
+             self.kernel('uf', values, x1_u, x2_f, fields2=fields2)],
+            [self.kernel('fu', values, x1_f, x2_u, fields1=fields1),
+             self.kernel('ff', values, x1_f, x2_f, fields1=fields1, fields2=fields2)]])
+
+    def factor_chunks(self, values, chunks, directory=None):
+        """
+        factorizes the covariance matrix of observations given by chunks,
+        e.g. a dataset.ChunkReader, without assembling the whole matrix.
+
+        Every chunk (x_u, y_u, x_f, y_f), optionally followed by the values
+        of the Fields at x_f, adds a block of rows to the factor. Only the
+        points of the previous chunks are kept in memory, the factor itself
+        is memory-mapped in directory if given.
+
+        returns a linalg.IncrementalCholesky.
+        """
+        return self._factor_chunks(values, chunks, directory)[0]
+
+    def _factor_chunks(self, values, chunks, directory):
+        """returns the factor and the times of assembly and factorization."""
+        values = tuple(float(i) for i in values)
+        F = IncrementalCholesky(directory=directory, jitter=self._noise,
+                                **self._options)
+
+        timings = [0., 0.]
+        previous = []
+        for data in chunks:
+            # the last chunks of u or f may be empty
+            x_u, x_f = [_coordinates(x) if len(x) else np.zeros((0, self.dim))
+                        for x in (data[0], data[2])]
+            y = np.concatenate((np.asarray(data[1], dtype=float).ravel(),
+                                np.asarray(data[3], dtype=float).ravel()))
+            fields = self._field_values_at(data[4] if len(data) > 4 else None,
+                                           x_f.shape[0])
+
+            if not(y.size == x_u.shape[0] + x_f.shape[0]):
+                raise ValueError('inconsistent number of points and values')
+
+            t = time.perf_counter()
+            K_new = self._block(values, x_u, x_f, fields, x_u, x_f, fields)
+            K_new_old = [self._block(values, x_u, x_f, fields, *p)
+                         for p in previous]
+            K_new_old = (np.hstack(K_new_old) if K_new_old else
+                         np.zeros((y.size, 0)))
+            timings[0] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            F.append(K_new_old, K_new, y)
+            timings[1] += time.perf_counter() - t
+            previous.append((x_u, x_f, fields))
+
+        return F, timings
+
+    def nlml_chunks(self, values, chunks, directory=None):
+        """
+        returns the negative log marginal likelihood of observations given by
+        chunks, see factor_chunks.
+        """
+        F, timings = self._factor_chunks(values, chunks, directory)
+        self._timings = tuple(timings)
+
+        t = time.perf_counter()
+        val = F.nlml()
+        self._record(values, val, 0., time.perf_counter() - t, factor=F)
+        return val
+
+    def fit_chunks(self, x0, chunks, method='Nelder-Mead', directory=None,
+                   **kwargs):
+        """
+        estimates the hyperparameters from observations given by chunks, see
+        factor_chunks. The chunks are read again for every evaluation, so
+        they must be iterable several times. Other arguments are passed to
+        scipy.optimize.minimize.
+        """
+        from scipy.optimize import minimize
+
+        fun = lambda values: self.nlml_chunks(values, chunks,
+                                              directory=directory)
+
+        res = minimize(fun, np.asarray(x0, dtype=float), method=method,
+                       **kwargs)
+        self.values = res.x
+        return res
+
+    def fit(self, x0, method='L-BFGS-B', jac=True, **kwargs):
+        """
+        estimates the hyperparameters by minimizing the negative log marginal
+        likelihood, starting from x0. The analytic gradient is used when jac
+        is True. Other arguments are passed to scipy.optimize.minimize.
+        """
+        from scipy.optimize import minimize
+
+        if jac:
+            fun = self.nlml_and_grad
+        else:
+            fun = self.nlml
+
+        res = minimize(fun, np.asarray(x0, dtype=float), method=method,
+                       jac=jac, **kwargs)
+        self.values = res.x
+        return res
+# ...
+
+# ...
+def _namespace():
+    import sympy
+    from mlhiphy import calculus
+
+    ns = dict(vars(sympy))
+    ns.update({k: v for k, v in vars(calculus).items() if isinstance(v, type)})
+    return ns
+
+def _loader(derivatives):
+    """returns a function that evaluates a srepr string, after creating the
+    operators of partial_derivative given by their indices."""
+    from sympy import sympify
+    from mlhiphy.calculus import partial_derivative
+
+    for i in derivatives:
+        partial_derivative(i)
+    ns = _namespace()
+    return lambda e: sympify(e, locals=ns)
+
+def save_model(model, dirname):
+    """
+    saves a model, its data and the factor of its covariance matrix in the
+    directory dirname, as a dataset (see dataset.save_dataset): the arrays are
+    .npy files and the operator is stored in the header.
+
+    For a Gaussian kuu, the operator is numerical: the multi-index form of L
+    and the Gaussian parameters, as polynomials of the hyperparameters and
+    the Fields (see gaussian.GaussianOperator), and the model is loaded
+    without sympy. Otherwise, the derived kernels are stored with srepr. The
+    srepr of the expressions is stored in both cases, as metadata.
+
+    A model restored with load_model needs neither to derive its kernels nor
+    to factorize its covariance matrix again.
+    """
+    from mlhiphy.dataset import save_dataset
+
+    if model._y is None:
+        raise ValueError('no data, use set_data first')
+
+    n_u = model._x_u.shape[0]
+    arrays = {'x_u': model._x_u,
+              'y_u': model._y[:n_u],
+              'x_f': model._x_f,
+              'y_f': model._y[n_u:]}
+    for name, v in zip(model._field_names, model._field_values):
+        arrays['field.' + name] = v
+
+    attrs = {'noise': model._noise, 'options': model._options}
+    if not(model.values is None):
+        arrays['values'] = np.asarray(model.values, dtype=float)
+
+    factor = model.factor
+    if not(factor is None):
+        arrays['factor'] = factor.L
+        arrays['factor_values'] = np.asarray(model.factor_values)
+        attrs['jitter'] = factor.jitter
+
+    operator = {'params': list(model.param_names),
+                'fields': list(model._field_names),
+                'kernel_indices': list(model._kernel_indices),
+                'dim': model.dim}
+    if model._gaussian is None:
+        from sympy import srepr
+
+        operator['metadata'] = dict(model._describe())
+        operator['metadata']['kernels'] = {k: srepr(v) for k, v in
+                                           model.kernels.items()}
+    else:
+        operator['metadata'] = model._describe()
+        operator['gaussian'] = model._gaussian.as_dict()
+
+    return save_dataset(dirname, arrays, outputs=['u', 'f'],
+                        operator=operator, attrs=attrs)
+
+def load_model(dirname, mmap_mode='r', trace=None):
+    """
+    loads a model saved with save_model. The data and the factor of the
+    covariance matrix are memory-mapped with the given mode.
+
+    A model with a Gaussian kuu is loaded and evaluated without sympy.
+    Otherwise, and when the expressions of the model are accessed, they are
+    evaluated with sympify: only load trusted files.
+    """
+    from mlhiphy.dataset import open_dataset
+
+    data = open_dataset(dirname, mmap_mode=mmap_mode)
+    op = data.operator
+    options = data.attrs['options']
+
+    if 'gaussian' in op:
+        from mlhiphy.gaussian import GaussianOperator
+
+        model = OperatorGP.from_gaussian(GaussianOperator.from_dict(op['gaussian']),
+                                         op['metadata'], op['kernel_indices'],
+                                         noise=data.attrs['noise'], trace=trace,
+                                         **options)
+
+    else:
+        # the expressions are at the top level in older files
+        d = op.get('metadata', op)
+        load = _loader(d.get('derivatives', []))
+
+        kernels = {k: load(v) for k, v in d['kernels'].items()}
+        model = OperatorGP(load(d['expr']), load(d['kuu']), load(d['xi']),
+                           load(d['xj']), params=[load(i) for i in d['params']],
+                           noise=data.attrs['noise'], trace=trace,
+                           kernels=kernels, **options)
+
+    fields = {name: data['field.' + name] for name in model._field_names}
+    model.set_data(data['x_u'], data['y_u'], data['x_f'], data['y_f'],
+                   fields=fields)
+
+    if 'values' in data:
+        model.values = np.array(data['values'])
+
+    if 'factor' in data:
+        factor = CholeskyFactor(data['factor'], jitter=data.attrs['jitter'])
+        model.set_factor(data['factor_values'], factor)
+
+    return model
+# ...
@@ -0,0 +1,666 @@
+# coding: utf-8
+
+import os
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from scipy.optimize import minimize
+from scipy.optimize import OptimizeResult
+
+from mlhiphy.linalg import CholeskyFactor
+
+
+# ... the objectives of each worker process, the model is unpickled only once
+#     so that its lambdified kernels, its cached factorization and the
+#     memoized values are reused by all the restarts that run in the worker
+_worker_objectives = None
+
+def _init_worker(model, cache):
+    global _worker_objectives
+    _worker_objectives = _Objectives(model, cache)
+# ...
+
+# ...
+class MemoizedNLML(object):
+    """
+    Wraps an objective function with a bounded LRU cache keyed on the
+    hyperparameters rounded to the given number of decimals, so that the
+    points revisited by an optimizer (e.g. the vertices of a Nelder-Mead
+    simplex) are not evaluated again.
+
+    Examples
+
+    >>> fun = MemoizedNLML(model.nlml, maxsize=256)
+    >>> minimize(fun, x0, method='Nelder-Mead')
+    >>> fun.hits, fun.misses
+    """
+
+    def __init__(self, fun, maxsize=128, decimals=12):
+        self._fun = fun
+        self._maxsize = maxsize
+        self._decimals = decimals
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __call__(self, values):
+        key = tuple(np.round(np.asarray(values, dtype=float), self._decimals))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return _copy(self._cache[key])
+
+        self.misses += 1
+        r = self._fun(values)
+        self._cache[key] = _copy(r)
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return r
+
+def _copy(r):
+    # gradients must not be shared with the caller, optimizers may modify them
+    if isinstance(r, tuple):
+        return tuple(np.copy(i) if isinstance(i, np.ndarray) else i for i in r)
+    return r
+# ...
+
+# ...
+def _objective(model, jac, cache=None):
+    """
+    returns the function to minimize. Points where the covariance matrix is
+    not positive definite, even with jitter, or where the value is not finite
+    get an infinite value. If cache is given, the function is memoized with
+    an LRU cache of this size.
+    """
+    if jac:
+        def fun(values):
+            try:
+                val, grad = model.nlml_and_grad(values)
+            except np.linalg.LinAlgError:
+                return np.inf, np.zeros(len(values))
+            if not np.isfinite(val):
+                return np.inf, np.zeros(len(values))
+            return val, grad
+    else:
+        def fun(values):
+            try:
+                val = model.nlml(values)
+            except np.linalg.LinAlgError:
+                return np.inf
+            if not np.isfinite(val):
+                return np.inf
+            return val
+
+    if cache:
+        fun = MemoizedNLML(fun, maxsize=cache)
+    return fun
+
+class _Objectives(object):
+    """objectives of a model, shared by all the restarts run in a process."""
+
+    def __init__(self, model, cache=None):
+        self._model = model
+        self._cache = cache
+        self._functions = {}
+
+    def __call__(self, jac):
+        if not(jac in self._functions):
+            self._functions[jac] = _objective(self._model, jac,
+                                              cache=self._cache)
+        return self._functions[jac]
+
+def _minimize(fun, x0, method, jac, kwargs):
+    memoized = isinstance(fun, MemoizedNLML)
+    if memoized:
+        hits = fun.hits
+        misses = fun.misses
+
+    try:
+        res = minimize(fun, x0, method=method, jac=jac, **kwargs)
+    except np.linalg.LinAlgError as e:
+        res = OptimizeResult(x=x0, fun=np.inf, success=False, status=-1,
+                             nit=0, nfev=0, message=str(e))
+
+    if memoized:
+        res.cache_hits = fun.hits - hits
+        res.cache_misses = fun.misses - misses
+    return res
+
+def _check_point(model, x0, name='x0'):
+    """returns x0 as an array, if it has one value per parameter."""
+    x0 = np.asarray(x0, dtype=float)
+    if not(x0.shape == (len(model.param_names),)):
+        raise ValueError('expecting {} with {} values, given {}'.format(
+                         name, len(model.param_names), x0.tolist()))
+    return x0
+
+def _segment(objectives, index, x0, simplex, maxiter, method, jac, kwargs):
+    """runs at most maxiter iterations, starting from x0 (or simplex)."""
+    kwargs = dict(kwargs)
+    options = dict(kwargs.pop('options', {}) or {})
+    if not(maxiter is None):
+        options['maxiter'] = maxiter
+    if not(simplex is None):
+        options['initial_simplex'] = simplex
+
+    return index, _minimize(objectives(jac), x0, method, jac,
+                            dict(kwargs, options=options))
+
+def _run_segment(*args):
+    return _segment(_worker_objectives, *args)
+# ...
+
+# ...
+class _SerialPool(object):
+    """runs the segments in the current process."""
+
+    def __init__(self, model, cache=None):
+        self._objectives = _Objectives(model, cache)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, *args):
+        future = Future()
+        future.set_result(_segment(self._objectives, *args))
+        return future
+
+class _ProcessPool(object):
+    """runs the segments in a pool of processes, each with its own model."""
+
+    def __init__(self, model, n_jobs, cache=None):
+        self._executor = ProcessPoolExecutor(max_workers=n_jobs,
+                                             initializer=_init_worker,
+                                             initargs=(model, cache))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # pruned restarts may still be running
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, *args):
+        return self._executor.submit(_run_segment, *args)
+# ...
+
+# ...
+def initial_design(box, n, seed=None, method='random', log=False):
+    """
+    returns n initial points in a box.
+
+    box: list
+        (low, high) for every parameter
+    seed: int or numpy.random.Generator
+        the same seed gives the same design
+    method: str
+        'random' for uniform samples, 'sobol' for a scrambled Sobol sequence
+        or 'lhs' for a Latin hypercube. The quasi-random designs cover the box
+        more evenly, so fewer restarts are needed.
+    log: bool
+        if True, the box is given for the logarithm of the parameters and the
+        returned points are exp of the samples
+    """
+    box = np.asarray(box, dtype=float)
+    d = len(box)
+
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        samples = rng.random((n, d))
+
+    elif method == 'sobol':
+        from scipy.stats import qmc
+        sampler = qmc.Sobol(d, scramble=True, seed=seed)
+        m = int(np.ceil(np.log2(max(n, 1))))
+        # balanced sequences need a power of 2 of points
+        samples = sampler.random_base2(m)[:n]
+
+    elif method == 'lhs':
+        from scipy.stats import qmc
+        samples = qmc.LatinHypercube(d, seed=seed).random(n)
+
+    else:
+        raise ValueError('unknown design {}'.format(method))
+
+    low = box[:,0]
+    high = box[:,1]
+    x = low + (high - low) * samples
+    if log:
+        x = np.exp(x)
+    return x
+# ...
+
+# ...
+class MultiStartResult(object):
+    """
+    Result of a multi-start optimization.
+
+    best: OptimizeResult
+        the successful run with the lowest value (the lowest value among all
+        runs if none succeeded)
+    runs: list
+        all the runs, in the order of their initial points
+    """
+
+    def __init__(self, runs):
+        self.runs = runs
+
+        successful = [r for r in runs if r.success]
+        if not successful:
+            successful = runs
+
+        self.best = min(successful, key=lambda r: r.fun)
+
+    @property
+    def x(self):
+        return self.best.x
+
+    @property
+    def fun(self):
+        return self.best.fun
+
+    def __repr__(self):
+        return 'MultiStartResult(fun={}, x={}, runs={})'.format(self.fun,
+                                                               self.x,
+                                                               len(self.runs))
+# ...
+
+# ...
+def _is_duplicate(x, optima, xtol):
+    for y in optima:
+        if np.linalg.norm(x - y) <= xtol * (1. + np.linalg.norm(y)):
+            return True
+    return False
+
+def iter_restarts(model, x0s, method='L-BFGS-B', jac=True, n_jobs=None,
+                  check_every=None, margin=None, xtol=None, cache=None,
+                  **kwargs):
+    """
+    minimizes the negative log marginal likelihood of the model from every
+    initial point of x0s and yields (index, OptimizeResult) as soon as a
+    restart is finished.
+
+    n_jobs: int
+        number of worker processes, None means the number of cpus.
+        With n_jobs = 1 the restarts are run in the current process.
+    check_every: int
+        if given, the restarts are run by segments of check_every iterations
+        (up to options['maxiter'] in total) and are checked after every
+        segment. A restart is stopped if
+        - its value is larger than the best converged value plus margin
+        - it is within a relative distance xtol of an optimum found by another
+          restart
+        Stopped restarts are marked as unsuccessful, with pruned = True.
+        Every segment is a new call to scipy.optimize.minimize from the last
+        point: Nelder-Mead continues from its simplex, but gradient based
+        methods (e.g. L-BFGS-B) lose their curvature information, so the
+        trajectory differs from an unsegmented run.
+    cache: int
+        if given, the objective is memoized with an LRU cache of this size,
+        see MemoizedNLML. The cache is shared by the restarts (and segments)
+        that run in the same process.
+
+    Other arguments are passed to scipy.optimize.minimize.
+
+    In parallel, which restarts are stopped depends on the order in which
+    segments finish.
+    """
+    x0s = [_check_point(model, x0, name='initial points') for x0 in x0s]
+
+    options = kwargs.get('options', {}) or {}
+    maxiter = options.get('maxiter', None)
+    segment = maxiter if check_every is None else check_every
+
+    if n_jobs == 1:
+        pool = _SerialPool(model, cache=cache)
+    else:
+        pool = _ProcessPool(model, n_jobs, cache=cache)
+
+    best = np.inf
+    optima = []
+    nit = [0] * len(x0s)
+    nfev = [0] * len(x0s)
+    hits = [0] * len(x0s)
+    misses = [0] * len(x0s)
+    requested = [segment] * len(x0s)
+
+    with pool:
+        pending = {}
+        for i, x0 in enumerate(x0s):
+            future = pool.submit(i, x0, None, segment, method, jac, kwargs)
+            pending[future] = i
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: pending[f]):
+                pending.pop(future)
+                i, res = future.result()
+
+                # a segment that stops before its iteration budget has
+                # converged or failed, it is not continued
+                stopped = (not(requested[i] is None) and
+                           res.get('nit', 0) < requested[i])
+
+                nit[i] += res.get('nit', 0)
+                nfev[i] += res.get('nfev', 0)
+                res.nit = nit[i]
+                res.nfev = nfev[i]
+                if 'cache_hits' in res:
+                    hits[i] += res.cache_hits
+                    misses[i] += res.cache_misses
+                    res.cache_hits = hits[i]
+                    res.cache_misses = misses[i]
+                res.pruned = False
+
+                finished = (check_every is None or res.success or stopped or
+                            not(maxiter is None) and nit[i] >= maxiter)
+
+                if not finished:
+                    if not(margin is None) and res.fun > best + margin:
+                        res.pruned = True
+                        res.message = 'pruned: dominated by another restart'
+
+                    elif not(xtol is None) and _is_duplicate(res.x, optima, xtol):
+                        res.pruned = True
+                        res.message = 'pruned: converging to a known optimum'
+
+                    if res.pruned:
+                        res.success = False
+                        finished = True
+
+                if res.success:
+                    optima.append(res.x)
+                    best = min(best, res.fun)
+
+                if finished:
+                    yield i, res
+                    continue
+
+                simplex = None
+                if 'final_simplex' in res:
+                    simplex = res.final_simplex[0]
+
+                requested[i] = segment
+                if not(maxiter is None):
+                    requested[i] = min(segment, maxiter - nit[i])
+
+                future = pool.submit(i, res.x, simplex, requested[i], method,
+                                     jac, kwargs)
+                pending[future] = i
+# ...
+
+# ...
+def multistart(model, box=None, n_restarts=10, x0s=None, seed=None,
+               design='random', log=False, n_jobs=None, method='L-BFGS-B',
+               jac=True, callback=None, **kwargs):
+    """
+    minimizes the negative log marginal likelihood of the model from several
+    initial points, spread over a pool of processes.
+
+    box: list
+        (low, high) for every parameter, used for the initial design
+    n_restarts: int
+        number of initial points
+    x0s: list
+        initial points, the initial design is not used if given
+    seed: int
+        seed of the initial design
+    design: str
+        'random', 'sobol' or 'lhs', see initial_design
+    log: bool
+        if True, box is given for the logarithm of the parameters
+    callback: callable
+        called as callback(index, result) when a restart is finished
+
+    check_every, margin and xtol enable the pruning of unpromising restarts,
+    see iter_restarts.
+
+    returns a MultiStartResult.
+    """
+    if x0s is None:
+        if box is None:
+            raise ValueError('expecting box or x0s')
+
+        if not(np.shape(box) == (len(model.param_names), 2)):
+            raise ValueError('expecting a box of {} (low, high) pairs, '
+                             'given {}'.format(len(model.param_names), box))
+
+        x0s = initial_design(box, n_restarts, seed=seed, method=design,
+                             log=log)
+
+    runs = [None] * len(x0s)
+    for i, res in iter_restarts(model, x0s, method=method, jac=jac,
+                                n_jobs=n_jobs, **kwargs):
+        runs[i] = res
+        if callback:
+            callback(i, res)
+
+    return MultiStartResult(runs)
+# ...
+
+# ...
+def backward_euler_steps(x, snapshots, field=None):
+    """
+    yields the observations (x_u, y_u, x_f, y_f) of consecutive time steps of
+    a backward Euler scheme L u_n = u_{n-1}, i.e. u := u_n and f := u_{n-1}.
+
+    x: ndarray
+        points where the snapshots are given
+    snapshots: list
+        values of the solution at consecutive time steps
+    field: Field
+        if given, the previous step is also the value of this Field, e.g. for
+        an operator linearized around the previous step, and the observations
+        are (x_u, y_u, x_f, y_f, {field: y_f})
+    """
+    for previous, current in zip(snapshots[:-1], snapshots[1:]):
+        if field is None:
+            yield x, current, x, previous
+        else:
+            yield x, current, x, previous, {field: previous}
+# ...
+
+# ...
+class Trajectory(object):
+    """
+    Result of the estimation of the hyperparameters over time steps.
+
+    x: ndarray
+        optimal hyperparameters, one row per time step
+    runs: list
+        the OptimizeResult of every time step
+    """
+
+    def __init__(self, runs):
+        self.runs = runs
+        self.x = np.asarray([r.x for r in runs])
+
+    @property
+    def fun(self):
+        return np.asarray([r.fun for r in self.runs])
+
+    @property
+    def success(self):
+        return np.asarray([r.success for r in self.runs])
+
+    def __repr__(self):
+        return 'Trajectory(steps={})'.format(len(self.runs))
+# ...
+
+# ...
+def track(model, steps, x0, method='L-BFGS-B', jac=True, callback=None,
+          cache=None, **kwargs):
+    """
+    estimates the hyperparameters for consecutive time steps.
+
+    Every optimization is started from the optimum of the previous step (the
+    last successful one), instead of a random point. The derived kernels are
+    shared by all the steps and, when the points do not move, so is the
+    factorization of the covariance matrix at the warm start.
+
+    steps: iterable
+        observations (x_u, y_u, x_f, y_f) for every time step, optionally
+        followed by the values of the Fields, see backward_euler_steps
+    x0: list
+        initial point for the first step
+    callback: callable
+        called as callback(step, result) after every step
+    cache: int
+        if given, the objective is memoized with an LRU cache of this size
+
+    Other arguments are passed to scipy.optimize.minimize.
+
+    returns a Trajectory.
+    """
+    x0 = _check_point(model, x0)
+
+    runs = []
+    for step, data in enumerate(steps):
+        model.set_data(*data)
+
+        fun = _objective(model, jac, cache=cache)
+        res = _minimize(fun, x0, method, jac, kwargs)
+        runs.append(res)
+        if res.success:
+            x0 = res.x
+
+        if callback:
+            callback(step, res)
+
+    return Trajectory(runs)
+# ...
+
+# ...
+def _save_checkpoint(filename, model, method, state):
+    d = dict(state)
+    d['method'] = method
+    d['params'] = list(model.param_names)
+
+    if not(model.factor is None):
+        d['factor_values'] = model.factor_values
+        d['factor_L'] = model.factor.L
+        d['factor_jitter'] = model.factor.jitter
+
+    d = {k: v for k, v in d.items() if not(v is None)}
+
+    # write then rename, a checkpoint is never left half written
+    tmp = '{}.tmp.npz'.format(filename)
+    np.savez(tmp, **d)
+    os.replace(tmp, filename)
+
+def _load_checkpoint(filename, model, method):
+    # the file is replaced by the next checkpoint, it must not stay open
+    with np.load(filename, allow_pickle=False) as f:
+        data = {k: f[k] for k in f.files}
+
+    if not(list(data['params']) == list(model.param_names)):
+        raise ValueError('checkpoint for parameters {}'.format(list(data['params'])))
+
+    if not(str(data['method']) == method):
+        raise ValueError('checkpoint for method {}'.format(data['method']))
+
+    if 'factor_L' in data:
+        try:
+            factor = CholeskyFactor(data['factor_L'],
+                                    jitter=float(data['factor_jitter']))
+            model.set_factor(data['factor_values'], factor)
+        except ValueError:
+            # the data of the model have changed
+            pass
+
+    state = {'x': data['x'], 'best_x': data['best_x'],
+             'simplex': data['simplex'] if 'simplex' in data else None,
+             'nit': int(data['nit']),
+             'nfev': int(data['nfev']),
+             'best_fun': float(data['best_fun']),
+             'success': bool(data['success']),
+             'finished': bool(data['finished'])}
+    return state
+# ...
+
+# ...
+def minimize_checkpointed(model, x0, filename, every=100, method='Nelder-Mead',
+                          jac=False, callback=None, cache=None, **kwargs):
+    """
+    minimizes the negative log marginal likelihood by segments of every
+    iterations, and saves a checkpoint in filename (npz) after each segment:
+    the optimizer state (current point and Nelder-Mead simplex), the number
+    of iterations, the best point so far and the Cholesky factor of the last
+    evaluation.
+
+    If filename exists, the optimization is resumed from it. The total
+    number of iterations is bounded by options['maxiter'] if given.
+    Gradient based methods restart from the current point, losing their
+    curvature information, while Nelder-Mead continues from its simplex.
+
+    callback: callable
+        called as callback(state) after every checkpoint
+    cache: int
+        if given, the objective is memoized with an LRU cache of this size,
+        shared by all the segments
+
+    Other arguments are passed to scipy.optimize.minimize.
+
+    returns an OptimizeResult.
+    """
+    options = kwargs.get('options', {}) or {}
+    maxiter = options.get('maxiter', None)
+
+    if os.path.exists(filename):
+        state = _load_checkpoint(filename, model, method)
+    else:
+        x0 = _check_point(model, x0)
+        state = {'x': x0, 'simplex': None, 'nit': 0, 'nfev': 0,
+                 'best_x': x0, 'best_fun': np.inf, 'success': False,
+                 'finished': False}
+
+    objectives = _Objectives(model, cache)
+    while not state['finished']:
+        n = every
+        if not(maxiter is None):
+            n = min(every, maxiter - state['nit'])
+            if n <= 0:
+                break
+
+        _, res = _segment(objectives, 0, state['x'], state['simplex'], n,
+                          method, jac, kwargs)
+
+        state['x'] = res.x
+        state['simplex'] = None
+        if 'final_simplex' in res:
+            state['simplex'] = res.final_simplex[0]
+        state['nit'] += res.get('nit', 0)
+        state['nfev'] += res.get('nfev', 0)
+        if res.fun < state['best_fun']:
+            state['best_x'] = res.x
+            state['best_fun'] = res.fun
+        state['success'] = bool(res.success)
+        state['finished'] = bool(res.success) or res.get('nit', 0) < n
+
+        _save_checkpoint(filename, model, method, state)
+        if callback:
+            callback(state)
+
+    if state['success']:
+        message = 'Optimization terminated successfully.'
+    elif state['finished']:
+        message = 'Optimization stopped before convergence.'
+    else:
+        message = 'Maximum number of iterations has been exceeded.'
+
+    return OptimizeResult(x=state['best_x'], fun=state['best_fun'],
+                          nit=state['nit'], nfev=state['nfev'],
+                          success=state['success'], message=message)
+# ...
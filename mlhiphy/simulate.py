@@ -0,0 +1,192 @@
+# coding: utf-8
+
+# Synthetic observations (x_u, y_u, x_f, y_f) for the problems of the
+# notebooks. Every generator draws its points from an explicit
+# numpy.random.Generator, so that the data is reproducible, and is vectorised.
+# generate runs a generator by chunks, in parallel, for large sizes.
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from mlhiphy.dataset import write_header
+from mlhiphy.dataset import open_dataset
+
+
+# ...
+def _noisy(rng, y, noise):
+    if noise > 0.:
+        y = y + noise * rng.standard_normal(y.shape)
+    return y
+
+def heat(rng, n, phi=1., noise=0.):
+    """
+    heat equation dt(u) - phi*dx(dx(u)) = f on [0, 1]^2, with the solution
+    u = exp(-t) sin(2 pi x) (see heat_equation/heat_eqn.py).
+
+    returns (X, y_u, X, y_f) where X has the columns (x, t).
+    """
+    X = rng.random((n, 2))
+    x = X[:,0]
+    t = X[:,1]
+
+    u = np.exp(-t) * np.sin(2*np.pi*x)
+    f = (4*np.pi**2*phi - 1.) * u
+    return X, _noisy(rng, u, noise), X, _noisy(rng, f, noise)
+
+def wave(rng, n, c=1., noise=0.):
+    """
+    wave equation dt(dt(u)) - c*dx(dx(u)) = f on [0, 1]^2, with the solution
+    u = (x - t)^2 + sin(x + t), so that f = 0 for c = 1 (see
+    wave_equation/).
+
+    returns (X, y_u, X, y_f) where X has the columns (x, t).
+    """
+    X = rng.random((n, 2))
+    x = X[:,0]
+    t = X[:,1]
+
+    s = np.sin(x + t)
+    u = (x - t)**2 + s
+    f = (1. - c) * (2. - s)
+    return X, _noisy(rng, u, noise), X, _noisy(rng, f, noise)
+
+def burgers(rng, n, tau=0.001, noise=0.):
+    """
+    one backward Euler step of Burgers' equation, u + tau*u*dx(u) = f, on
+    [0, 1] with f = x (see burgers_equation/). u = x/(1 + tau) is the exact
+    solution of dt(u) + u*dx(u) = 0 with u(x, 0) = x, at t = tau, which
+    satisfies the step up to O(tau^2).
+
+    returns (x, y_u, x, y_f).
+    """
+    x = rng.random(n)
+    u = x / (1. + tau)
+    return x, _noisy(rng, u, noise), x, _noisy(rng, x, noise)
+
+def backward_euler(rng, n, tau=0.02, alpha=1., steps=1, noise=0.):
+    """
+    steps of the backward Euler scheme u_k - tau*alpha*dx(dx(u_k)) = u_{k-1}
+    for the heat equation on [0, 2 pi], with u_0 = sin(x), whose exact
+    solution is u_k = sin(x) / (1 + tau*alpha)^k.
+
+    returns (x, y_u, x, y_f) for the last step, i.e. y_u = u_steps and
+    y_f = u_{steps-1}.
+    """
+    x = 2*np.pi * rng.random(n)
+    f = np.sin(x) / (1. + tau*alpha)**(steps - 1)
+    u = f / (1. + tau*alpha)
+    return x, _noisy(rng, u, noise), x, _noisy(rng, f, noise)
+
+def snapshots(rng, n, tau=0.02, alpha=1., steps=5, noise=0.):
+    """
+    returns the points x and the snapshots u_0, ..., u_steps of the backward
+    Euler scheme (see backward_euler), e.g. for optimize.backward_euler_steps.
+    """
+    x = 2*np.pi * rng.random(n)
+    u = [np.sin(x) / (1. + tau*alpha)**k for k in range(0, steps + 1)]
+    return x, [_noisy(rng, v, noise) for v in u]
+
+_generators = {'heat': heat,
+               'wave': wave,
+               'burgers': burgers,
+               'backward_euler': backward_euler}
+
+_coordinates = {'heat': ['x', 't'],
+                'wave': ['x', 't'],
+                'burgers': ['x'],
+                'backward_euler': ['x']}
+# ...
+
+# ...
+def _run_chunk(problem, seed, n, params):
+    rng = np.random.default_rng(seed)
+    return _generators[problem](rng, n, **params)
+
+def generate(problem, n, seed=None, chunk_size=1000000, n_jobs=None,
+             directory=None, **params):
+    """
+    generates n observations of a problem by chunks, in a pool of processes.
+
+    Every chunk has its own stream, spawned from seed, so that the result only
+    depends on seed and chunk_size, not on the number of processes.
+
+    problem: str
+        one of 'heat', 'wave', 'burgers', 'backward_euler'
+    n_jobs: int
+        number of worker processes, None means the number of cpus. With
+        n_jobs = 1 the chunks are generated in the current process.
+    directory: str
+        if given, the arrays are written by chunks as a dataset (see
+        dataset.open_dataset) instead of being kept in memory
+
+    Other arguments are passed to the generator.
+
+    returns the arrays {'x_u', 'y_u', 'x_f', 'y_f'} or the opened Dataset.
+
+    Examples
+
+    >>> data = generate('heat', 10**7, seed=0, directory='heat')
+    """
+    if not(problem in _generators):
+        raise ValueError('unknown problem {}, expecting one of {}'.format(
+                         problem, sorted(_generators.keys())))
+
+    if n < 1:
+        raise ValueError('expecting a positive number of points, given {}'.format(n))
+
+    sizes = [min(chunk_size, n - start) for start in range(0, n, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    names = ('x_u', 'y_u', 'x_f', 'y_f')
+
+    arrays = None
+    def _store(k, chunk):
+        nonlocal arrays
+        if arrays is None:
+            arrays = {}
+            for name, a in zip(names, chunk):
+                shape = (n,) + a.shape[1:]
+                if directory is None:
+                    arrays[name] = np.empty(shape, dtype=a.dtype)
+                else:
+                    filename = os.path.join(directory, name + '.npy')
+                    arrays[name] = np.lib.format.open_memmap(
+                        filename, mode='w+', dtype=a.dtype, shape=shape)
+
+        start = k * chunk_size
+        for name, a in zip(names, chunk):
+            arrays[name][start:start+a.shape[0]] = a
+
+    if not(directory is None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # an existing dataset is invalid until its new header is written
+        header = os.path.join(directory, 'header.json')
+        if os.path.exists(header):
+            os.remove(header)
+
+    if n_jobs == 1:
+        for k, (s, m) in enumerate(zip(seeds, sizes)):
+            _store(k, _run_chunk(problem, s, m, params))
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_run_chunk, problem, s, m, params)
+                       for s, m in zip(seeds, sizes)]
+            for k, future in enumerate(futures):
+                _store(k, future.result())
+
+    if directory is None:
+        return arrays
+
+    for a in arrays.values():
+        a.flush()
+
+    attrs = dict(params)
+    attrs.update({'problem': problem, 'seed': seed, 'chunk_size': chunk_size})
+    write_header(directory, {name: name + '.npy' for name in names},
+                 coordinates=_coordinates[problem], outputs=['u', 'f'],
+                 attrs=attrs)
+    return open_dataset(directory)
+# ...
@@ -0,0 +1,378 @@
+# coding: utf-8
+
+# Append-only store of flat records, e.g. the results of fits.
+#
+#     results/
+#         shard-<pid>-<token>.jsonl   one file per writer process
+#         part-0.npz                  columns of compacted records, and masks
+#                                     of the records that have the key
+#         index.json                  parts, their sizes and bytes of every
+#                                     shard compacted
+#
+# Every process appends to its own shard, so that workers can write without
+# locks. compact converts the records into columns (npz) for fast reads, the
+# shards are never rewritten: the index stores how many bytes of every shard
+# are already in a part, so writers can go on appending while compacting.
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import numpy as np
+
+
+_index = 'index.json'
+
+# ...
+def _flatten(record, prefix='', out=None):
+    if out is None:
+        out = {}
+    for k, v in record.items():
+        name = prefix + str(k)
+        if isinstance(v, dict):
+            _flatten(v, name + '.', out)
+        elif isinstance(v, np.ndarray):
+            out[name] = v.tolist()
+        elif isinstance(v, np.generic):
+            out[name] = v.item()
+        else:
+            out[name] = v
+    return out
+
+def _is_number(v):
+    return v is None or isinstance(v, (int, float))
+
+def _objects(values):
+    a = np.empty(len(values), dtype=object)
+    a[:] = values
+    return a
+
+def _column(values):
+    """returns a bool or an int array if all the values are booleans or
+    integers, a float array if they are numbers (None is nan), an object
+    array otherwise."""
+    if values and all(isinstance(v, bool) for v in values):
+        return np.asarray(values, dtype=bool)
+    if values and all(type(v) is int for v in values):
+        a = np.asarray(values)
+        # larger integers than int64 are objects
+        if a.dtype.kind == 'i':
+            return a
+    if all(_is_number(v) for v in values):
+        return np.asarray([np.nan if v is None else v for v in values],
+                          dtype=float)
+    return _objects(values)
+
+def _part_column(values, present):
+    """returns the array of a column of a part, from the values of the
+    records that have the key (present), with the dtype given by _column."""
+    given = [v for v, p in zip(values, present) if p]
+    if any(v is None for v in given):
+        c = _objects(given)
+    else:
+        c = _column(given)
+
+    if c.dtype == object:
+        a = _objects([None] * len(values))
+    elif c.dtype.kind in 'bi':
+        a = np.zeros(len(values), dtype=c.dtype)
+    else:
+        a = np.full(len(values), np.nan)
+    a[np.asarray(present, dtype=bool)] = c
+    return a
+
+def _concatenate(pieces):
+    """
+    concatenates (values, present) pieces of a column. Missing values are
+    nan in numerical columns and None in object columns, values that are
+    present (e.g. a nan nlml) are kept.
+    """
+    if not pieces:
+        return np.zeros(0)
+
+    if not any(a.dtype == object for a, _ in pieces):
+        arrays = []
+        for a, present in pieces:
+            if a.dtype.kind in 'bi' and not present.all():
+                a = np.where(present, a, np.nan)
+            arrays.append(a)
+        return np.concatenate(arrays)
+
+    values = []
+    for a, present in pieces:
+        values += [v if p else None for v, p in zip(a.tolist(), present)]
+    return _objects(values)
+
+def kernel_hash(*exprs):
+    """returns a short hash identifying kernels or operators, from their
+    string representation."""
+    h = hashlib.sha1()
+    for e in exprs:
+        h.update(str(e).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+def fit_record(model, res, dataset=None, **extra):
+    """
+    returns the record of a fit of an OperatorGP: the estimated parameters
+    (as 'param.<name>'), the nlml, the number of iterations and evaluations,
+    the kernel hash and the dataset id. Other arguments are added to the
+    record.
+    """
+    record = {'param': {p: float(v) for p, v in zip(model.param_names, res.x)},
+              'nlml': float(res.fun),
+              'success': bool(res.success),
+              'nit': int(res.get('nit', 0)),
+              'nfev': int(res.get('nfev', 0)),
+              'kernel_hash': kernel_hash(*[model.kernels[k] for k in
+                                           sorted(model.kernels.keys())]),
+              'dataset': dataset}
+    record.update(extra)
+    return record
+# ...
+
+# ...
+class ResultStore(object):
+    """
+    Append-only store of records (dictionaries, flattened with dotted names),
+    that can be written concurrently by several processes and read by
+    columns.
+
+    Examples
+
+    >>> store = ResultStore('results')
+    >>> store.append(fit_record(model, res, dataset='heat', t_fit=12.3))
+    >>> columns = store.columns(['param.alpha', 'nlml'])
+    """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._directory = directory
+        self._pid = None
+        self._shard = None
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def __getstate__(self):
+        # every process opens its own shard
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        state['_shard'] = None
+        return state
+
+    def _shard_name(self):
+        if not(self._pid == os.getpid()):
+            self._pid = os.getpid()
+            self._shard = 'shard-{}-{}.jsonl'.format(self._pid,
+                                                     uuid.uuid4().hex[:8])
+        return self._shard
+
+    def append(self, record, sync=False):
+        """appends a record, to the shard of the current process. The file is
+        flushed, and synced to the disk if sync is True."""
+        record = dict(_flatten(record))
+        record.setdefault('time', time.time())
+
+        filename = os.path.join(self._directory, self._shard_name())
+        with open(filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def extend(self, records, sync=False):
+        """appends several records at once."""
+        lines = []
+        for record in records:
+            record = dict(_flatten(record))
+            record.setdefault('time', time.time())
+            lines.append(json.dumps(record) + '\n')
+
+        filename = os.path.join(self._directory, self._shard_name())
+        with open(filename, 'a') as f:
+            f.write(''.join(lines))
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    # ...
+    def _read_index(self):
+        filename = os.path.join(self._directory, _index)
+        if not os.path.exists(filename):
+            return {'parts': [], 'sizes': [], 'offsets': {}}
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    def _shards(self):
+        return sorted(i for i in os.listdir(self._directory)
+                      if i.startswith('shard-') and i.endswith('.jsonl'))
+
+    def _read_shard(self, name, offset):
+        """returns the complete records of a shard after offset, and the
+        offset of the end of the last complete record."""
+        records = []
+        with open(os.path.join(self._directory, name), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        # a writer may be in the middle of a line
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                pass
+        return records, offset + end
+
+    def _pending(self, index):
+        records = []
+        offsets = {}
+        for name in self._shards():
+            r, end = self._read_shard(name, index['offsets'].get(name, 0))
+            records += r
+            offsets[name] = end
+        return records, offsets
+    # ...
+
+    # ...
+    def records(self):
+        """returns all the records, as dictionaries."""
+        index = self._read_index()
+        records = []
+        for part, n in zip(index['parts'], index['sizes']):
+            columns = self._read_part(part)
+            for i in range(0, n):
+                record = {}
+                for k, (v, present) in columns.items():
+                    # only missing keys are absent, nan and None are kept
+                    if present[i]:
+                        value = v[i]
+                        record[k] = value.item() if isinstance(value, np.generic) else value
+                records.append(record)
+
+        records += self._pending(index)[0]
+        return records
+
+    def __len__(self):
+        return len(self.records())
+
+    def columns(self, names=None):
+        """
+        returns the records by columns, as a dictionary of arrays. Numerical
+        columns are float arrays (nan for missing values), boolean and
+        integer columns without missing values are bool and int arrays, the
+        others are object arrays (None for missing values). Only the given
+        columns are read.
+        """
+        index = self._read_index()
+        parts = [(self._read_part(part, names), n)
+                 for part, n in zip(index['parts'], index['sizes'])]
+        pending, _ = self._pending(index)
+
+        if names is None:
+            keys = set()
+            for c, _ in parts:
+                keys |= set(c.keys())
+            for r in pending:
+                keys |= set(r.keys())
+            names = sorted(keys)
+
+        out = {}
+        for name in names:
+            pieces = []
+            for c, n in parts:
+                if name in c:
+                    pieces.append(c[name])
+                else:
+                    pieces.append((np.full(n, np.nan), np.zeros(n, dtype=bool)))
+            # only the records that are not compacted yet are converted
+            if pending:
+                pieces.append((_column([r.get(name) for r in pending]),
+                               np.asarray([name in r for r in pending])))
+            out[name] = _concatenate(pieces)
+        return out
+    # ...
+
+    # ...
+    def _read_part(self, part, names=None):
+        """returns the columns of a part, only those in names if given, as
+        (values, present) where present is False for the records without
+        the key."""
+        with np.load(os.path.join(self._directory, part),
+                     allow_pickle=False) as data:
+            columns = {}
+            for k in data.files:
+                if k.startswith('mask:'):
+                    continue
+
+                name = k[5:] if k.startswith('json:') else k
+                if not(names is None) and not(name in names):
+                    continue
+
+                if k.startswith('json:'):
+                    values = _objects([json.loads(v) for v in data[k]])
+                else:
+                    values = data[k]
+
+                if 'mask:' + name in data.files:
+                    present = data['mask:' + name]
+                else:
+                    present = np.ones(len(values), dtype=bool)
+                columns[name] = (values, present)
+            return columns
+
+    def compact(self):
+        """
+        moves the records written so far into a columnar part, so that they
+        are read faster. Writers can go on appending during the compaction,
+        but only one process should compact at a time.
+
+        returns the number of compacted records.
+        """
+        index = self._read_index()
+        records, offsets = self._pending(index)
+        if not records:
+            return 0
+
+        keys = set()
+        for r in records:
+            keys |= set(r.keys())
+
+        arrays = {}
+        for k in sorted(keys):
+            present = [k in r for r in records]
+            c = _part_column([r.get(k) for r in records], present)
+            if c.dtype == object:
+                arrays['json:' + k] = np.asarray([json.dumps(v) for v in c])
+            else:
+                arrays[k] = c
+
+            # the records without the key, a mask is only stored if needed
+            if not all(present):
+                arrays['mask:' + k] = np.asarray(present)
+
+        part = 'part-{}.npz'.format(len(index['parts']))
+        tmp = os.path.join(self._directory, part + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, os.path.join(self._directory, part))
+
+        index['parts'].append(part)
+        index['sizes'].append(len(records))
+        index['offsets'].update(offsets)
+
+        tmp = os.path.join(self._directory, _index + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self._directory, _index))
+
+        return len(records)
+# ...
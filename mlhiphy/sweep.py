@@ -0,0 +1,134 @@
+# coding: utf-8
+
+import os
+import json
+import traceback
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+from mlhiphy.utilities import to_json
+
+
+# ...
+def grid(**axes):
+    """
+    returns the cells of the cartesian product of the given axes, as a list of
+    dictionaries.
+
+    Examples
+
+    >>> grid(tau=[0.01, 0.02], n=[10, 20], seed=range(5))
+    """
+    names = list(axes.keys())
+    return [dict(zip(names, values))
+            for values in product(*[list(axes[k]) for k in names])]
+# ...
+
+# ...
+def cell_key(cell):
+    """returns a string identifying a cell of the grid."""
+    return json.dumps(to_json(cell), sort_keys=True)
+# ...
+
+# ...
+def read_records(filename):
+    """
+    returns the records of a sweep file, one record per finished cell.
+    A truncated last line (e.g. after the job was killed) is ignored.
+    """
+    records = []
+    if not os.path.exists(filename):
+        return records
+
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def _append(filename, record):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(to_json(record)) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+# ...
+
+# ...
+def _run_cell(fit, cell):
+    try:
+        return cell, fit(**cell), None
+    except Exception:
+        return cell, None, traceback.format_exc()
+# ...
+
+# ...
+def run_sweep(fit, cells, filename, n_jobs=None, callback=None, store=None):
+    """
+    runs fit(**cell) for every cell of a grid, in a pool of processes.
+
+    Each result is appended to filename (one JSON record per line) as soon as
+    it is available. Cells that already have a result in filename are
+    skipped, so an interrupted sweep is resumed by calling run_sweep again.
+    Failed cells are recorded with their error and run again on resume.
+
+    fit: callable
+        a picklable function (defined at module level) returning a dictionary
+        of results, e.g. the estimated parameters, the nlml and the timings
+    cells: list
+        dictionaries of parameters, see grid
+    filename: str
+        the file where the records are stored
+    n_jobs: int
+        number of worker processes, None means the number of cpus.
+        With n_jobs = 1 the cells are run in the current process.
+    callback: callable
+        called as callback(record) for every new record
+    store: ResultStore
+        if given, the results are also appended to the store, as
+        {'cell': cell, 'result': result}, for columnar reads
+
+    returns the records of all the finished cells.
+    """
+    done = {}
+    for record in read_records(filename):
+        if record.get('error') is None:
+            done[cell_key(record['cell'])] = record
+
+    todo = []
+    keys = set(done.keys())
+    for cell in cells:
+        key = cell_key(cell)
+        if not(key in keys):
+            todo.append(cell)
+            keys.add(key)
+
+    def _store(cell, result, error):
+        record = {'cell': cell, 'result': result, 'error': error}
+        record = to_json(record)
+        _append(filename, record)
+        if error is None:
+            done[cell_key(cell)] = record
+            if not(store is None):
+                store.append({'cell': record['cell'], 'result': record['result']})
+        if callback:
+            callback(record)
+
+    if n_jobs == 1:
+        for cell in todo:
+            _store(*_run_cell(fit, cell))
+
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_run_cell, fit, cell) for cell in todo]
+            for future in as_completed(futures):
+                _store(*future.result())
+
+    keys = [cell_key(cell) for cell in cells]
+    return [done[k] for k in keys if k in done]
+# ...
@@ -17,6 +17,17 @@ from mlhiphy.calculus import (dx, dy, dz)
 from mlhiphy.calculus import LinearOperator
 from mlhiphy.calculus import Field
 from mlhiphy.calculus import _generic_ops, _partial_derivatives
+from mlhiphy.calculus import Unknown
+from mlhiphy.calculus import find_partial_derivatives
+from mlhiphy.calculus import sort_partial_derivatives
+from mlhiphy.calculus import partial_derivatives_by_order
+from mlhiphy.calculus import dt
+from mlhiphy.calculus import partial_derivative
+from mlhiphy.calculus import coordinate_index
+from mlhiphy.calculus import multi_index_form
+from mlhiphy.calculus import multi_index_system
+from mlhiphy.calculus import linearize
+from mlhiphy.calculus import field_derivative
 
 # ...
 def test_0():
@@ -115,9 +126,125 @@ def test_kernel():
     kuu = theta * exp(-1/(2)*((x_i - x_j)**2))
     print(kuu)
 
+def test_partial_derivatives():
+    u = Unknown('u')
+    mu = Constant('mu')
+
+    expr = mu * u + dx(u) + dx(dx(u)) + mu * dx(u) + dy(dx(dx(u)))
+
+    d = partial_derivatives_by_order(expr)
+    assert(list(d.keys()) == [3, 2, 1])
+    assert(d[3] == (dy(dx(dx(u))),))
+    assert(d[2] == (dx(dx(u)),))
+    assert(d[1] == (dx(u),))
+
+    # the result is cached, changing it does not change the cache
+    d.clear()
+    assert(list(partial_derivatives_by_order(expr).keys()) == [3, 2, 1])
+
+    assert(sort_partial_derivatives(expr) == [dy(dx(dx(u))), dx(dx(u)), dx(u)])
+    assert(set(find_partial_derivatives([expr, [dz(u)]])) ==
+           set([dy(dx(dx(u))), dx(dx(u)), dx(u), dz(u)]))
+    assert(sort_partial_derivatives(mu * u) == [])
+
+def test_canonical_derivatives():
+    u = Unknown('u')
+    mu = Constant('mu')
+
+    assert(dy(dx(u)) == dx(dy(u)))
+    assert(dz(dy(dx(u))) == dx(dy(dz(u))))
+    assert(dy(dx(u)).args[0] == dy(u))
+
+    # like terms are merged
+    assert(dy(dx(u)) + dx(dy(u)) == 2*dx(dy(u)))
+    assert(dy(mu*dx(u)) + dx(dy(u)) == mu*dx(dy(u)) + dx(dy(u)))
+    assert(dy(mu*dx(u)) + dx(dy(mu*u)) == 2*mu*dx(dy(u)))
+
+def test_time_derivative():
+    u = Unknown('u')
+    phi = Constant('phi')
+
+    assert(dt(dx(u)) == dx(dt(u)))
+    assert(dt(dx(u)).args[0] == dt(u))
+
+    # dt is along the last coordinate
+    assert(coordinate_index(dt, 2) == 1)
+    assert(coordinate_index(dt, 4) == 3)
+
+    expr = dt(u) - phi*dx(dx(u))
+    assert(multi_index_form(expr, u, 2) == {(2, 0): -phi, (0, 1): 1})
+    assert(multi_index_form(expr, u, 4) == {(2, 0, 0, 0): -phi,
+                                            (0, 0, 0, 1): 1})
+
+    # dy and dt are the same coordinate in 2D
+    try:
+        multi_index_form(dt(dy(u)), u, 2)
+        assert(False)
+    except ValueError:
+        pass
+
+def test_partial_derivative():
+    u = Unknown('u')
+
+    assert(partial_derivative(1) is dy)
+
+    d4 = partial_derivative(4)
+    assert(partial_derivative(4) is d4)
+    assert(d4(dx(u)) == dx(d4(u)))
+    assert(multi_index_form(d4(d4(u)) + dz(u), u, 5) == {(0, 0, 0, 0, 2): 1,
+                                                       (0, 0, 1, 0, 0): 1})
+    try:
+        coordinate_index(d4, 3)
+        assert(False)
+    except ValueError:
+        pass
+
+def test_multi_index_system():
+    u = Unknown('u')
+    v = Unknown('v')
+    mu = Constant('mu')
+
+    forms = multi_index_system(mu*dx(u) + dy(v) + dx(dy(u)) - v, [u, v], 2)
+    assert(forms[u] == {(1, 0): mu, (1, 1): 1})
+    assert(forms[v] == {(0, 1): 1, (0, 0): -1})
+
+    # terms must be linear in the unknowns
+    try:
+        multi_index_system(u*v, [u, v], 2)
+        assert(False)
+    except ValueError:
+        pass
+
+def test_linearize():
+    u = Unknown('u')
+    c = Constant('c')
+    mu = Constant('mu')
+    F = Field('F')
+
+    # Burgers
+    assert(linearize(u + c*u*dx(u), u, mu) == u + c*mu*dx(u))
+    assert(linearize(u + c*u*dx(u), u, F) == u + c*F*dx(u))
+
+    # derivatives of a constant state vanish
+    assert(linearize(u**2 + dx(u)*dx(dx(u)), u, 0.5) == 0.5*u)
+    assert(linearize(dx(dx(u)) + mu*u, u, F) == dx(dx(u)) + mu*u)
+
+    # frozen derivatives of a Field are Fields too
+    F_x = field_derivative(F, dx(u))
+    assert(F_x == Field('F_x'))
+    assert(field_derivative(F, dx(dt(u))) == Field('F_xt'))
+    assert(linearize(dx(u)*dx(dx(u)), u, F) == F_x*dx(dx(u)))
+    assert(linearize(u*dx(u)**2, u, F) == F*F_x*dx(u))
+
 # .....................................................
 if __name__ == '__main__':
     test_0()
     test_1()
     test_2()
     test_kernel()
+    test_partial_derivatives()
+    test_canonical_derivatives()
+    test_time_derivative()
+    test_partial_derivative()
+    test_multi_index_system()
+    test_linearize()
@@ -0,0 +1,98 @@
+# coding: utf-8
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import OptimizeResult
+
+from mlhiphy.dataset import save_dataset
+from mlhiphy.dataset import open_dataset
+from mlhiphy.dataset import convert_pickle
+from mlhiphy.dataset import ChunkReader
+
+def _sum(data, name):
+    return float(np.sum(data[name]))
+
+def test_dataset(tmpdir):
+    dirname = os.path.join(str(tmpdir), 'heat')
+
+    rng = np.random.RandomState(0)
+    x = rng.rand(20, 2)
+    y = np.sin(x[:,0])
+
+    save_dataset(dirname, {'x_u': x, 'y_u': y, 'x_f': x, 'y_f': 2*y},
+                 coordinates=['x', 't'], outputs=['u', 'f'],
+                 operator={'expr': 'dt(u) - phi*dx(dx(u))'},
+                 attrs={'tau': np.float64(0.02)})
+
+    data = open_dataset(dirname)
+    assert(sorted(data.keys()) == ['x_f', 'x_u', 'y_f', 'y_u'])
+    assert(data.coordinates == ['x', 't'])
+    assert(data.operator['expr'] == 'dt(u) - phi*dx(dx(u))')
+    assert(data.attrs['tau'] == 0.02)
+
+    # memory-mapped, read only
+    assert(isinstance(data['x_u'], np.memmap))
+    assert(not data['x_u'].flags.writeable)
+    assert(np.array_equal(data['x_u'], x))
+    assert(np.array_equal(data['y_f'], 2*y))
+
+    # the dataset is opened again by every worker
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        sums = list(executor.map(_sum, [data]*2, ['y_u', 'y_f']))
+    assert(np.allclose(sums, [np.sum(y), 2*np.sum(y)]))
+
+    # an incomplete dataset cannot be opened
+    os.remove(os.path.join(dirname, 'header.json'))
+    try:
+        open_dataset(dirname)
+        assert(False)
+    except IOError:
+        pass
+
+def test_convert_pickle(tmpdir):
+    filename = os.path.join(str(tmpdir), 'heat_data.pkl')
+
+    theta1, theta2 = np.meshgrid(np.arange(0, 3), np.arange(0, 4))
+    res = OptimizeResult(x=np.array([1., 2.]), fun=-6.1, success=True,
+                         message='done')
+    with open(filename, 'wb') as f:
+        pickle.dump({'theta1': theta1, 'theta2': theta2,
+                     'nlml': theta1 + theta2, 'min': res}, f)
+
+    data = convert_pickle(filename, os.path.join(str(tmpdir), 'heat'),
+                          coordinates=['theta1', 'theta2'])
+
+    assert(sorted(data.keys()) == ['min.x', 'nlml', 'theta1', 'theta2'])
+    assert(np.array_equal(data['nlml'], theta1 + theta2))
+    assert(np.array_equal(data['min.x'], [1., 2.]))
+    assert(data.attrs['min.fun'] == -6.1)
+    assert(data.attrs['min.success'] is True)
+    assert(data.attrs['source'] == 'heat_data.pkl')
+
+def test_chunk_reader(tmpdir):
+    x_u = np.arange(0., 10.)
+    x_f = np.arange(0., 7.)
+    data = save_dataset(str(tmpdir), {'x_u': x_u, 'y_u': 2*x_u,
+                                      'x_f': x_f, 'y_f': 3*x_f, 'g': x_f**2})
+
+    chunks = ChunkReader(data, chunk_size=3, fields={'F': 'g'})
+    assert(len(chunks) == 4)
+    assert(chunks.shape == (10, 7))
+
+    # it can be read several times
+    for i in range(0, 2):
+        sizes = [(len(c[0]), len(c[2])) for c in chunks]
+        assert(sizes == [(3, 3), (3, 3), (3, 1), (1, 0)])
+
+    x_u, y_u, x_f, y_f, fields = list(chunks)[2]
+    assert(list(x_u) == [6., 7., 8.] and list(y_u) == [12., 14., 16.])
+    assert(list(fields['F']) == [36.])
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_dataset(tempfile.mkdtemp())
+    test_convert_pickle(tempfile.mkdtemp())
+    test_chunk_reader(tempfile.mkdtemp())
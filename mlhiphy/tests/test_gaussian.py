@@ -0,0 +1,120 @@
+# coding: utf-8
+import numpy as np
+
+from mlhiphy.calculus import dx, dt
+from mlhiphy.calculus import Constant
+from mlhiphy.calculus import Unknown
+from mlhiphy.calculus import multi_index_form
+from mlhiphy.kernels import compute_kernels
+from mlhiphy.gaussian import hermite_table
+from mlhiphy.gaussian import GaussianDerivatives
+from mlhiphy.gaussian import gaussian_kernels
+
+from sympy import symbols
+from sympy import exp
+from sympy import diff
+from sympy import lambdify
+from sympy import hermite
+from sympy import Poly
+from sympy import Rational
+
+def test_hermite_table():
+    H = hermite_table(4)
+    assert(list(H[2,:3]) == [-2, 0, 4])
+    assert(list(H[4]) == [12, 0, -48, 0, 16])
+
+def test_high_orders():
+    # the coefficients overflow int64 from H_26
+    z = symbols('z')
+    H = hermite_table(30)
+    for n in [26, 30]:
+        c = Poly(hermite(n, z), z).all_coeffs()[::-1]
+        assert(list(H[n,:n+1]) == [int(i) for i in c])
+
+    # d^n/dr^n exp(-r^2) = (-1)^n H_n(r) exp(-r^2)
+    Xi = np.array([0.1, 0.35])
+    Xj = np.array([0.2, 0.9, 1.4])
+    D = GaussianDerivatives(Xi, Xj)
+    for n in [26, 30]:
+        k = (-1)**n * hermite(n, z) * exp(-z**2)
+        K = [[float(k.subs(z, Rational(a - b)).evalf(30)) for b in Xj]
+             for a in Xi]
+        assert(np.allclose(D[(n,), (0,)], K, rtol=1e-10))
+
+def test_gaussian_derivatives():
+    xi, yi, xj, yj = symbols('xi yi xj yj')
+    l = [0.7, 1.3]
+    theta = 2.
+
+    kuu = theta * exp(-l[0]*(xi - xj)**2 - l[1]*(yi - yj)**2)
+
+    rng = np.random.RandomState(0)
+    Xi = rng.rand(5, 2)
+    Xj = rng.rand(4, 2)
+
+    D = GaussianDerivatives(Xi, Xj, l=l, theta=theta)
+    for a, b in [((0, 0), (0, 0)), ((1, 0), (0, 2)), ((2, 1), (3, 1)),
+                 ((0, 3), (2, 0))]:
+        args = [xi]*a[0] + [yi]*a[1] + [xj]*b[0] + [yj]*b[1]
+        k = diff(kuu, *args) if args else kuu
+        f = lambdify((xi, yi, xj, yj), k, 'numpy')
+        K = f(Xi[:,0][:,None], Xi[:,1][:,None], Xj[:,0][None,:], Xj[:,1][None,:])
+
+        assert(np.allclose(D[a, b], K))
+
+def test_gaussian_kernels():
+    xi, ti, xj, tj = symbols('xi ti xj tj')
+
+    u = Unknown('u')
+    phi = Constant('phi')
+    l = Constant('l')
+
+    expr = dt(u) - phi*dx(dx(u))
+    kuu = exp(-l*((xi - xj)**2 + (ti - tj)**2))
+
+    values = {phi: 0.3, l: 0.8}
+    kernels = compute_kernels(expr, kuu, (xi, ti), (xj, tj))
+
+    op = multi_index_form(expr, u, 2)
+    op = {a: float(c.subs(values)) for a, c in op.items()}
+
+    rng = np.random.RandomState(1)
+    Xi = rng.rand(6, 2)
+    Xj = rng.rand(3, 2)
+    blocks = gaussian_kernels(op, Xi, Xj, l=0.8)
+
+    for name in ['uu', 'uf', 'fu', 'ff']:
+        f = lambdify((xi, ti, xj, tj), kernels[name].subs(values), 'numpy')
+        K = f(Xi[:,0][:,None], Xi[:,1][:,None], Xj[:,0][None,:], Xj[:,1][None,:])
+
+        assert(np.allclose(blocks[name], K))
+
+def test_hyperparameter_derivatives():
+    xi, yi, xj, yj = symbols('xi yi xj yj')
+    l0, l1, theta = symbols('l0 l1 theta')
+
+    kuu = theta * exp(-l0*(xi - xj)**2 - l1*(yi - yj)**2)
+    values = {l0: 0.7, l1: 1.3, theta: 2.}
+
+    rng = np.random.RandomState(2)
+    Xi = rng.rand(5, 2)
+    Xj = rng.rand(4, 2)
+
+    D = GaussianDerivatives(Xi, Xj, l=[0.7, 1.3], theta=2.)
+    for a, b in [((0, 0), (0, 0)), ((1, 0), (0, 2)), ((2, 1), (3, 1))]:
+        args = [xi]*a[0] + [yi]*a[1] + [xj]*b[0] + [yj]*b[1]
+        k = diff(kuu, *args) if args else kuu
+        for wrt, p in [(None, theta), (0, l0), (1, l1)]:
+            f = lambdify((xi, yi, xj, yj), diff(k, p).subs(values), 'numpy')
+            K = f(Xi[:,0][:,None], Xi[:,1][:,None], Xj[:,0][None,:],
+                  Xj[:,1][None,:])
+
+            assert(np.allclose(D.derivative((a, b), wrt), K))
+
+#############################################
+if __name__ == '__main__':
+    test_hermite_table()
+    test_high_orders()
+    test_gaussian_derivatives()
+    test_gaussian_kernels()
+    test_hyperparameter_derivatives()
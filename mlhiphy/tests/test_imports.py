@@ -0,0 +1,37 @@
+# coding: utf-8
+import sys
+import subprocess
+
+_heavy = ['sympy', 'mlhiphy.calculus', 'mlhiphy.kernels']
+
+def _loaded(statement, modules=_heavy):
+    """returns the names of the heavy modules loaded by statement, in a new
+    interpreter."""
+    code = ('import sys; {}; '
+            'print(",".join(m for m in {!r} if m in sys.modules))'.format(
+            statement, list(modules)))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return [m for m in out.decode().strip().split(',') if m]
+
+def test_lazy_package():
+    assert(_loaded('import mlhiphy') == [])
+
+    # submodules are still available as attributes
+    assert(_loaded('import mlhiphy; mlhiphy.calculus') ==
+           ['sympy', 'mlhiphy.calculus'])
+
+def test_numeric_modules():
+    for name in ['gaussian', 'linalg', 'optimize', 'trace', 'sweep',
+                 'dataset', 'simulate', 'store', 'utilities']:
+        assert(_loaded('import mlhiphy.{}'.format(name)) == [])
+
+def test_models():
+    # workers import models to evaluate a fitted model
+    assert(_loaded('import mlhiphy.models', _heavy + ['scipy.optimize']) == [])
+    assert(_loaded('from mlhiphy.models import OperatorGP, load_model') == [])
+
+#############################################
+if __name__ == '__main__':
+    test_lazy_package()
+    test_numeric_modules()
+    test_models()
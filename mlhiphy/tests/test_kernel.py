@@ -1,8 +1,15 @@
 # coding: utf-8
 from mlhiphy.calculus import dx, dy, dz
+from mlhiphy.calculus import dt
+from mlhiphy.calculus import Grad_2d, Div_2d
 from mlhiphy.calculus import Constant
 from mlhiphy.calculus import Unknown
+from mlhiphy.calculus import Field
 from mlhiphy.kernels import compute_kernel, generic_kernel
+from mlhiphy.kernels import compute_kernels
+from mlhiphy.kernels import KernelDerivatives
+from mlhiphy.kernels import compute_kernel_system
+from mlhiphy.kernels import field_at
 
 from sympy import expand
 from sympy import Lambda
@@ -10,6 +17,9 @@ from sympy import Function, Derivative
 from sympy import symbols
 from sympy import exp
 from sympy import Tuple
+from sympy import diff
+from sympy import simplify
+from sympy import Rational
 
 def test_generic_kernel_1d():
     x, xi, xj = symbols('x xi xj')
@@ -144,6 +154,198 @@ def test_generic_kernel_3d():
            Derivative(Function('u')(*Xi, *Xj), xi, xi, xj, xj))
     # ...
 
+def test_generic_kernel_mixed():
+    x, xi, xj = symbols('x xi xj')
+    y, yi, yj = symbols('y yi yj')
+
+    Xi = Tuple(xi,yi)
+    Xj = Tuple(xj,yj)
+
+    u = Unknown('u')
+
+    expr = generic_kernel(dx(dy(u)), u, (Xi, Xj))
+    assert(generic_kernel(dy(dx(u)), u, (Xi, Xj)) == expr)
+    assert(sorted(expr.variables, key=str) == [xi, xj, yi, yj])
+
+    # both orderings give a single term
+    expr = generic_kernel(dx(dy(u)) + dy(dx(u)), u, (Xi, Xj))
+    assert(expr.args[0] == 4)
+
+def test_kernel_derivatives():
+    xi, xj = symbols('xi xj')
+    yi, yj = symbols('yi yj')
+
+    kuu = exp(-0.5*((xi - xj)**2 + (yi - yj)**2))
+    D = KernelDerivatives(kuu, Tuple(xi,yi), Tuple(xj,yj))
+
+    assert(D[(0,0), (0,0)] == kuu)
+    assert(simplify(D[(1,0), (0,2)] - diff(kuu, xi, yj, yj)) == 0)
+    # the intermediate derivatives are stored
+    assert(len(D) == 4)
+
+def test_compute_kernels():
+    x, xi, xj = symbols('x xi xj')
+    y, yi, yj = symbols('y yi yj')
+
+    Xi = Tuple(xi,yi)
+    Xj = Tuple(xj,yj)
+
+    u = Unknown('u')
+    phi = Constant('phi')
+    theta = Constant('theta')
+
+    expr = phi * u + dx(u) + dy(dy(u)) + dy(dx(u))
+    kuu = theta * exp(-0.5*((xi - xj)**2 + (yi - yj)**2))
+
+    kernels = compute_kernels(expr, kuu, Xi, Xj)
+
+    # same kernels as with generic_kernel
+    U = Function('u')
+    for name, args in [('fu', Xi), ('uf', Xj), ('ff', (Xi, Xj))]:
+        if name == 'ff':
+            k = generic_kernel(expr, u, args).subs(U(*Xi, *Xj), kuu).doit()
+        else:
+            k = generic_kernel(expr, u, args).subs(U(*args), kuu).doit()
+
+        assert(simplify(kernels[name] - k) == 0)
+        assert(simplify(compute_kernel(expr, kuu, args) - k) == 0)
+
+def test_heat_kernels():
+    xi, xj = symbols('xi xj')
+    ti, tj = symbols('ti tj')
+
+    Xi = Tuple(xi,ti)
+    Xj = Tuple(xj,tj)
+
+    u = Unknown('u')
+    phi = Constant('phi')
+    theta = Constant('theta')
+
+    expr = dt(u) - phi*dx(dx(u))
+    kuu = exp(-theta*((xi - xj)**2 + (ti - tj)**2))
+
+    kernels = compute_kernels(expr, kuu, Xi, Xj)
+
+    # hand derived kernels, see heat_equation/heat_eqn.py
+    kfu = diff(kuu, ti) - phi*diff(kuu, xi, xi)
+    kff = (diff(kuu, tj, ti) - phi*diff(kuu, xj, xj, ti)
+           - phi*diff(kuu, tj, xi, xi) + phi**2*diff(kuu, xj, xj, xi, xi))
+
+    assert(simplify(kernels['fu'] - kfu) == 0)
+    assert(simplify(kernels['ff'] - kff) == 0)
+
+    U = Function('u')
+    k = generic_kernel(expr, u, (Xi, Xj)).subs(U(*Xi, *Xj), kuu).doit()
+    assert(simplify(k - kff) == 0)
+
+def test_kernels_3d_time():
+    xi, yi, zi, ti = symbols('xi yi zi ti')
+    xj, yj, zj, tj = symbols('xj yj zj tj')
+
+    Xi = Tuple(xi,yi,zi,ti)
+    Xj = Tuple(xj,yj,zj,tj)
+
+    u = Unknown('u')
+    phi = Constant('phi')
+
+    expr = dt(u) - phi*(dx(dx(u)) + dy(dy(u)) + dz(dz(u)))
+    kuu = exp(-0.5*((xi - xj)**2 + (yi - yj)**2 + (zi - zj)**2 + (ti - tj)**2))
+
+    kfu = diff(kuu, ti) - phi*(diff(kuu, xi, xi) + diff(kuu, yi, yi) +
+                               diff(kuu, zi, zi))
+    assert(simplify(compute_kernel(expr, kuu, Xi) - kfu) == 0)
+
+    U = Function('u')
+    k = generic_kernel(expr, u, Xi).subs(U(*Xi), kuu).doit()
+    assert(simplify(k - kfu) == 0)
+
+def test_kernel_system():
+    xi, xj = symbols('xi xj')
+    yi, yj = symbols('yi yj')
+
+    Xi = Tuple(xi,yi)
+    Xj = Tuple(xj,yj)
+
+    u = Unknown('u')
+    v = Unknown('v')
+    p = Unknown('p')
+    nu = Constant('nu')
+
+    kuu = exp(-0.5*((xi - xj)**2 + (yi - yj)**2))
+    kpp = 2*exp(-((xi - xj)**2 + (yi - yj)**2))
+
+    # Stokes
+    grad = Grad_2d(p)
+    exprs = [-nu*(dx(dx(u)) + dy(dy(u))) + grad[0],
+             -nu*(dx(dx(v)) + dy(dy(v))) + grad[1],
+             Div_2d(Tuple(u, v))]
+
+    derivatives = {}
+    names, kernels = compute_kernel_system(exprs, {u: kuu, v: kuu, p: kpp},
+                                           Xi, Xj, unknowns=[u, v, p],
+                                           derivatives=derivatives)
+
+    assert(names == ['u', 'v', 'p', 'f0', 'f1', 'f2'])
+    assert(len(kernels) == 36)
+    # u and v share their table of derivatives
+    assert(len(derivatives) == 2)
+
+    assert(kernels['u', 'u'] == kuu)
+    assert(kernels['u', 'p'] == 0)
+    assert(simplify(kernels['p', 'f0'] - diff(kpp, xj)) == 0)
+    assert(simplify(kernels['f2', 'u'] - diff(kuu, xi)) == 0)
+    assert(simplify(kernels['f2', 'f2'] - diff(kuu, xi, xj) - diff(kuu, yi, yj)) == 0)
+    assert(simplify(kernels['f0', 'f1'] - diff(kpp, xi, yj)) == 0)
+
+    # one unknown gives the kernels of compute_kernels
+    expr = u - nu*dx(dx(u))
+    names, kernels = compute_kernel_system([expr], kuu, Xi, Xj)
+    single = compute_kernels(expr, kuu, Xi, Xj)
+    assert(names == ['u', 'f0'])
+    assert(simplify(kernels['f0', 'f0'] - single['ff']) == 0)
+    assert(simplify(kernels['u', 'f0'] - single['uf']) == 0)
+
+def test_linearized_kernels():
+    xi, xj = symbols('xi xj')
+
+    u = Unknown('u')
+    c = Constant('c')
+    l = Constant('l')
+    theta = Constant('theta')
+    F = Field('F')
+    tau = Rational(1, 1000)
+    mu = Rational(2, 5)
+
+    kuu = theta*exp(-1/(2*l)*((xi - xj)**2))
+    expr = u + tau*c*u*dx(u)
+
+    # hand linearized kernels, see burgers_equation/burgerseq_mod.ipynb
+    kff = (kuu + tau*c*mu*(diff(kuu, xi) + diff(kuu, xj))
+           + tau**2*c**2*mu**2*diff(kuu, xi, xj))
+    kfu = kuu + tau*mu*c*diff(kuu, xi)
+
+    kernels = compute_kernels(expr, kuu, xi, xj, around=mu)
+    assert(simplify(kernels['ff'] - kff) == 0)
+    assert(simplify(kernels['fu'] - kfu) == 0)
+
+    # around a Field, its values at xi and xj
+    kernels = compute_kernels(expr, kuu, xi, xj, around=F)
+    Fi = field_at(F, 'i')
+    Fj = field_at(F, 'j')
+    assert(kernels['ff'].has(Fi) and kernels['ff'].has(Fj))
+    assert(not kernels['fu'].has(Fj))
+    assert(simplify(kernels['ff'].subs({Fi: mu, Fj: mu}) - kff) == 0)
+
+    # the same in a system, with a variable coefficient
+    names, kernels = compute_kernel_system([F*dx(u)], kuu, xi, xj)
+    assert(kernels['f0', 'f0'].free_symbols == set([Fi, Fj, xi, xj, l, theta]))
+    assert(simplify(kernels['f0', 'f0'] - Fi*Fj*diff(kuu, xi, xj)) == 0)
+
+    names, kernels = compute_kernel_system([expr], kuu, xi, xj, around=F)
+    single = compute_kernels(expr, kuu, xi, xj, around=F)
+    assert(simplify(kernels['f0', 'f0'] - single['ff']) == 0)
+    assert(simplify(kernels['f0', 'u'] - single['fu']) == 0)
+
 def test_1d():
     x, xi, xj = symbols('x xi xj')
 
@@ -294,6 +496,13 @@ if __name__ == '__main__':
     test_generic_kernel_1d()
     test_generic_kernel_2d()
     test_generic_kernel_3d()
+    test_generic_kernel_mixed()
+    test_kernel_derivatives()
+    test_compute_kernels()
+    test_heat_kernels()
+    test_kernels_3d_time()
+    test_kernel_system()
+    test_linearized_kernels()
     test_1d()
     test_2d()
     test_3d()
@@ -0,0 +1,117 @@
+# coding: utf-8
+import numpy as np
+
+from mlhiphy.linalg import cholesky
+from mlhiphy.linalg import nlml
+from mlhiphy.linalg import block_cholesky
+from mlhiphy.linalg import SchurFactorization
+from mlhiphy.linalg import IncrementalCholesky
+
+def test_cholesky_spd():
+    x = np.linspace(0., 1., 5)
+    K = np.exp(-0.5*(x[:,None] - x[None,:])**2) + np.eye(5)
+
+    F = cholesky(K)
+    assert(F.jitter == 0.)
+    assert(np.allclose(F.L.dot(F.L.T), K))
+
+    b = np.arange(5.)
+    assert(np.allclose(K.dot(F.solve(b)), b))
+    assert(np.allclose(F.logdet(), np.linalg.slogdet(K)[1]))
+
+def test_cholesky_jitter():
+    # rank one matrix, only positive semi-definite
+    v = np.ones(4)
+    K = np.outer(v, v)
+
+    F = cholesky(K, max_tries=10)
+    assert(F.jitter > 0.)
+    assert(np.allclose(F.L.dot(F.L.T), K + F.jitter*np.eye(4)))
+
+    # the given jitter is used as a starting value
+    F = cholesky(K, jitter=1.e-3)
+    assert(F.jitter == 1.e-3)
+
+def test_cholesky_indefinite():
+    K = np.diag([1., -1.])
+
+    try:
+        cholesky(K, max_tries=3)
+        assert(False)
+    except np.linalg.LinAlgError:
+        pass
+
+    try:
+        cholesky(K, max_tries=-1)
+        assert(False)
+    except ValueError:
+        pass
+
+def test_nlml():
+    x = np.linspace(0., 1., 6)
+    K = np.exp(-0.5*(x[:,None] - x[None,:])**2) + 0.1*np.eye(6)
+    y = np.sin(x)
+
+    expected = 0.5*(y.dot(np.linalg.solve(K, y)) + np.linalg.slogdet(K)[1]
+                    + 6*np.log(2*np.pi))
+    assert(np.allclose(nlml(cholesky(K), y), expected))
+
+def _joint_covariance(phi):
+    x = np.linspace(0., 1., 5)
+    r = x[:,None] - x[None,:]
+    k = np.exp(-0.5*r**2)
+    Kuu = k + 1.e-2*np.eye(5)
+    Kuf = phi*k - (r**2 - 1.)*k
+    Kff = phi**2*k + (r**4 - 6*r**2 + 3)*k + 2*phi*(1. - r**2)*k + 1.e-2*np.eye(5)
+    return Kuu, Kuf, Kff
+
+def test_block_cholesky():
+    Kuu, Kuf, Kff = _joint_covariance(0.5)
+    K = np.block([[Kuu, Kuf], [Kuf.T, Kff]])
+
+    F = block_cholesky(Kuu, Kuf, Kff)
+    assert(np.allclose(F.L.dot(F.L.T), K + F.jitter*np.eye(10)))
+    assert(np.allclose(F.logdet(), cholesky(K).logdet()))
+
+def test_schur_factorization():
+    factorize = SchurFactorization()
+
+    for phi in [0.5, 1., 2.]:
+        Kuu, Kuf, Kff = _joint_covariance(phi)
+        K = np.block([[Kuu, Kuf], [Kuf.T, Kff]])
+
+        F = factorize((1.,), lambda: Kuu, Kuf, Kff)
+        assert(np.allclose(F.logdet(), cholesky(K).logdet()))
+
+    assert(factorize.misses == 1)
+    assert(factorize.hits == 2)
+
+def test_incremental_cholesky(tmpdir):
+    x = np.linspace(0., 3., 11)
+    K = np.exp(-0.5*(x[:,None] - x[None,:])**2) + 0.1*np.eye(11)
+    y = np.sin(x)
+
+    for directory in [None, str(tmpdir)]:
+        F = IncrementalCholesky(directory=directory)
+        for start, end in [(0, 4), (4, 8), (8, 11)]:
+            F.append(K[start:end,:start], K[start:end,start:end], y[start:end])
+
+        assert(F.size == 11 and len(F) == 3)
+        assert(np.allclose(F.nlml(), nlml(cholesky(K), y)))
+        assert(np.allclose(F.to_factor().L, cholesky(K).L))
+        assert(np.allclose(F.solve_lower(y), cholesky(K).solve_lower(y)))
+
+    # the blocks are memory-mapped
+    assert(isinstance(F._rows[0], np.memmap))
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_cholesky_spd()
+    test_cholesky_jitter()
+    test_cholesky_indefinite()
+    test_nlml()
+    test_block_cholesky()
+    test_schur_factorization()
+    test_incremental_cholesky(tempfile.mkdtemp())
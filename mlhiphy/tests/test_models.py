@@ -0,0 +1,416 @@
+# coding: utf-8
+import numpy as np
+
+from mlhiphy.calculus import dx, dy
+from mlhiphy.calculus import Constant
+from mlhiphy.calculus import Unknown
+from mlhiphy.calculus import Field
+from mlhiphy.models import OperatorGP
+
+from sympy import symbols
+from sympy import exp
+from sympy import Tuple
+
+def _heat_model(**kwargs):
+    """backward Euler scheme for the heat equation, u - tau alpha u_xx = f."""
+    xi, xj = symbols('xi xj')
+
+    u = Unknown('u')
+
+    theta = Constant('theta')
+    l     = Constant('l')
+    alpha = Constant('alpha')
+    tau   = Constant('tau')
+
+    kuu = theta * exp(-l*(xi - xj)**2)
+    expr = u - tau * alpha * dx(dx(u))
+
+    model = OperatorGP(expr, kuu, xi, xj, constants={tau: 0.02}, **kwargs)
+
+    rng = np.random.RandomState(0)
+    x = rng.rand(15)*2*np.pi
+    model.set_data(x, np.exp(-0.02)*np.sin(x), x, np.sin(x))
+
+    return model
+
+def test_params():
+    model = _heat_model()
+
+    assert([i.name for i in model.params] == ['l', 'theta', 'alpha'])
+    assert([i.name for i in model.kernel_params] == ['l', 'theta'])
+
+def test_covariance_2d():
+    xi, xj = symbols('xi xj')
+    yi, yj = symbols('yi yj')
+
+    Xi = Tuple(xi,yi)
+    Xj = Tuple(xj,yj)
+
+    u = Unknown('u')
+    phi = Constant('phi')
+
+    kuu = exp(-0.5*((xi - xj)**2 + (yi - yj)**2))
+    model = OperatorGP(phi * u + dx(u) + dy(dy(u)), kuu, Xi, Xj)
+
+    x = np.random.RandomState(1).rand(6, 2)
+    model.set_data(x, np.zeros(6), x, np.zeros(6))
+
+    K = model.covariance([0.7])
+    assert(np.allclose(K, K.T))
+    assert(np.all(np.linalg.eigvalsh(K) > -1.e-10))
+
+def test_nlml_gradient():
+    model = _heat_model(noise=1.e-2)
+
+    values = np.array([0.5, 1., 2.])
+    val, grad = model.nlml_and_grad(values)
+    assert(np.allclose(val, model.nlml(values)))
+
+    eps = 1.e-6
+    for p in range(0, 3):
+        e = eps*np.eye(3)[p]
+        fd = (model.nlml(values + e) - model.nlml(values - e)) / (2*eps)
+        assert(np.allclose(grad[p], fd, rtol=1.e-3))
+
+def test_fit():
+    model = _heat_model(noise=1.e-7)
+
+    res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+    assert(res.success)
+    assert(abs(model.values[2] - 1.) < 0.1)
+
+def _burgers_model(around):
+    """backward Euler scheme for Burgers' equation, u + tau c u u_x = f."""
+    xi, xj = symbols('xi xj')
+
+    u = Unknown('u')
+
+    theta = Constant('theta')
+    l     = Constant('l')
+    c     = Constant('c')
+    tau   = Constant('tau')
+
+    kuu = theta * exp(-l*(xi - xj)**2)
+    expr = u + tau * c * u * dx(u)
+
+    return OperatorGP(expr, kuu, xi, xj, constants={tau: 0.1}, noise=1.e-2,
+                      around=around)
+
+def test_linearized_model():
+    rng = np.random.RandomState(0)
+    x = rng.rand(12)
+    y_u = x/1.1
+    y_f = x
+
+    mu = float(np.mean(y_f))
+    model = _burgers_model(mu)
+    assert([i.name for i in model.params] == ['l', 'theta', 'c'])
+    model.set_data(x, y_u, x, y_f)
+
+    # around a Field with constant values, the same covariance
+    F = Field('F')
+    field_model = _burgers_model(F)
+    assert(field_model.fields == (F,))
+    assert([i.name for i in field_model.params] == ['l', 'theta', 'c'])
+
+    try:
+        field_model.set_data(x, y_u, x, y_f)
+        assert(False)
+    except ValueError:
+        pass
+
+    field_model.set_data(x, y_u, x, y_f, fields={'F': np.full(x.size, mu)})
+
+    values = [1., 1., 0.5]
+    assert(np.allclose(model.covariance(values), field_model.covariance(values)))
+
+    # and the gradient is still consistent
+    field_model.set_data(x, y_u, x, y_f, fields={F: y_f})
+    val, grad = field_model.nlml_and_grad(values)
+    eps = 1.e-6
+    for p in range(0, 3):
+        v = list(values)
+        v[p] += eps
+        assert(abs((field_model.nlml(v) - val)/eps - grad[p]) < 1.e-3*max(1., abs(grad[p])))
+
+def test_chunks(tmpdir):
+    from mlhiphy.dataset import save_dataset
+    from mlhiphy.dataset import ChunkReader
+
+    model = _heat_model(noise=1.e-2)
+
+    # more points of f than of u
+    x = np.random.RandomState(1).rand(15)*2*np.pi
+    x_f = np.concatenate((x, x[:4] + 0.1))
+    y_u = np.exp(-0.02)*np.sin(x)
+    y_f = np.sin(x_f)
+    model.set_data(x, y_u, x_f, y_f)
+
+    save_dataset(str(tmpdir), {'x_u': x, 'y_u': y_u, 'x_f': x_f, 'y_f': y_f})
+    chunks = ChunkReader(str(tmpdir), chunk_size=4)
+    assert(len(chunks) == 5)
+
+    values = [1., 1., 0.5]
+    assert(np.allclose(model.nlml_chunks(values, chunks), model.nlml(values)))
+
+    res = model.fit_chunks([1., 1., 0.5], chunks, options={'maxiter': 50})
+    assert(res.fun <= model.nlml(values))
+
+    # the same timings as the in memory evaluations
+    from mlhiphy.trace import Trace
+
+    model.trace = Trace()
+    model.nlml_chunks(values, chunks)
+    model.nlml([1., 1., 0.6])
+    for name in ['t_assembly', 't_factorization', 't_solve']:
+        assert(np.all(model.trace[name] > 0.))
+    assert(np.all(model.trace['condition'] >= 1.))
+    assert(np.allclose(model.trace['jitter'], 1.e-2))
+
+def test_save_load(tmpdir):
+    from mlhiphy.models import save_model
+    from mlhiphy.models import load_model
+
+    model = _heat_model(noise=1.e-2)
+    res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+
+    dirname = str(tmpdir)
+    save_model(model, dirname)
+    loaded = load_model(dirname)
+
+    assert(loaded.params == model.params)
+    assert(loaded.kernels == model.kernels)
+    assert(np.allclose(loaded.values, res.x))
+
+    # the factor is memory-mapped and is not computed again
+    assert(isinstance(loaded.factor.L, np.memmap))
+    assert(loaded.factor_values == model.factor_values)
+    assert(np.allclose(loaded.nlml(res.x), res.fun))
+    assert(isinstance(loaded.factor.L, np.memmap))
+
+    # with Fields
+    F = Field('F')
+    model = _burgers_model(F)
+    x = np.linspace(0., 1., 8)
+    model.set_data(x, x/1.1, x, x, fields={F: x})
+    value = model.nlml([1., 1., 0.5])
+
+    save_model(model, dirname)
+    loaded = load_model(dirname)
+    assert(loaded.fields == (F,))
+    assert(np.allclose(loaded.nlml([1., 1., 0.5]), value))
+
+_load_4d = """
+import sys
+import numpy as np
+from mlhiphy.calculus import PartialDerivative
+from mlhiphy.models import load_model, OperatorGP
+
+model = load_model(sys.argv[1])
+assert(model.expr.atoms(PartialDerivative))
+
+# the loaded operator derives the same kernels
+derived = OperatorGP(model.expr, model.kuu, model._xi, model._xj,
+                     params=model.params, noise=1.e-6)
+derived.set_data(model._x_u, model._y[:4], model._x_f, model._y[4:])
+assert(np.allclose(derived.nlml([1.5]), model.nlml([1.5])))
+"""
+
+def test_save_load_derivatives(tmpdir):
+    import sys
+    import subprocess
+    from mlhiphy.calculus import partial_derivative
+    from mlhiphy.models import save_model
+
+    # an operator created on demand, along the fourth coordinate
+    Xi = Tuple(*symbols('xi yi zi wi'))
+    Xj = Tuple(*symbols('xj yj zj wj'))
+    d3 = partial_derivative(3)
+
+    u = Unknown('u')
+    phi = Constant('phi')
+    kuu = exp(-0.5*sum((a - b)**2 for a, b in zip(Xi, Xj)))
+    model = OperatorGP(phi*u + d3(d3(u)), kuu, Xi, Xj, noise=1.e-6)
+
+    x = np.random.RandomState(0).rand(4, 4)
+    model.set_data(x, np.sin(x[:,3]), x, np.sin(x[:,3]))
+
+    dirname = str(tmpdir)
+    save_model(model, dirname)
+
+    # d3 does not exist in a new process
+    subprocess.check_call([sys.executable, '-c', _load_4d, dirname])
+
+def test_predict():
+    model = _heat_model(noise=1.e-6)
+    res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+
+    x = np.linspace(0.5, 5.5, 101)
+    mean, var = model.predict(x, variance=True, chunk_size=7)
+    assert(np.allclose(mean, model.predict(x, chunk_size=1000)))
+    assert(np.max(np.abs(mean - np.exp(-0.02)*np.sin(x))) < 1.e-2)
+
+    mean_f = model.predict(x, output='f', chunk_size=13)
+    assert(np.max(np.abs(mean_f - np.sin(x))) < 1.e-2)
+
+    # same as the dense formulas, with the data of _heat_model
+    x_d = np.random.RandomState(0).rand(15)*2*np.pi
+    y = np.concatenate((np.exp(-0.02)*np.sin(x_d), np.sin(x_d)))
+
+    K = model.covariance(res.x) + model.factor.jitter*np.eye(30)
+    Ks = np.hstack([model.kernel('uu', res.x, x, x_d),
+                    model.kernel('uf', res.x, x, x_d)])
+    Kss = model.kernel('uu', res.x, x, x)
+    expected = np.diag(Kss - Ks.dot(np.linalg.solve(K, Ks.T)))
+    assert(np.allclose(mean, Ks.dot(np.linalg.solve(K, y)), atol=1.e-6))
+    assert(np.allclose(var, np.maximum(expected, 0.), atol=1.e-6))
+    assert(np.all(var >= 0.))
+
+def test_gaussian_engine():
+    F = Field('F')
+    rng = np.random.RandomState(3)
+    x = rng.rand(7)
+
+    model = _burgers_model(F)
+    reference = OperatorGP(model.expr, model.kuu, symbols('xi'), symbols('xj'),
+                           params=model.params, noise=1.e-2, engine='sympy')
+    assert(model.engine == 'gaussian')
+    assert(reference.engine == 'sympy')
+
+    for m in [model, reference]:
+        m.set_data(x, x/1.1, x[:5], x[:5], fields={F: np.cos(x[:5])})
+
+    values = [0.8, 1.5, 0.5]
+    assert(np.allclose(model.covariance(values), reference.covariance(values)))
+    for dK, dK_ref in zip(model.covariance_gradient(values),
+                          reference.covariance_gradient(values)):
+        assert(np.allclose(dK, dK_ref))
+
+    fields = [np.sin(x)]
+    for name in ['uu', 'ff']:
+        assert(np.allclose(model.kernel_diagonal(name, values, x, fields=fields),
+                           reference.kernel_diagonal(name, values, x,
+                                                     fields=fields)))
+
+    # l given by a length scale, the closed form kernels
+    xi, xj = symbols('xi xj')
+    u = Unknown('u')
+    s = Constant('s')
+    alpha = Constant('alpha')
+    kuu = exp(-(xi - xj)**2/(2*s**2))
+
+    model = OperatorGP(u - alpha*dx(dx(u)), kuu, xi, xj)
+    reference = OperatorGP(u - alpha*dx(dx(u)), kuu, xi, xj, engine='sympy')
+    assert(model.engine == 'gaussian')
+    for m in [model, reference]:
+        m.set_data(x, x, x, x)
+    for dK, dK_ref in zip(model.covariance_gradient([0.4, 0.7]),
+                          reference.covariance_gradient([0.4, 0.7])):
+        assert(np.allclose(dK, dK_ref))
+
+    # other kernels are lambdified
+    kuu = exp(-abs(xi - xj))
+    assert(OperatorGP(u - alpha*dx(u), kuu, xi, xj).engine == 'sympy')
+    try:
+        OperatorGP(u - alpha*dx(u), kuu, xi, xj, engine='gaussian')
+        assert(False)
+    except ValueError:
+        pass
+
+_fit_pickled = """
+import sys
+import pickle
+import numpy as np
+
+with open(sys.argv[1], 'rb') as f:
+    model = pickle.load(f)
+
+res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+x = np.linspace(0.5, 5.5, 11)
+mean = model.predict(x)
+assert(res.success)
+assert(np.max(np.abs(mean - np.exp(-0.02)*np.sin(x))) < 1.e-2)
+assert(not('sympy' in sys.modules))
+"""
+
+def test_fit_without_sympy(tmpdir):
+    import os
+    import sys
+    import pickle
+    import subprocess
+
+    model = _heat_model(noise=1.e-7)
+    filename = os.path.join(str(tmpdir), 'model.pkl')
+    with open(filename, 'wb') as f:
+        pickle.dump(model, f)
+
+    # the closed form kernels are used, nothing is lambdified
+    subprocess.check_call([sys.executable, '-c', _fit_pickled, filename])
+
+    # the expressions are restored on demand
+    with open(filename, 'rb') as f:
+        loaded = pickle.load(f)
+    assert(loaded.expr == model.expr)
+    assert(loaded.params == model.params)
+
+_predict_loaded = """
+import sys
+import numpy as np
+from mlhiphy.models import load_model
+
+model = load_model(sys.argv[1])
+x = np.linspace(0.5, 5.5, 11)
+mean, var = model.predict(x, variance=True)
+mean_f = model.predict(x, output='f', fields={'F': np.cos(x)})
+np.save(sys.argv[2], np.concatenate((mean, var, mean_f)))
+assert(model.engine == 'gaussian')
+assert(not('sympy' in sys.modules))
+"""
+
+def test_load_without_sympy(tmpdir):
+    import os
+    import sys
+    import subprocess
+    from mlhiphy.models import save_model
+    from mlhiphy.models import load_model
+
+    F = Field('F')
+    model = _burgers_model(F)
+    x = np.linspace(0., 1., 8)
+    model.set_data(x, x/1.1, x, x, fields={F: np.cos(x)})
+    model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+
+    dirname = os.path.join(str(tmpdir), 'model')
+    save_model(model, dirname)
+
+    # the operator is numerical, the expressions are metadata
+    filename = os.path.join(str(tmpdir), 'predictions.npy')
+    subprocess.check_call([sys.executable, '-c', _predict_loaded, dirname,
+                           filename])
+
+    x = np.linspace(0.5, 5.5, 11)
+    mean, var = model.predict(x, variance=True)
+    mean_f = model.predict(x, output='f', fields={F: np.cos(x)})
+    assert(np.allclose(np.load(filename), np.concatenate((mean, var, mean_f))))
+
+    loaded = load_model(dirname)
+    assert(loaded.expr == model.expr)
+    assert(loaded.fields == (F,))
+    assert(loaded.kernel_params == model.kernel_params)
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_params()
+    test_covariance_2d()
+    test_nlml_gradient()
+    test_fit()
+    test_linearized_model()
+    test_chunks(tempfile.mkdtemp())
+    test_save_load(tempfile.mkdtemp())
+    test_save_load_derivatives(tempfile.mkdtemp())
+    test_predict()
+    test_gaussian_engine()
+    test_fit_without_sympy(tempfile.mkdtemp())
+    test_load_without_sympy(tempfile.mkdtemp())
@@ -0,0 +1,193 @@
+# coding: utf-8
+import numpy as np
+
+from mlhiphy.optimize import initial_design
+from mlhiphy.optimize import multistart
+from mlhiphy.optimize import backward_euler_steps
+from mlhiphy.optimize import track
+from mlhiphy.optimize import MemoizedNLML
+from mlhiphy.optimize import minimize_checkpointed
+from mlhiphy.tests.test_models import _heat_model
+
+_box = [(0.05, 1.), (0.5, 5.), (0.1, 3.)]
+_bounds = [(1.e-3, None)]*3
+
+def test_initial_design():
+    x0s = initial_design(_box, 8, seed=3)
+
+    assert(x0s.shape == (8, 3))
+    assert(np.allclose(x0s, initial_design(_box, 8, seed=3)))
+    for k, (low, high) in enumerate(_box):
+        assert(np.all(x0s[:,k] >= low) and np.all(x0s[:,k] <= high))
+
+def test_invalid_dimensions():
+    model = _heat_model(noise=1.e-7)
+
+    # caller errors are raised, not recorded as failed runs
+    for kwargs in [{'box': _box[:2]}, {'x0s': [[1., 1.]]}]:
+        try:
+            multistart(model, n_restarts=2, n_jobs=1, **kwargs)
+            assert(False)
+        except ValueError:
+            pass
+
+    try:
+        track(model, [], [1., 1.])
+        assert(False)
+    except ValueError:
+        pass
+
+def test_multistart_serial():
+    model = _heat_model(noise=1.e-7)
+
+    finished = []
+    res = multistart(model, box=_box, n_restarts=3, seed=0, n_jobs=1,
+                     bounds=_bounds, callback=lambda i, r: finished.append(i))
+
+    assert(len(res.runs) == 3)
+    assert(finished == [0, 1, 2])
+    assert(res.fun == min(r.fun for r in res.runs if r.success))
+
+def test_multistart_parallel():
+    model = _heat_model(noise=1.e-7)
+
+    serial = multistart(model, box=_box, n_restarts=4, seed=1, n_jobs=1,
+                        bounds=_bounds)
+    parallel = multistart(model, box=_box, n_restarts=4, seed=1, n_jobs=2,
+                          bounds=_bounds)
+
+    for r1, r2 in zip(serial.runs, parallel.runs):
+        assert(np.allclose(r1.x, r2.x))
+    assert(abs(parallel.x[2] - 1.) < 0.1)
+
+def test_multistart_pruning():
+    model = _heat_model(noise=1.e-7)
+
+    kwargs = dict(box=_box, n_restarts=8, seed=0, n_jobs=1,
+                  method='Nelder-Mead', jac=False, options={'maxiter': 2000})
+
+    full = multistart(model, **kwargs)
+    pruned = multistart(model, check_every=10, margin=5., xtol=1.e-2, **kwargs)
+
+    assert(any(r.pruned for r in pruned.runs))
+    assert(all(not r.success for r in pruned.runs if r.pruned))
+    assert(sum(r.nit for r in pruned.runs) < sum(r.nit for r in full.runs))
+    assert(abs(pruned.fun - full.fun) < 1.e-3)
+
+def test_track():
+    model = _heat_model(noise=1.e-7)
+
+    # u(x, t) = exp(-alpha t) sin(x) with alpha = 1 and tau = 0.02
+    x = np.random.RandomState(2).rand(15)*2*np.pi
+    snapshots = [np.exp(-0.02*n)*np.sin(x) for n in range(0, 6)]
+
+    res = track(model, backward_euler_steps(x, snapshots), [0.5, 2., 0.5],
+                bounds=_bounds)
+
+    assert(res.x.shape == (5, 3))
+    assert(np.all(res.success))
+    assert(np.all(np.abs(res.x[:,2] - 1.) < 0.1))
+    # warm starts need fewer evaluations than the first step
+    assert(all(r.nfev < res.runs[0].nfev for r in res.runs[1:]))
+
+def test_initial_design_quasi_random():
+    log_box = np.log(_box)
+
+    for method in ['sobol', 'lhs']:
+        x0s = initial_design(log_box, 8, seed=0, method=method, log=True)
+
+        assert(x0s.shape == (8, 3))
+        assert(np.allclose(x0s, initial_design(log_box, 8, seed=0,
+                                               method=method, log=True)))
+        for k, (low, high) in enumerate(_box):
+            assert(np.all(x0s[:,k] >= low) and np.all(x0s[:,k] <= high))
+
+    # a Latin hypercube has exactly one point in every stratum
+    x0s = initial_design([(0., 1.)]*2, 10, seed=0, method='lhs')
+    for k in range(0, 2):
+        strata = np.floor(x0s[:,k]*10).astype(int)
+        assert(sorted(strata) == list(range(0, 10)))
+
+def test_memoized_nlml():
+    calls = []
+    def fun(x):
+        calls.append(x)
+        return float(np.sum(x**2)), 2*x
+
+    f = MemoizedNLML(fun, maxsize=2, decimals=8)
+
+    v, g = f(np.array([1., 2.]))
+    g[0] = 100.
+    v, g = f(np.array([1., 2. + 1.e-12]))
+    assert(np.allclose(g, [2., 4.]))
+    assert((f.hits, f.misses) == (1, 1))
+
+    f(np.array([3., 4.]))
+    f(np.array([5., 6.]))
+    assert(len(f) == 2)
+
+    # [1, 2] was evicted
+    f(np.array([1., 2.]))
+    assert((f.hits, f.misses) == (1, 4))
+    assert(len(calls) == 4)
+
+def test_multistart_cache():
+    model = _heat_model(noise=1.e-7)
+
+    # the initial simplex of every segment was already evaluated
+    kwargs = dict(box=_box, n_restarts=2, seed=0, n_jobs=1, check_every=20,
+                  method='Nelder-Mead', jac=False, options={'maxiter': 2000})
+
+    res = multistart(model, **kwargs)
+    cached = multistart(model, cache=256, **kwargs)
+
+    assert(all(r.cache_hits > 0 for r in cached.runs))
+    assert(np.allclose(res.x, cached.x))
+
+def test_minimize_checkpointed(tmpdir):
+    import os
+
+    x0 = [0.5, 2., 0.5]
+    options = {'maxiter': 2000}
+
+    filename = os.path.join(str(tmpdir), 'full.npz')
+    full = minimize_checkpointed(_heat_model(noise=1.e-7), x0, filename, every=20,
+                                 options=options)
+    assert(full.success)
+
+    # the job is stopped after 40 iterations ...
+    filename = os.path.join(str(tmpdir), 'fit.npz')
+    res = minimize_checkpointed(_heat_model(noise=1.e-7), x0, filename, every=20,
+                                options={'maxiter': 40})
+    assert(not res.success)
+    assert(res.nit == 40)
+
+    # ... and resumed by a new process
+    model = _heat_model(noise=1.e-7)
+    res = minimize_checkpointed(model, x0, filename, every=20, cache=64,
+                                options=options)
+    assert(res.success)
+    assert(res.nit == full.nit)
+    assert(np.allclose(res.x, full.x))
+    assert(not(model.factor is None))
+
+    # a finished fit is not run again
+    again = minimize_checkpointed(model, x0, filename, every=20,
+                                  options=options)
+    assert(again.nit == res.nit)
+    assert(np.allclose(again.x, res.x))
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_initial_design()
+    test_invalid_dimensions()
+    test_initial_design_quasi_random()
+    test_multistart_serial()
+    test_multistart_parallel()
+    test_multistart_pruning()
+    test_track()
+    test_memoized_nlml()
+    test_multistart_cache()
+    test_minimize_checkpointed(tempfile.mkdtemp())
@@ -0,0 +1,62 @@
+# coding: utf-8
+import os
+import numpy as np
+
+from mlhiphy.simulate import heat, wave, burgers, backward_euler
+from mlhiphy.simulate import snapshots
+from mlhiphy.simulate import generate
+
+def test_generators():
+    for generator in [heat, wave, burgers, backward_euler]:
+        x_u, y_u, x_f, y_f = generator(np.random.default_rng(0), 50)
+        assert(y_u.shape == (50,) and y_f.shape == (50,))
+        assert(x_u.shape[0] == 50)
+
+        # reproducible
+        again = generator(np.random.default_rng(0), 50)
+        assert(np.array_equal(again[1], y_u))
+
+    # the wave solution satisfies the equation for c = 1
+    X, y_u, X, y_f = wave(np.random.default_rng(1), 10)
+    assert(np.allclose(y_f, 0.))
+    assert(np.allclose(y_u, (X[:,0] - X[:,1])**2 + np.sin(X[:,0] + X[:,1])))
+
+    # backward Euler: u_k = u_{k-1} / (1 + tau alpha)
+    x, y_u, x, y_f = backward_euler(np.random.default_rng(2), 10, tau=0.1, steps=3)
+    assert(np.allclose(y_u*1.1, y_f))
+    assert(np.allclose(y_f*1.1**2, np.sin(x)))
+
+    x, u = snapshots(np.random.default_rng(2), 10, tau=0.1, steps=3)
+    assert(len(u) == 4 and np.allclose(u[3], y_u))
+
+def test_generate(tmpdir):
+    for n in [0, -1]:
+        try:
+            generate('heat', n, seed=3, n_jobs=1)
+            assert(False)
+        except ValueError:
+            pass
+
+    serial = generate('heat', 1000, seed=3, chunk_size=300, n_jobs=1)
+    parallel = generate('heat', 1000, seed=3, chunk_size=300, n_jobs=2)
+
+    assert(serial['x_u'].shape == (1000, 2))
+    for name in ['x_u', 'y_u', 'x_f', 'y_f']:
+        assert(np.array_equal(serial[name], parallel[name]))
+
+    # chunks have different streams
+    assert(not np.array_equal(serial['x_u'][:300], serial['x_u'][300:600]))
+
+    data = generate('burgers', 1000, seed=3, chunk_size=300, n_jobs=2,
+                    directory=os.path.join(str(tmpdir), 'burgers'), tau=0.01)
+    assert(data.attrs['problem'] == 'burgers')
+    assert(data.attrs['tau'] == 0.01)
+    assert(data.coordinates == ['x'])
+    assert(np.allclose(data['y_u'], data['x_u']/1.01))
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_generators()
+    test_generate(tempfile.mkdtemp())
@@ -0,0 +1,124 @@
+# coding: utf-8
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from mlhiphy.store import ResultStore
+from mlhiphy.store import kernel_hash
+from mlhiphy.store import fit_record
+
+def _write(store, k):
+    for i in range(0, 10):
+        store.append({'param': {'alpha': k + 0.1*i}, 'nlml': float(i),
+                      'dataset': 'heat-{}'.format(k)})
+    return os.getpid()
+
+def test_concurrent_writers(tmpdir):
+    store = ResultStore(str(tmpdir))
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        list(executor.map(_write, [store]*4, range(0, 4)))
+
+    assert(len(store) == 40)
+    columns = store.columns(['param.alpha', 'nlml', 'dataset'])
+    assert(columns['nlml'].dtype == float)
+    assert(sorted(columns['param.alpha']) ==
+           sorted(k + 0.1*i for k in range(0, 4) for i in range(0, 10)))
+    assert(sorted(set(columns['dataset'])) == ['heat-0', 'heat-1', 'heat-2', 'heat-3'])
+
+def test_compact(tmpdir):
+    store = ResultStore(str(tmpdir))
+    store.extend([{'nlml': float(i), 'tag': 'a'} for i in range(0, 5)])
+
+    assert(store.compact() == 5)
+    assert(store.compact() == 0)
+
+    # new records and columns after the compaction
+    store.append({'nlml': 5., 'nit': 3})
+
+    # a writer in the middle of a line
+    filename = os.path.join(str(tmpdir), store._shard_name())
+    with open(filename, 'a') as f:
+        f.write('{"nlml": 6.')
+
+    columns = store.columns()
+    assert(list(columns['nlml']) == [0., 1., 2., 3., 4., 5.])
+    assert(list(columns['tag']) == ['a']*5 + [None])
+    assert(np.isnan(columns['nit'][0]) and columns['nit'][5] == 3.)
+
+    assert(store.compact() == 1)
+    assert(len(store) == 6)
+    assert(store.records()[5]['nit'] == 3.)
+
+def test_columns(tmpdir):
+    store = ResultStore(str(tmpdir))
+    store.extend([{'nlml': float(i), 'success': i > 1} for i in range(0, 4)])
+    store.compact()
+    store.extend([{'nlml': 4., 'success': True, 'tag': 'b'}])
+
+    # only the given columns, booleans are kept
+    columns = store.columns(['success', 'tag'])
+    assert(sorted(columns.keys()) == ['success', 'tag'])
+    assert(columns['success'].dtype == bool)
+    assert(list(columns['success']) == [False, False, True, True, True])
+    assert(list(columns['tag']) == [None]*4 + ['b'])
+
+    store.compact()
+    columns = store.columns(['nlml', 'success', 'nit'])
+    assert(list(columns['nlml']) == [0., 1., 2., 3., 4.])
+    assert(columns['success'].dtype == bool)
+    assert(columns['nit'].dtype == float and np.isnan(columns['nit']).all())
+
+def test_round_trip(tmpdir):
+    import json
+
+    store = ResultStore(str(tmpdir))
+    store.extend([{'nlml': 1., 'nit': 3, 'success': True, 'tag': 'a'},
+                  {'nlml': float('nan'), 'nit': 0, 'success': False,
+                   'tag': float('nan')},
+                  {'nlml': 2., 'message': None},
+                  {'tag': None, 'x': [1, 2]}])
+
+    # the records are the same before and after the compaction, real nan
+    # and None values are kept, missing keys are absent
+    before = json.dumps(store.records(), sort_keys=True)
+    assert(store.compact() == 4)
+    assert(json.dumps(store.records(), sort_keys=True) == before)
+
+    records = store.records()
+    assert(np.isnan(records[1]['nlml']))
+    assert(records[2]['message'] is None and not('nit' in records[2]))
+    assert(records[0]['nit'] == 3 and isinstance(records[0]['nit'], int))
+
+    columns = store.columns(['nlml', 'tag', 'success', 'nit'])
+    assert(np.isnan(columns['nlml'][1]) and np.isnan(columns['nlml'][3]))
+    assert(columns['tag'][0] == 'a' and np.isnan(columns['tag'][1]))
+    assert(columns['tag'][2] is None and columns['tag'][3] is None)
+    assert(list(columns['nit'][:2]) == [3., 0.] and np.isnan(columns['nit'][2]))
+    assert(columns['success'][0] == 1. and np.isnan(columns['success'][3]))
+
+def test_fit_record(tmpdir):
+    from mlhiphy.tests.test_models import _heat_model
+
+    model = _heat_model(noise=1.e-2)
+    res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+
+    store = ResultStore(str(tmpdir))
+    store.append(fit_record(model, res, dataset='heat', t_fit=0.1))
+
+    columns = store.columns()
+    assert(np.allclose(columns['param.alpha'], res.x[2]))
+    assert(columns['kernel_hash'][0] == kernel_hash(*[model.kernels[k] for k in
+                                                      sorted(model.kernels)]))
+    assert(columns['dataset'][0] == 'heat')
+    assert(columns['success'].dtype == bool and columns['success'][0])
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_concurrent_writers(tempfile.mkdtemp())
+    test_compact(tempfile.mkdtemp())
+    test_columns(tempfile.mkdtemp())
+    test_round_trip(tempfile.mkdtemp())
+    test_fit_record(tempfile.mkdtemp())
@@ -0,0 +1,80 @@
+# coding: utf-8
+import os
+import numpy as np
+
+from mlhiphy.sweep import grid
+from mlhiphy.sweep import run_sweep
+from mlhiphy.sweep import read_records
+from mlhiphy.store import ResultStore
+
+def _fit(tau, n, seed):
+    if n < 0:
+        raise ValueError('n must be positive')
+
+    rng = np.random.default_rng(seed)
+    x = rng.random(n)
+    return {'mean': x.mean() * tau, 'n': n}
+
+def test_grid():
+    cells = grid(tau=[0.01, 0.02], n=[10, 20, 30], seed=[0])
+
+    assert(len(cells) == 6)
+    assert(cells[0] == {'tau': 0.01, 'n': 10, 'seed': 0})
+    assert(cells[-1] == {'tau': 0.02, 'n': 30, 'seed': 0})
+
+def test_run_sweep(tmpdir):
+    filename = os.path.join(str(tmpdir), 'sweep.jsonl')
+    cells = grid(tau=[0.01, 0.02], n=[10, 20], seed=[0, 1])
+
+    # a first, interrupted, sweep
+    records = run_sweep(_fit, cells[:3], filename, n_jobs=1)
+    assert(len(records) == 3)
+
+    new = []
+    records = run_sweep(_fit, cells, filename, n_jobs=2,
+                        callback=lambda r: new.append(r))
+
+    assert(len(new) == 5)
+    assert(len(records) == 8)
+    assert([r['cell'] for r in records] == cells)
+    assert(len(read_records(filename)) == 8)
+
+    r = records[5]
+    expected = _fit(**r['cell'])
+    assert(np.allclose(r['result']['mean'], expected['mean']))
+
+def test_run_sweep_errors(tmpdir):
+    filename = os.path.join(str(tmpdir), 'sweep.jsonl')
+    cells = grid(tau=[0.01], n=[-1, 10], seed=[0])
+
+    records = run_sweep(_fit, cells, filename, n_jobs=1)
+    assert(len(records) == 1)
+
+    errors = [r for r in read_records(filename) if r['error']]
+    assert(len(errors) == 1)
+    assert('n must be positive' in errors[0]['error'])
+
+    # failed cells are run again
+    run_sweep(_fit, cells, filename, n_jobs=1)
+    assert(len(read_records(filename)) == 3)
+
+def test_run_sweep_store(tmpdir):
+    filename = os.path.join(str(tmpdir), 'sweep.jsonl')
+    store = ResultStore(os.path.join(str(tmpdir), 'results'))
+    cells = grid(tau=[0.01, 0.02], n=[-1, 10, 20], seed=[0])
+
+    run_sweep(_fit, cells, filename, n_jobs=2, store=store)
+
+    # only the finished cells
+    columns = store.columns(['cell.tau', 'cell.n', 'result.mean'])
+    assert(sorted(columns['cell.n']) == [10., 10., 20., 20.])
+    assert(np.all(columns['result.mean'] > 0.))
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_grid()
+    test_run_sweep(tempfile.mkdtemp())
+    test_run_sweep_errors(tempfile.mkdtemp())
+    test_run_sweep_store(tempfile.mkdtemp())
@@ -0,0 +1,61 @@
+# coding: utf-8
+import os
+import numpy as np
+
+from mlhiphy.trace import Trace
+
+def test_ring_buffer():
+    trace = Trace(capacity=4, names=['a', 'b'])
+    for i in range(0, 6):
+        trace.record([i, 2*i], float(i), jitter=1.e-8)
+
+    assert(len(trace) == 4)
+    assert(trace.count == 6)
+
+    d = trace.as_dict()
+    assert(list(d['evaluation']) == [2, 3, 4, 5])
+    assert(list(d['a']) == [2., 3., 4., 5.])
+    assert(list(d['b']) == [4., 6., 8., 10.])
+    assert(list(d['value']) == [2., 3., 4., 5.])
+    assert(np.allclose(trace.params[0], [2., 4.]))
+
+def test_export(tmpdir):
+    trace = Trace()
+    for i in range(0, 3):
+        trace.record([i], float(i), t_assembly=0.1, t_factorization=0.2,
+                     t_solve=0.3, condition=10.)
+
+    filename = os.path.join(str(tmpdir), 'trace.csv')
+    trace.to_csv(filename)
+    data = np.genfromtxt(filename, delimiter=',', names=True)
+    assert(list(data['p0']) == [0., 1., 2.])
+    assert(np.allclose(data['t_factorization'], 0.2))
+
+    filename = os.path.join(str(tmpdir), 'trace.npz')
+    trace.to_npz(filename)
+    data = np.load(filename)
+    assert(list(data['value']) == [0., 1., 2.])
+    assert(np.allclose(data['condition'], 10.))
+
+def test_model_trace():
+    from mlhiphy.tests.test_models import _heat_model
+
+    trace = Trace()
+    model = _heat_model(noise=1.e-7, trace=trace)
+
+    res = model.fit([1., 1., 0.5], bounds=[(1.e-3, None)]*3)
+
+    assert(trace.count == res.nfev)
+    assert(trace.names == ['l', 'theta', 'alpha'])
+    assert(np.all(trace['jitter'] >= 1.e-7))
+    assert(np.all(trace['condition'] >= 1.))
+    assert(np.all(trace['t_factorization'] >= 0.))
+    assert(np.allclose(trace['value'].min(), res.fun))
+
+#############################################
+if __name__ == '__main__':
+    import tempfile
+
+    test_ring_buffer()
+    test_export(tempfile.mkdtemp())
+    test_model_trace()
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import numpy as np
+
+
+_columns = ('value', 't_assembly', 't_factorization', 't_solve', 'jitter',
+            'condition')
+
+# ...
+class Trace(object):
+    """
+    Records every evaluation of the negative log marginal likelihood in a ring
+    buffer: the hyperparameters, the value, the wall time spent in the
+    assembly, the factorization and the solve, the jitter and an estimate of
+    the condition number.
+
+    Only the last capacity evaluations are kept, the arrays are allocated at
+    the first record.
+
+    Examples
+
+    >>> model.trace = Trace()
+    >>> model.fit(x0)
+    >>> model.trace.to_csv('fit.csv')
+    """
+
+    def __init__(self, capacity=10000, names=None):
+        self._capacity = capacity
+        self._count = 0
+        self._params = None
+        self._data = None
+        self.names = names
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        """total number of recorded evaluations."""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def clear(self):
+        self._count = 0
+
+    def record(self, params, value, t_assembly=0., t_factorization=0.,
+               t_solve=0., jitter=0., condition=np.nan):
+        if self._params is None:
+            self._params = np.zeros((self._capacity, len(params)))
+            self._data = np.zeros((self._capacity, len(_columns)))
+
+        i = self._count % self._capacity
+        self._params[i] = params
+        self._data[i] = (value, t_assembly, t_factorization, t_solve, jitter,
+                         condition)
+        self._count += 1
+
+    def _order(self):
+        n = len(self)
+        if self._count <= self._capacity:
+            return np.arange(0, n)
+        start = self._count % self._capacity
+        return np.roll(np.arange(0, n), -start)
+
+    def _names(self):
+        if self._params is None:
+            return []
+        if self.names is None:
+            return ['p{}'.format(i) for i in range(self._params.shape[1])]
+        return list(self.names)
+
+    @property
+    def params(self):
+        """hyperparameters of the recorded evaluations, oldest first."""
+        if self._params is None:
+            return np.zeros((0, 0))
+        return self._params[self._order()]
+
+    def as_dict(self):
+        """returns the recorded columns, oldest first."""
+        d = {}
+        if self._data is None:
+            return d
+
+        order = self._order()
+        d['evaluation'] = self._count - len(self) + np.arange(0, len(self))
+        for k, name in enumerate(self._names()):
+            d[name] = self._params[order,k]
+        for k, name in enumerate(_columns):
+            d[name] = self._data[order,k]
+        return d
+
+    def __getitem__(self, name):
+        return self.as_dict()[name]
+
+    def to_npz(self, filename):
+        np.savez(filename, **self.as_dict())
+
+    def to_csv(self, filename):
+        d = self.as_dict()
+        names = list(d.keys())
+        data = np.column_stack([d[name] for name in names]) if d else []
+        np.savetxt(filename, data, delimiter=',', header=','.join(names),
+                   comments='')
+# ...
@@ -0,0 +1,38 @@
+# coding: utf-8
+
+# JSON helpers shared by the on disk formats (dataset) and the sweeps.
+
+import os
+import json
+import numpy as np
+
+
+# ...
+def to_json(value):
+    """
+    returns value with numpy arrays and scalars converted to lists and python
+    numbers, and the keys of dictionaries converted to strings. Values that
+    JSON cannot represent are converted to strings.
+    """
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return to_json(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+def write_json(filename, data):
+    """writes data to filename atomically: a temporary file is synced to the
+    disk, then renamed."""
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+# ...